@@ -1,16 +1,78 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-from flask_socketio import SocketIO, emit, disconnect
 import os
+
+# Режим сервера SocketIO: threading (поток ОС на клиента), eventlet или gevent
+# (зеленые потоки, тысячи клиентов в одном процессе). Для eventlet/gevent
+# стандартная библиотека патчится до импорта остальных модулей, поэтому сокеты,
+# subprocess и time.sleep становятся кооперативными.
+SOCKETIO_ASYNC_MODES = ('threading', 'eventlet', 'gevent')
+SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE', 'threading')
+if SOCKETIO_ASYNC_MODE not in SOCKETIO_ASYNC_MODES:
+    raise ValueError(f"SOCKETIO_ASYNC_MODE: ожидается одно из {', '.join(SOCKETIO_ASYNC_MODES)}, "
+                     f"получено {SOCKETIO_ASYNC_MODE!r}")
+if SOCKETIO_ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif SOCKETIO_ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+from flask import (Flask, render_template, request, redirect, url_for, session, flash, jsonify, g,
+                   Response, stream_with_context, has_request_context)
+from markupsafe import Markup
+from flask_socketio import SocketIO, emit, disconnect, join_room
 import time
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from datetime import datetime, timedelta
 from functools import wraps
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 import subprocess
 import platform
+import tempfile
+import shutil
+import errno
+import stat
+import socket
+import base64
+import hashlib
+import gzip
+import hmac
+import http.client
+from urllib.parse import urlparse
 import uuid
+import sqlite3
+import sys
+import atexit
 import threading
+import queue
 import json
+import csv
+import re
+import glob
+import bisect
+import ctypes
+import ctypes.util
+import select
+import struct
+import click
+import urllib.request
+
+try:
+    import bcrypt
+except ImportError:  # bcrypt необязателен: нужен только для хэшей $2a$/$2b$/$2y$
+    bcrypt = None
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен: без него ответы сжимаются только gzip
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессных блокировок нет, работает только один процесс
+    fcntl = None
 
 app = Flask(__name__)
 
@@ -30,9 +92,39 @@ app.secret_key = os.environ.get('SECRET_KEY', 'dev-key-change-in-production-' +
 app.permanent_session_lifetime = timedelta(hours=8)  # Сессия истекает через 8 часов
 
 # Инициализация SocketIO
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=SOCKETIO_ASYNC_MODE)
 shiro_ini_path = 'shiro.ini'
 
+# Предел одновременных соединений сервера eventlet (по умолчанию у eventlet.wsgi - 1024)
+SOCKETIO_MAX_CONNECTIONS = int(os.environ.get('SOCKETIO_MAX_CONNECTIONS', 10000))
+
+
+def socketio_server_options():
+    """Параметры socketio.run() для выбранного режима сервера"""
+    options = {'allow_unsafe_werkzeug': True}
+    if SOCKETIO_ASYNC_MODE == 'eventlet':
+        options['max_size'] = SOCKETIO_MAX_CONNECTIONS
+    return options
+
+
+def run_blocking(func, *args, **kwargs):
+    """
+    Выполняет блокирующий вызов (разбор и запись shiro.ini, хэширование паролей,
+    SQLite) так, чтобы он не останавливал цикл событий
+
+    В режиме threading вызов выполняется как есть. В режимах eventlet/gevent
+    он уходит в пул настоящих потоков ОС, а текущий зеленый поток ждет
+    результат, не блокируя остальных клиентов. Сокеты и subprocess в этих
+    режимах уже кооперативны благодаря monkey patching.
+    """
+    if SOCKETIO_ASYNC_MODE == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(func, *args, **kwargs)
+    if SOCKETIO_ASYNC_MODE == 'gevent':
+        import gevent
+        return gevent.get_hub().threadpool.apply(func, args, kwargs)
+    return func(*args, **kwargs)
+
 # Добавляем версию в контекст всех шаблонов
 @app.context_processor
 def inject_version():
@@ -81,7 +173,6 @@ def detect_zeppelin_installation():
         '../zeppelin/bin/zeppelin-daemon.sh'
     ]
     
-    import glob
     for path_pattern in common_paths:
         matches = glob.glob(path_pattern)
         if matches:
@@ -97,10 +188,13 @@ def detect_zeppelin_installation():
     return {'type': 'unknown', 'available': False}
 
 
-def get_system_info():
+def _detect_system_info():
     """
     Определяет операционную систему и команды управления сервисами
     
+    Запускает systemctl, перебирает возможные пути zeppelin-daemon.sh и читает
+    /etc/os-release, поэтому вызывается только через кэш SystemInfo.
+    
     Returns:
         dict: Информация о системе и командах
     """
@@ -211,11 +305,333 @@ def get_system_info():
             'commands': {}
         }
 
+class SystemInfo:
+    """
+    Кэш результата определения системы и способа установки Zeppelin
+
+    Определение выполняется один раз (при старте или первом обращении) и
+    повторяется только явно через refresh() или если закэшированный
+    zeppelin-daemon.sh перестал существовать.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._info = None
+        self.detected_at = None
+        self.detection_seconds = None
+
+    def get(self):
+        """
+        Возвращает закэшированную информацию о системе
+
+        Returns:
+            dict: Информация о системе и командах (см. _detect_system_info)
+        """
+        info = self._info
+        if info is None:
+            return self._refresh_unless_changed(None)
+        daemon_path = info.get('daemon_path')
+        if daemon_path and not os.path.exists(daemon_path):
+            logger.warning(f"zeppelin-daemon.sh больше не найден по пути {daemon_path}, определяем установку заново")
+            return self._refresh_unless_changed(info)
+        return info
+
+    def refresh(self):
+        """
+        Заново определяет систему и способ установки Zeppelin
+
+        Returns:
+            dict: Новая информация о системе
+        """
+        with self._lock:
+            return self._detect()
+
+    def _refresh_unless_changed(self, stale):
+        # Одновременные первые запросы ждут одно определение: проверка повторяется под блокировкой
+        with self._lock:
+            if self._info is not stale:
+                return self._info
+            return self._detect()
+
+    def _detect(self):
+        started = time.monotonic()
+        info = _detect_system_info()
+        self.detection_seconds = time.monotonic() - started
+        self.detected_at = datetime.now()
+        self._info = info
+        logger.info(f"Определение установки Zeppelin: {info['zeppelin_type']} ({info['service_manager']}), "
+                    f"заняло {self.detection_seconds * 1000:.1f} мс")
+        return info
+
+    def describe(self):
+        """Возвращает информацию о системе вместе с данными об определении"""
+        info = self.get()
+        return {
+            **info,
+            'detected_at': self.detected_at.isoformat() if self.detected_at else None,
+            'detection_ms': round(self.detection_seconds * 1000, 1) if self.detection_seconds is not None else None
+        }
+
+
+system_info_cache = SystemInfo()
+
+
+def get_system_info():
+    """
+    Возвращает информацию о системе и командах управления сервисами из кэша
+    
+    Returns:
+        dict: Информация о системе и командах
+    """
+    return system_info_cache.get()
+
+
 # Настройка логирования с ротацией
+# Размер очереди записей лога; при переполнении записи отбрасываются и считаются
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+# Дополнительно писать события аудита в logs/audit.jsonl (одна JSON-строка на событие)
+AUDIT_LOG_JSON = os.environ.get('AUDIT_LOG_JSON', '').lower() in ('1', 'true', 'yes')
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler с ограниченной очередью
+
+    Поток запроса только кладет запись в очередь. Если обработчик файлов не
+    успевает (например, диск завис), запись отбрасывается без блокировки,
+    а счетчик dropped увеличивается.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+        self.listener = None
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+
+class AuditRecordFilter(logging.Filter):
+    """Пропускает только записи аудита (с атрибутом audit из log_user_action)"""
+
+    def filter(self, record):
+        return hasattr(record, 'audit')
+
+
+class JsonAuditFormatter(logging.Formatter):
+    """Форматирует запись аудита как JSON-строку с полями action, actor, target, ip, ts"""
+
+    def format(self, record):
+        return json.dumps(record.audit, ensure_ascii=False)
+
+
+# Каталог журналов приложения (app.log, audit.jsonl и по умолчанию audit.db)
+LOG_DIR = os.environ.get('LOG_DIR', 'logs')
+# Путь к SQLite-хранилищу аудита (пустая строка отключает хранилище)
+AUDIT_DB_PATH = os.environ.get('AUDIT_DB_PATH', os.path.join(LOG_DIR, 'audit.db'))
+# Срок хранения событий аудита в днях (0 - хранить бессрочно)
+AUDIT_RETENTION_DAYS = int(os.environ.get('AUDIT_RETENTION_DAYS', '365'))
+# Как часто поток логирования запускает очистку старых событий (секунды)
+AUDIT_COMPACT_INTERVAL = int(os.environ.get('AUDIT_COMPACT_INTERVAL', '3600'))
+AUDIT_PAGE_MAX = 500
+
+
+class AuditStore:
+    """
+    Хранилище событий аудита в SQLite
+
+    Пишет один поток (QueueListener через AuditStoreHandler), читают потоки
+    запросов - у каждого свое соединение. Индексы (поле, ts) позволяют
+    выбирать страницу событий по actor/target/action или по диапазону
+    времени без полного просмотра таблицы; пагинация - по курсору (ts, id),
+    поэтому глубокие страницы не замедляются.
+    """
+
+    FILTERS = ('actor', 'target', 'action')
+
+    def __init__(self, path, retention_days=AUDIT_RETENTION_DAYS):
+        self.path = path
+        self.retention_days = retention_days
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._writer = sqlite3.connect(path, check_same_thread=False)
+        # auto_vacuum действует только для новой базы и должен быть задан до создания таблиц
+        self._writer.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        self._writer.execute('PRAGMA journal_mode=WAL')
+        self._writer.execute('PRAGMA synchronous=NORMAL')
+        self._writer.executescript('''
+            CREATE TABLE IF NOT EXISTS audit_events (
+                id INTEGER PRIMARY KEY,
+                ts REAL NOT NULL,
+                action TEXT NOT NULL,
+                actor TEXT,
+                target TEXT,
+                ip TEXT,
+                details TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_audit_ts ON audit_events (ts);
+            CREATE INDEX IF NOT EXISTS idx_audit_actor_ts ON audit_events (actor, ts);
+            CREATE INDEX IF NOT EXISTS idx_audit_target_ts ON audit_events (target, ts);
+            CREATE INDEX IF NOT EXISTS idx_audit_action_ts ON audit_events (action, ts);
+        ''')
+        self._writer.commit()
+        self.last_compaction = time.monotonic()
+
+    def _reader(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path)
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+        return connection
+
+    def record(self, ts, action, actor=None, target=None, ip=None, details=None):
+        """Сохраняет событие (ts - Unix-время в секундах)"""
+        self.record_many([(ts, action, actor, target, ip, details)])
+
+    def record_many(self, rows):
+        """Сохраняет события кортежами (ts, action, actor, target, ip, details) одной транзакцией"""
+        with self._write_lock:
+            self._writer.executemany(
+                'INSERT INTO audit_events (ts, action, actor, target, ip, details) VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._writer.commit()
+
+    def query(self, actor=None, target=None, action=None, since=None, until=None, cursor=None, limit=50):
+        """
+        Возвращает страницу событий от новых к старым
+
+        Args:
+            actor, target, action (str): Точные фильтры
+            since, until (float): Границы по времени (Unix-время, until не включается)
+            cursor (str): Курсор 'ts:id' из next_cursor предыдущей страницы
+            limit (int): Размер страницы (не больше AUDIT_PAGE_MAX)
+
+        Returns:
+            dict: {'events': [...], 'next_cursor': str | None}
+        """
+        limit = max(1, min(int(limit), AUDIT_PAGE_MAX))
+        conditions, params = [], []
+        for name, value in (('actor', actor), ('target', target), ('action', action)):
+            if value:
+                conditions.append(f'{name} = ?')
+                params.append(value)
+        if since is not None:
+            conditions.append('ts >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('ts < ?')
+            params.append(until)
+        if cursor:
+            cursor_ts, cursor_id = cursor.split(':', 1)
+            conditions.append('(ts < ? OR (ts = ? AND id < ?))')
+            params.extend([float(cursor_ts), float(cursor_ts), int(cursor_id)])
+
+        sql = 'SELECT id, ts, action, actor, target, ip, details FROM audit_events'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY ts DESC, id DESC LIMIT ?'
+        rows = self._reader().execute(sql, params + [limit + 1]).fetchall()
+
+        events = [{
+            'id': row['id'],
+            'ts': datetime.fromtimestamp(row['ts']).isoformat(timespec='milliseconds'),
+            'action': row['action'],
+            'actor': row['actor'],
+            'target': row['target'],
+            'ip': row['ip'],
+            'details': row['details'],
+        } for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = f"{last['ts']!r}:{last['id']}"
+        return {'events': events, 'next_cursor': next_cursor}
+
+    def compact(self, now=None, batch_size=10000):
+        """
+        Удаляет события старше срока хранения порциями и освобождает место в файле
+
+        Returns:
+            int: Количество удаленных событий
+        """
+        self.last_compaction = time.monotonic()
+        if self.retention_days <= 0:
+            return 0
+        cutoff = (now or time.time()) - self.retention_days * 86400
+        deleted = 0
+        with self._write_lock:
+            while True:
+                cursor = self._writer.execute(
+                    'DELETE FROM audit_events WHERE id IN '
+                    '(SELECT id FROM audit_events WHERE ts < ? ORDER BY ts LIMIT ?)', (cutoff, batch_size))
+                self._writer.commit()
+                deleted += cursor.rowcount
+                if cursor.rowcount < batch_size:
+                    break
+            if deleted:
+                self._writer.execute('PRAGMA incremental_vacuum')
+                self._writer.execute('PRAGMA optimize')
+        return deleted
+
+    def count(self):
+        return self._reader().execute('SELECT COUNT(*) FROM audit_events').fetchone()[0]
+
+
+class AuditStoreHandler(logging.Handler):
+    """Пишет записи аудита из потока QueueListener в AuditStore и периодически чистит его"""
+
+    def __init__(self, store, compact_interval=AUDIT_COMPACT_INTERVAL):
+        super().__init__()
+        self.store = store
+        self.compact_interval = compact_interval
+        self.addFilter(AuditRecordFilter())
+
+    def emit(self, record):
+        try:
+            audit = record.audit
+            run_blocking(self.store.record, record.created, audit['action'], audit['actor'],
+                         audit['target'], audit['ip'], audit.get('details'))
+            if time.monotonic() - self.store.last_compaction > self.compact_interval:
+                run_blocking(self.store.compact)
+        except Exception:
+            self.handleError(record)
+
+
+def open_audit_store(path=AUDIT_DB_PATH):
+    """
+    Открывает хранилище аудита
+
+    Returns:
+        AuditStore | None: None если хранилище отключено или недоступно
+    """
+    if not path:
+        return None
+    try:
+        return AuditStore(path)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Хранилище аудита {path} недоступно: {e}", file=sys.stderr)
+        return None
+
+
 def setup_logging():
-    """Настраивает логирование с ротацией файлов"""
+    """
+    Настраивает логирование с ротацией файлов
+
+    Записи проходят через ограниченную очередь: запись в файл, вывод в консоль
+    и ротация выполняются в отдельном потоке QueueListener.
+
+    Returns:
+        tuple: (logger, DroppingQueueHandler)
+    """
     # Создаем директорию для логов если её нет
-    log_dir = 'logs'
+    log_dir = LOG_DIR
     if not os.path.exists(log_dir):
         os.makedirs(log_dir)
     
@@ -239,17 +655,217 @@ def setup_logging():
     
     file_handler.setFormatter(formatter)
     console_handler.setFormatter(formatter)
+    handlers = [file_handler, console_handler]
+
+    if AUDIT_LOG_JSON:
+        audit_handler = RotatingFileHandler(
+            filename=os.path.join(log_dir, 'audit.jsonl'),
+            maxBytes=10*1024*1024,
+            backupCount=5,
+            encoding='utf-8'
+        )
+        audit_handler.addFilter(AuditRecordFilter())
+        audit_handler.setFormatter(JsonAuditFormatter())
+        handlers.append(audit_handler)
+
+    if audit_store is not None:
+        handlers.append(AuditStoreHandler(audit_store))
+
+    # Потоки запросов только кладут записи в очередь, ввод-вывод делает QueueListener
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    queue_handler.listener = listener
+    listener.start()
+    # При завершении процесса дописываем оставшиеся в очереди записи
+    atexit.register(listener.stop)
     
     # Настраиваем logger
     logger = logging.getLogger(__name__)
     logger.setLevel(logging.INFO)
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    logger.addHandler(queue_handler)
     
-    return logger
+    return logger, queue_handler
+
+# Инициализируем хранилище аудита и логирование
+audit_store = open_audit_store()
+logger, log_queue_handler = setup_logging()
+
+
+@app.before_request
+def start_request_timer():
+    """Запоминает время начала запроса для метрик"""
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """Учитывает длительность и код ответа запроса в метриках"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint, request.method)
+        HTTP_REQUESTS.inc(endpoint, request.method, str(response.status_code))
+    return response
+
+
+# Сжатие ответов: HTML/JSON/CSS/JS не меньше COMPRESS_MIN_SIZE байт (0 - отключено)
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+    'application/json', 'image/svg+xml',
+}
+# Статика с отпечатком содержимого в URL кэшируется браузером на год
+STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Сторонние библиотеки: закрепленные версии хранятся в static/vendor (см. static/vendor/README.md).
+# URL - источник файла для flask --app app vendor-assets
+VENDOR_ASSETS = {
+    'bootstrap.css': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
+    'popper.js': 'https://cdn.jsdelivr.net/npm/@popperjs/core@2.11.8/dist/umd/popper.min.js',
+    'bootstrap.js': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.min.js',
+    'socket.io.js': 'https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.7.2/socket.io.min.js',
+}
+# Загружать библиотеку с CDN, если локального файла нет (по умолчанию страницы не обращаются к внешним адресам)
+VENDOR_CDN_FALLBACK = os.environ.get('VENDOR_CDN_FALLBACK', '').lower() in ('1', 'true', 'yes')
+
+_static_hashes = {}      # filename -> ((mtime_ns, size), отпечаток)
+_static_compressed = {}  # (filename, отпечаток, кодировка) -> сжатое содержимое
+
+
+def static_asset_hash(filename):
+    """
+    Отпечаток содержимого статического файла, пересчитывается при изменении mtime/размера
+
+    Args:
+        filename (str): Путь внутри static/
+
+    Returns:
+        str: Первые 12 символов SHA-256 или None, если файла нет
+    """
+    path = os.path.join(app.static_folder, filename)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _static_hashes.get(filename)
+    if cached and cached[0] == key:
+        return cached[1]
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    _static_hashes[filename] = (key, digest)
+    return digest
+
+
+def vendor_filename(name):
+    """Имя файла библиотеки внутри static/"""
+    return 'vendor/' + VENDOR_ASSETS[name].rsplit('/', 1)[-1]
+
+
+def vendor_url(name):
+    """
+    URL сторонней библиотеки из static/vendor
+
+    CDN используется только при VENDOR_CDN_FALLBACK и отсутствии локального файла.
+
+    Args:
+        name (str): Ключ VENDOR_ASSETS
+
+    Returns:
+        str: URL для шаблона
+    """
+    filename = vendor_filename(name)
+    if VENDOR_CDN_FALLBACK and not os.path.isfile(os.path.join(app.static_folder, filename)):
+        return VENDOR_ASSETS[name]
+    return url_for('static', filename=filename)
+
 
-# Инициализируем логирование
-logger = setup_logging()
+app.jinja_env.globals['vendor_url'] = vendor_url
+
+
+@app.url_defaults
+def add_static_fingerprint(endpoint, values):
+    """Добавляет отпечаток содержимого в URL статики: url_for('static', ...) -> ?v=<hash>"""
+    if endpoint == 'static' and 'v' not in values:
+        digest = static_asset_hash(values.get('filename', ''))
+        if digest:
+            values['v'] = digest
+
+
+def choose_encoding():
+    """Выбирает кодировку сжатия по Accept-Encoding: br (если доступен brotli) или gzip"""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_bytes(data, encoding):
+    """Сжимает данные в выбранной кодировке"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(COMPRESS_LEVEL, 11))
+    return gzip.compress(data, compresslevel=COMPRESS_LEVEL, mtime=0)
+
+
+@app.after_request
+def compress_response(response):
+    """
+    Сжимает текстовые ответы и выставляет заголовки кэширования статики
+
+    Статика с актуальным отпечатком (?v=) получает immutable на год. Сжатые
+    версии статических файлов кэшируются в памяти по отпечатку, динамические
+    ответы сжимаются на каждый запрос. Потоковые ответы, частичные запросы и
+    уже сжатые ответы не трогаются.
+    """
+    is_static = request.endpoint == 'static'
+    if is_static and response.status_code in (200, 304):
+        filename = request.view_args.get('filename', '')
+        version = request.args.get('v')
+        if version and version == static_asset_hash(filename):
+            response.cache_control.public = True
+            response.cache_control.max_age = STATIC_IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+
+    if (not COMPRESS_MIN_SIZE or response.status_code != 200 or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES or 'Range' in request.headers):
+        return response
+    if response.is_streamed and not is_static:
+        return response
+    length = response.calculate_content_length()
+    if length is not None and length < COMPRESS_MIN_SIZE:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+
+    if is_static:
+        filename = request.view_args.get('filename', '')
+        key = (filename, static_asset_hash(filename), encoding)
+        body = _static_compressed.get(key)
+        if body is None:
+            with open(os.path.join(app.static_folder, filename), 'rb') as f:
+                body = compress_bytes(f.read(), encoding)
+            _static_compressed[key] = body
+        # Тело из файла больше не нужно: отдаем сжатую копию
+        response.close()
+        response.direct_passthrough = False
+        etag, _ = response.get_etag()
+        if etag:
+            response.set_etag(etag, weak=True)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        body = compress_bytes(data, encoding)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
 
 
 @app.before_request
@@ -277,6 +893,19 @@ def check_session_timeout():
         # Обновляем время последней активности
         session['last_activity'] = datetime.now().isoformat()
         session.permanent = True
+        # Идентификатор сессии браузера для адресных событий SocketIO (session_room)
+        session.setdefault('client_id', uuid.uuid4().hex)
+
+
+def session_room():
+    """
+    Комната SocketIO текущей сессии браузера (все ее вкладки)
+
+    Returns:
+        str | None: Имя комнаты или None, если у сессии еще нет client_id
+    """
+    client_id = session.get('client_id')
+    return f'session:{client_id}' if client_id else None
 
 
 def login_required(f):
@@ -309,7 +938,7 @@ def validate_input(data, field_name, min_length=1, max_length=50):
     return True, data
 
 
-def log_user_action(action, username, details=None):
+def log_user_action(action, username, details=None, client_ip=None, target=None):
     """
     Логирует действия пользователей
     
@@ -317,174 +946,1780 @@ def log_user_action(action, username, details=None):
         action (str): Тип действия
         username (str): Имя пользователя
         details (str): Дополнительные детали
+        client_ip (str): IP клиента, если действие выполняется вне запроса (фоновые задачи)
+        target (str): Объект действия (пользователь или роль), попадает в JSON-аудит
     """
-    client_ip = request.remote_addr if request else 'unknown'
+    client_ip = client_ip or (request.remote_addr if request else 'unknown')
     log_message = f"User: {username}, Action: {action}, IP: {client_ip}"
     if details:
         log_message += f", Details: {details}"
-    logger.info(log_message)
+    audit = {
+        'action': action,
+        'actor': username,
+        'target': target,
+        'ip': client_ip,
+        'ts': datetime.now().isoformat(timespec='milliseconds'),
+        'details': details,
+    }
+    logger.info(log_message, extra={'audit': audit})
+
+
+# Границы бакетов гистограмм длительности (секунды)
+METRICS_DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# После стольких несвернутых наблюдений записывающий поток сворачивает их сам
+METRICS_FOLD_THRESHOLD = 1024
+METRICS_PREFIX = 'zeppelin_user_mgmt_'
+
 
+def _format_metric_labels(labelnames, labels, extra=()):
+    pairs = list(zip(labelnames, labels)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
 
-def read_shiro_ini():
+
+class _Metric:
     """
-    Reads the shiro.ini file and parses its contents into users, roles, and sections.
-    Preserves all sections and their original formatting.
+    Базовая метрика в формате Prometheus
 
-    Returns:
-        tuple: A tuple containing three dictionaries:
-            - users (dict): A dictionary of users with their passwords and roles.
-            - roles (dict): A dictionary of roles with their permissions.
-            - sections (dict): A dictionary of sections with their original lines.
+    Наблюдения из потоков запросов только добавляются в deque (атомарно в
+    CPython, без блокировки). Агрегация выполняется при выдаче /metrics или
+    когда накопилось METRICS_FOLD_THRESHOLD наблюдений - тогда один поток
+    сворачивает их, взяв блокировку без ожидания.
     """
-    users = {}
-    roles = {}
-    sections = {}
-    current_section = None
-    section_order = []  # Сохраняем порядок секций
 
-    try:
-        with open(shiro_ini_path, 'r', encoding='utf-8') as file:
-            lines = file.readlines()
-    except FileNotFoundError:
-        logger.error(f"Файл {shiro_ini_path} не найден")
-        flash(f'Файл конфигурации {shiro_ini_path} не найден', 'error')
-        return users, roles, sections
-    except PermissionError:
-        logger.error(f"Нет прав доступа к файлу {shiro_ini_path}")
-        flash('Нет прав доступа к файлу конфигурации', 'error')
-        return users, roles, sections
-    except Exception as e:
-        logger.error(f"Ошибка чтения файла {shiro_ini_path}: {str(e)}")
-        flash('Ошибка чтения файла конфигурации', 'error')
-        return users, roles, sections
+    metric_type = 'untyped'
 
-    # Сначала читаем все строки и определяем секции
-    for i, line in enumerate(lines):
-        stripped_line = line.strip()
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = METRICS_PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._pending = deque()
+        self._fold_lock = threading.Lock()
+        self._values = {}
+        metrics_registry.append(self)
 
-        # Определяем начало новой секции
-        if stripped_line.startswith('[') and stripped_line.endswith(']'):
-            current_section = stripped_line[1:-1]
-            if current_section not in sections:
-                sections[current_section] = []
-                section_order.append(current_section)
+    def _record(self, labels, value):
+        self._pending.append((labels, value))
+        if len(self._pending) > METRICS_FOLD_THRESHOLD and self._fold_lock.acquire(blocking=False):
+            try:
+                self._fold()
+            finally:
+                self._fold_lock.release()
 
-        # Добавляем строку в текущую секцию (включая заголовок секции)
-        if current_section:
-            sections[current_section].append(line)
-        else:
-            # Строки до первой секции (комментарии в начале файла)
-            if 'header' not in sections:
-                sections['header'] = []
-                section_order.insert(0, 'header')
-            sections['header'].append(line)
+    def _fold(self):
+        pending = self._pending
+        while True:
+            try:
+                labels, value = pending.popleft()
+            except IndexError:
+                return
+            self._apply(labels, value)
 
-        # Парсим пользователей только из секции [users]
-        if current_section == 'users' and '=' in stripped_line and not stripped_line.startswith('['):
-            parts = stripped_line.split('=', 1)  # Разделяем только по первому знаку =
-            if len(parts) == 2:
-                username, data = parts[0].strip(), parts[1].strip()
-                data_parts = [part.strip() for part in data.split(',') if part.strip()]
-                if data_parts:
-                    users[username] = {'password': data_parts[0], 'roles': data_parts[1:]}
+    def _apply(self, labels, value):
+        raise NotImplementedError
 
-        # Парсим роли только из секции [roles]
-        elif current_section == 'roles' and '=' in stripped_line and not stripped_line.startswith('['):
-            parts = stripped_line.split('=', 1)  # Разделяем только по первому знаку =
-            if len(parts) == 2:
-                role = parts[0].strip()
-                roles[role] = parts[1].strip()
+    def _samples(self):
+        raise NotImplementedError
 
-    # Сохраняем порядок секций
-    sections['_section_order'] = section_order
-    
-    logger.info(f"Прочитано пользователей: {len(users)}, ролей: {len(roles)}, секций: {len(section_order)}")
-    
-    return users, roles, sections
+    def render(self):
+        with self._fold_lock:
+            self._fold()
+            samples = list(self._samples())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        lines.extend(f'{name}{labels} {value:g}' if isinstance(value, float) else f'{name}{labels} {value}'
+                     for name, labels, value in samples)
+        return lines
 
 
-def write_shiro_ini(users, roles, sections):
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+
+    metric_type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        self._record(labels, amount)
+
+    def _apply(self, labels, value):
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def value(self, *labels):
+        with self._fold_lock:
+            self._fold()
+            return self._values.get(labels, 0)
+
+    def _samples(self):
+        for labels, value in self._values.items():
+            yield self.name + '_total', _format_metric_labels(self.labelnames, labels), value
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными бакетами"""
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=METRICS_DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        self._record(labels, value)
+
+    def _apply(self, labels, value):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            entry[0][index] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def count(self, *labels):
+        with self._fold_lock:
+            self._fold()
+            entry = self._values.get(labels)
+            return entry[2] if entry else 0
+
+    def _samples(self):
+        for labels, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield (self.name + '_bucket', _format_metric_labels(self.labelnames, labels, [('le', f'{bound:g}')]),
+                       cumulative)
+            yield self.name + '_bucket', _format_metric_labels(self.labelnames, labels, [('le', '+Inf')]), count
+            yield self.name + '_sum', _format_metric_labels(self.labelnames, labels), float(total)
+            yield self.name + '_count', _format_metric_labels(self.labelnames, labels), count
+
+
+class CallbackMetric(_Metric):
     """
-    Writes the users, roles, and sections back to the shiro.ini file.
-    Preserves all sections and their original formatting, only modifying [users] and [roles].
+    Метрика, значение которой берется из существующих счетчиков в момент выдачи
+
+    callback возвращает число или словарь {кортеж значений меток: число}.
+    """
+
+    def __init__(self, name, documentation, metric_type, callback, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.metric_type = metric_type
+        self._callback = callback
+
+    def _samples(self):
+        values = self._callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        suffix = '_total' if self.metric_type == 'counter' else ''
+        for labels, value in values.items():
+            yield self.name + suffix, _format_metric_labels(self.labelnames, labels), value
+
+
+def render_metrics():
+    """Возвращает все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in list(metrics_registry):
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+metrics_registry = []
+
+HTTP_REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Длительность обработки HTTP-запросов',
+                                 ('endpoint', 'method'))
+HTTP_REQUESTS = Counter('http_requests', 'HTTP-запросы по маршруту и коду ответа', ('endpoint', 'method', 'status'))
+SHIRO_READ_SECONDS = Histogram('shiro_read_duration_seconds', 'Длительность read_shiro_ini', ('cache',))
+SHIRO_READ_BYTES = Counter('shiro_read_bytes', 'Прочитано байт shiro.ini (без учета кэша)')
+SHIRO_WRITE_SECONDS = Histogram('shiro_write_duration_seconds', 'Длительность write_shiro_ini', ('result',))
+SHIRO_WRITE_BYTES = Counter('shiro_write_bytes', 'Записано байт shiro.ini')
+REALM_LOCK_WAIT_SECONDS = Histogram('realm_lock_wait_seconds', 'Ожидание блокировки shiro.ini')
+SUBPROCESS_SECONDS = Histogram('subprocess_duration_seconds', 'Длительность команд управления Zeppelin',
+                               ('command',))
+SUBPROCESS_TIMEOUTS = Counter('subprocess_timeouts', 'Команды управления Zeppelin, прерванные по таймауту',
+                              ('command',))
+SOCKETIO_EVENTS = Counter('socketio_events_emitted', 'Отправленные события SocketIO', ('event',))
+STATUS_CACHE_REQUESTS = Counter('status_cache_requests', 'Обращения к кэшу статуса Zeppelin', ('result',))
+BUS_MESSAGES = Counter('message_bus_messages', 'Сообщения шины между воркерами', ('channel', 'direction'))
+
+
+def run_timed_command(command_label, args, **kwargs):
+    """
+    subprocess.run с учетом длительности и таймаутов в метриках
 
     Args:
-        users (dict): A dictionary of users with their passwords and roles.
-        roles (dict): A dictionary of roles with their permissions.
-        sections (dict): A dictionary of sections with their original lines.
-    
+        command_label (str): Метка команды для метрик (status, start, restart, ...)
+        args (list): Команда
+        **kwargs: Аргументы subprocess.run
+
     Returns:
-        bool: True if successful, False otherwise
+        subprocess.CompletedProcess
     """
+    started = time.perf_counter()
     try:
-        # Создаем резервную копию
-        backup_path = f"{shiro_ini_path}.backup"
-        if os.path.exists(shiro_ini_path):
-            with open(shiro_ini_path, 'r', encoding='utf-8') as src:
-                with open(backup_path, 'w', encoding='utf-8') as dst:
-                    dst.write(src.read())
-        
-        logger.info(f"Начинаем запись в {shiro_ini_path}")
-        logger.info(f"Пользователей для записи: {len(users)}, ролей: {len(roles)}")
-        
-        with open(shiro_ini_path, 'w', encoding='utf-8') as file:
-            # Получаем порядок секций
-            section_order = sections.get('_section_order', sections.keys())
-            
-            for section_name in section_order:
-                if section_name == '_section_order':
-                    continue
-                    
-                if section_name == 'users':
-                    # Перезаписываем секцию [users] с новыми данными
-                    file.write('[users]\n')
-                    for user, data in users.items():
-                        roles_str = ', '.join(data['roles']) if data['roles'] else ''
-                        file.write(f"{user} = {data['password']}{', ' + roles_str if roles_str else ''}\n")
-                    file.write('\n')  # Добавляем пустую строку после секции
-                    
-                elif section_name == 'roles':
-                    # Перезаписываем секцию [roles] с новыми данными
-                    file.write('[roles]\n')
-                    for role, perms in roles.items():
-                        file.write(f"{role} = {perms}\n")
-                    file.write('\n')  # Добавляем пустую строку после секции
-                    
-                else:
-                    # Сохраняем все остальные секции как есть
-                    if section_name in sections:
-                        lines = sections[section_name]
-                        # Проверяем, нужно ли добавить разделитель
-                        if file.tell() > 0 and lines:
-                            # Добавляем разделитель между секциями если нужно
-                            if not lines[0].startswith('\n') and not lines[0].startswith('['):
-                                file.write('\n')
-                        
-                        file.writelines(lines)
-        
-        return True
-        
-    except PermissionError:
-        logger.error(f"Нет прав записи в файл {shiro_ini_path}")
-        flash('Нет прав записи в файл конфигурации', 'error')
-        return False
+        return subprocess.run(args, **kwargs)
+    except subprocess.TimeoutExpired:
+        SUBPROCESS_TIMEOUTS.inc(command_label)
+        raise
+    finally:
+        SUBPROCESS_SECONDS.observe(time.perf_counter() - started, command_label)
+
+
+# Шина сообщений между воркерами: пусто или memory:// - один процесс,
+# unix:///путь/к/каталогу - несколько воркеров на одном хосте
+MESSAGE_QUEUE_URL = os.environ.get('MESSAGE_QUEUE_URL', '')
+
+
+def worker_id():
+    """Идентификатор текущего процесса (pid берется при вызове: воркеры создаются через fork)"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class LocalMessageBus:
+    """
+    Шина сообщений одного процесса: publish() сразу вызывает подписчиков
+
+    Каналы: emit (события SocketIO для всех клиентов), realm (shiro.ini
+    изменен), status (статус Zeppelin от ведущего воркера), status_request
+    (запрос проверки статуса у ведущего), clients (число WebSocket-клиентов
+    воркера).
+    """
+
+    multi_process = False
+
+    def __init__(self):
+        self._handlers = {}
+
+    def subscribe(self, channel, handler):
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def publish(self, channel, message):
+        BUS_MESSAGES.inc(channel, 'out')
+        self._dispatch(channel, message)
+
+    def _dispatch(self, channel, message):
+        for handler in self._handlers.get(channel, ()):
+            try:
+                handler(message)
+            except Exception as e:
+                logger.error(f"Ошибка обработки сообщения шины {channel}: {e}")
+
+    def close(self):
+        pass
+
+
+class UnixSocketMessageBus(LocalMessageBus):
+    """
+    Шина между процессами одного хоста на UNIX-датаграммах, без брокера
+
+    Каждый воркер слушает свой сокет <каталог>/<pid>.sock. publish() доставляет
+    сообщение своим подписчикам и отправляет его во все остальные сокеты
+    каталога. Сокеты завершившихся воркеров удаляются при первой неудачной
+    отправке. После fork (gunicorn --preload) дочерний процесс открывает
+    собственный сокет.
+
+    Отправка идет через отдельный неблокирующий сокет: если очередь приема
+    воркера переполнена (он завис или медленно рассылает события), сообщение
+    для него отбрасывается, а не останавливает поток отправителя.
+    """
+
+    multi_process = True
+    MAX_MESSAGE_SIZE = 65536
+    # Не чаще одного предупреждения об отброшенных сообщениях за интервал (секунды)
+    DROP_WARNING_INTERVAL = 10.0
+
+    def __init__(self, directory, name=None):
+        super().__init__()
+        self.directory = directory
+        self.dropped = 0
+        self._name = name
+        self._sock = None
+        self._send_sock = None
+        self._path = None
+        self._last_drop_warning = None
+        os.makedirs(directory, exist_ok=True)
+        self._open()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reopen_after_fork)
+
+    def _reopen_after_fork(self):
+        self._name = None
+        self._open()
+
+    def _open(self):
+        self._path = os.path.join(self.directory, f'{self._name or os.getpid()}.sock')
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self._path)
+        self._send_sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._send_sock.setblocking(False)
+        threading.Thread(target=self._receive, args=(self._sock,), daemon=True,
+                         name='message-bus').start()
+
+    def _receive(self, sock):
+        while True:
+            try:
+                payload = sock.recv(self.MAX_MESSAGE_SIZE)
+            except OSError:
+                return
+            try:
+                envelope = json.loads(payload)
+            except ValueError:
+                continue
+            BUS_MESSAGES.inc(envelope['channel'], 'in')
+            self._dispatch(envelope['channel'], envelope['message'])
+
+    def peers(self):
+        """Сокеты остальных воркеров"""
+        return [path for path in glob.glob(os.path.join(self.directory, '*.sock')) if path != self._path]
+
+    def publish(self, channel, message):
+        super().publish(channel, message)
+        payload = json.dumps({'channel': channel, 'message': message}, default=str).encode('utf-8')
+        if len(payload) > self.MAX_MESSAGE_SIZE:
+            logger.error(f"Сообщение шины {channel} больше {self.MAX_MESSAGE_SIZE} байт, не отправлено")
+            return
+        for path in self.peers():
+            try:
+                self._send_sock.sendto(payload, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Воркер завершился, сокет остался
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except BlockingIOError:
+                # Очередь приема воркера заполнена: ждать его нельзя
+                self._drop(channel, path, 'очередь приема заполнена')
+            except OSError as e:
+                self._drop(channel, path, e)
+
+    def _drop(self, channel, path, reason):
+        self.dropped += 1
+        now = time.monotonic()
+        if self._last_drop_warning is None or now - self._last_drop_warning >= self.DROP_WARNING_INTERVAL:
+            self._last_drop_warning = now
+            logger.warning(f"Сообщение шины {channel} не доставлено в {path}: {reason} "
+                           f"(всего отброшено: {self.dropped})")
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        if self._send_sock is not None:
+            self._send_sock.close()
+            self._send_sock = None
+        if self._path and os.path.exists(self._path):
+            os.unlink(self._path)
+
+
+def open_message_bus(url=MESSAGE_QUEUE_URL):
+    """
+    Создает шину сообщений по URL
+
+    Args:
+        url (str): '' или memory:// - LocalMessageBus, unix:///каталог - UnixSocketMessageBus
+
+    Returns:
+        LocalMessageBus
+    """
+    if not url or url == 'memory://':
+        return LocalMessageBus()
+    parsed = urlparse(url)
+    if parsed.scheme == 'unix' and parsed.path:
+        bus = UnixSocketMessageBus(parsed.path)
+        atexit.register(bus.close)
+        return bus
+    raise ValueError(f'MESSAGE_QUEUE_URL: неподдерживаемая шина {url!r} (memory:// или unix:///каталог)')
+
+
+message_bus = open_message_bus()
+
+
+def emit_event(event, data, local=False, **kwargs):
+    """
+    socketio.emit с подсчетом отправленных событий
+
+    При нескольких воркерах события идут через шину сообщений, чтобы их
+    получили клиенты, подключенные к другим воркерам. Это касается и адресных
+    событий (to=/room=): участников комнаты знает только воркер, к которому
+    они подключены, остальные воркеры отправляют событие в пустую комнату.
+    local=True - только клиентам этого воркера (событие, которое каждый
+    воркер формирует сам).
+    """
+    SOCKETIO_EVENTS.inc(event)
+    if message_bus.multi_process and not local:
+        message_bus.publish('emit', {'event': event, 'data': data, 'kwargs': kwargs})
+    else:
+        socketio.emit(event, data, **kwargs)
+
+
+def _deliver_bus_emit(message):
+    socketio.emit(message['event'], message['data'], **message['kwargs'])
+
+
+message_bus.subscribe('emit', _deliver_bus_emit)
+
+
+# Схема хэширования новых паролей: auto | plain | sha256 | bcrypt.
+# auto - sha256, если в [main] настроен PasswordMatcher, иначе пароли хранятся как есть
+PASSWORD_HASH_SCHEME = os.environ.get('PASSWORD_HASH_SCHEME', 'auto').lower()
+# Число итераций для $shiro1$ (значение по умолчанию DefaultHashService в Shiro)
+SHIRO_HASH_ITERATIONS = int(os.environ.get('SHIRO_HASH_ITERATIONS', '500000'))
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '10'))
+# Размер пула потоков для хэширования/проверки паролей. $shiro1$ считается с
+# захваченным GIL (см. _shiro1_digest), поэтому по умолчанию один поток: больше
+# потоков не ускоряют SHA-256, а только отнимают процессор у запросов и SocketIO.
+# Для bcrypt, который вычисляется без GIL, пул можно увеличить
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '1'))
+# Время жизни кэша успешных проверок (секунды, 0 - кэш отключен)
+PASSWORD_VERIFY_CACHE_TTL = float(os.environ.get('PASSWORD_VERIFY_CACHE_TTL', '300'))
+PASSWORD_VERIFY_CACHE_SIZE = 1024
+
+SHIRO1_PREFIX = '$shiro1$'
+BCRYPT_PREFIXES = ('$2a$', '$2b$', '$2y$')
+_SHIRO_DIGESTS = {'SHA-256': 'sha256', 'SHA-512': 'sha512', 'SHA-1': 'sha1', 'MD5': 'md5'}
+
+
+def is_hashed_credential(credential):
+    """Проверяет, является ли значение пароля из shiro.ini хэшем ($shiro1$ или bcrypt)"""
+    return credential.startswith(SHIRO1_PREFIX) or credential.startswith(BCRYPT_PREFIXES)
+
+
+def _shiro1_digest(algorithm, password, salt, iterations):
+    """
+    Повторяет SimpleHash из Shiro: digest(salt + пароль), затем еще iterations - 1 раз digest(hash)
+
+    Цикл выполняется интерпретатором, а hashlib отпускает GIL только для
+    данных больше 2 КБ, поэтому все время вычисления (~0.35 с при 500000
+    итераций) поток держит GIL и делит процессор с остальными потоками процесса.
+    """
+    digest = getattr(hashlib, algorithm)
+    hashed = digest(salt + password.encode('utf-8')).digest()
+    for _ in range(iterations - 1):
+        hashed = digest(hashed).digest()
+    return hashed
+
+
+def hash_password(password, scheme='sha256', iterations=None):
+    """
+    Хэширует пароль в формате, который понимает PasswordMatcher из Shiro
+
+    Args:
+        password (str): Пароль в открытом виде
+        scheme (str): plain | sha256 | bcrypt
+        iterations (int): Число итераций для sha256 (по умолчанию SHIRO_HASH_ITERATIONS)
+
+    Returns:
+        str: $shiro1$SHA-256$<итерации>$<соль base64>$<хэш base64>, bcrypt-хэш или исходный пароль
+    """
+    if scheme == 'plain':
+        return password
+    if scheme == 'bcrypt':
+        if bcrypt is None:
+            raise RuntimeError('Для схемы bcrypt требуется пакет bcrypt')
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(BCRYPT_ROUNDS)).decode('ascii')
+    if scheme != 'sha256':
+        raise ValueError(f'Неизвестная схема хэширования: {scheme}')
+    iterations = iterations or SHIRO_HASH_ITERATIONS
+    salt = os.urandom(16)
+    hashed = _shiro1_digest('sha256', password, salt, iterations)
+    return (f"{SHIRO1_PREFIX}SHA-256${iterations}$"
+            f"{base64.b64encode(salt).decode('ascii')}${base64.b64encode(hashed).decode('ascii')}")
+
+
+def verify_credential(password, credential):
+    """
+    Сравнивает введенный пароль со значением из shiro.ini (открытый текст, $shiro1$ или bcrypt)
+
+    Returns:
+        bool: True если пароль совпадает
+    """
+    if credential.startswith(SHIRO1_PREFIX):
+        parts = credential.split('$')
+        if len(parts) != 6 or parts[2] not in _SHIRO_DIGESTS:
+            logger.warning(f"Неподдерживаемый формат хэша пароля: {parts[2] if len(parts) > 2 else '?'}")
+            return False
+        try:
+            iterations = int(parts[3])
+            salt = base64.b64decode(parts[4])
+            expected = base64.b64decode(parts[5])
+        except ValueError:
+            return False
+        return hmac.compare_digest(_shiro1_digest(_SHIRO_DIGESTS[parts[2]], password, salt, iterations), expected)
+    if credential.startswith(BCRYPT_PREFIXES):
+        if bcrypt is None:
+            logger.warning('Найден bcrypt-хэш пароля, но пакет bcrypt не установлен')
+            return False
+        try:
+            return bcrypt.checkpw(password.encode('utf-8'), credential.encode('ascii'))
+        except ValueError:
+            return False
+    return hmac.compare_digest(password.encode('utf-8'), credential.encode('utf-8'))
+
+
+def resolve_password_scheme(sections):
+    """
+    Определяет схему хэширования для новых паролей
+
+    Args:
+        sections (dict): Секции shiro.ini из read_shiro_ini()
+
+    Returns:
+        str: plain | sha256 | bcrypt
+    """
+    scheme = PASSWORD_HASH_SCHEME
+    if scheme == 'auto':
+        main_section = ''.join(sections.get('main', []))
+        scheme = 'sha256' if 'PasswordMatcher' in main_section else 'plain'
+    if scheme == 'bcrypt' and bcrypt is None:
+        logger.warning('Пакет bcrypt не установлен, новые пароли хэшируются SHA-256')
+        scheme = 'sha256'
+    return scheme
+
+
+class PasswordService:
+    """
+    Хэширование и проверка паролей вне потоков запросов
+
+    Вычисление хэша выполняется в ограниченном пуле потоков, поэтому всплеск
+    входов не занимает все потоки сервера и SocketIO. Пул ограничивает число
+    одновременных вычислений, но не изолирует процессор: $shiro1$ считается
+    с захваченным GIL, и каждый поток пула конкурирует за него с потоками
+    запросов и SocketIO. Поэтому по умолчанию в пуле один поток
+    (PASSWORD_HASH_WORKERS), а при всплеске входов остальные проверки ждут
+    в очереди пула, не отнимая процессор. Bcrypt вычисляется без GIL. Успешные проверки
+    кэшируются на короткое время: ключ включает значение пароля из shiro.ini
+    (версию учетных данных), поэтому смена пароля автоматически делает старые
+    записи бесполезными. Введенный пароль в кэше хранится только как HMAC
+    со случайным ключом процесса. Одновременные проверки одной и той же пары
+    выполняются один раз.
+    """
+
+    def __init__(self, max_workers=PASSWORD_HASH_WORKERS, cache_ttl=PASSWORD_VERIFY_CACHE_TTL,
+                 cache_size=PASSWORD_VERIFY_CACHE_SIZE, verify_func=verify_credential):
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._verify_func = verify_func
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='password-hash')
+        self._cache = OrderedDict()  # (username, credential, hmac пароля) -> время истечения
+        self._pending = {}  # тот же ключ -> Future выполняющейся проверки
+        self._cache_key_secret = os.urandom(32)
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.hash_computations = 0
+
+    def _cache_key(self, username, password, credential):
+        password_mac = hmac.new(self._cache_key_secret, password.encode('utf-8'), hashlib.sha256).digest()
+        return username, credential, password_mac
+
+    def _compute(self, password, credential):
+        with self._lock:
+            self.hash_computations += 1
+        return self._verify_func(password, credential)
+
+    def verify(self, username, password, credential):
+        """
+        Проверяет пароль пользователя
+
+        Args:
+            username (str): Имя пользователя
+            password (str): Введенный пароль
+            credential (str | None): Значение пароля из shiro.ini
+
+        Returns:
+            bool: True если пароль верный
+        """
+        if credential is None:
+            return False
+        if not is_hashed_credential(credential):
+            # Открытый текст сравнивается мгновенно, пул и кэш не нужны
+            return verify_credential(password, credential)
+
+        key = self._cache_key(username, password, credential)
+        with self._lock:
+            expires_at = self._cache.get(key)
+            if expires_at is not None:
+                if expires_at > time.monotonic():
+                    self._cache.move_to_end(key)
+                    self.cache_hits += 1
+                    return True
+                del self._cache[key]
+            self.cache_misses += 1
+            future = self._pending.get(key)
+            started = future is None
+            if started:
+                future = self._executor.submit(run_blocking, self._compute, password, credential)
+                self._pending[key] = future
+
+        # Колбэк регистрируется вне блокировки: у завершившегося future он
+        # выполняется сразу в этом потоке, а _finish сам берет self._lock
+        if started:
+            future.add_done_callback(lambda done, key=key: self._finish(key, done))
+        return future.result()
+
+    def _finish(self, key, future):
+        with self._lock:
+            self._pending.pop(key, None)
+            if self.cache_ttl > 0 and not future.exception() and future.result():
+                self._cache[key] = time.monotonic() + self.cache_ttl
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+    def encode(self, password, sections):
+        """
+        Готовит значение пароля для записи в shiro.ini по схеме resolve_password_scheme()
+
+        Args:
+            password (str): Пароль в открытом виде
+            sections (dict): Секции shiro.ini
+
+        Returns:
+            str: Хэш или исходный пароль
+        """
+        scheme = resolve_password_scheme(sections)
+        if scheme == 'plain':
+            return password
+        return self._executor.submit(run_blocking, hash_password, password, scheme).result()
+
+    def encode_many(self, passwords, scheme):
+        """
+        Готовит значения нескольких паролей: хэши вычисляются всем пулом
+
+        Args:
+            passwords (list): Пароли в открытом виде
+            scheme (str): Схема из resolve_password_scheme()
+
+        Returns:
+            list: Хэши (или исходные пароли для plain) в том же порядке
+        """
+        if scheme == 'plain':
+            return list(passwords)
+        futures = [self._executor.submit(run_blocking, hash_password, password, scheme) for password in passwords]
+        return [future.result() for future in futures]
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cache_size': len(self._cache),
+                'cache_hits': self.cache_hits,
+                'cache_misses': self.cache_misses,
+                'hash_computations': self.hash_computations,
+            }
+
+
+password_service = PasswordService()
+
+# Ограничение попыток входа: емкость корзины и пополнение (попыток в минуту)
+LOGIN_THROTTLE_IP_BURST = int(os.environ.get('LOGIN_THROTTLE_IP_BURST', '20'))
+LOGIN_THROTTLE_IP_PER_MINUTE = float(os.environ.get('LOGIN_THROTTLE_IP_PER_MINUTE', '10'))
+LOGIN_THROTTLE_USER_BURST = int(os.environ.get('LOGIN_THROTTLE_USER_BURST', '10'))
+LOGIN_THROTTLE_USER_PER_MINUTE = float(os.environ.get('LOGIN_THROTTLE_USER_PER_MINUTE', '5'))
+# Максимум отслеживаемых ключей в каждой таблице (старые вытесняются по LRU)
+LOGIN_THROTTLE_MAX_ENTRIES = int(os.environ.get('LOGIN_THROTTLE_MAX_ENTRIES', '10000'))
+# Длинные имена обрезаются, чтобы атакующий не раздувал память ключами
+LOGIN_THROTTLE_KEY_LENGTH = 64
+
+
+class TokenBucketTable:
+    """
+    Таблица token bucket с жестким ограничением числа ключей
+
+    Для каждого ключа хранится [токены, время обновления]. Таблица - OrderedDict
+    в порядке последнего обращения: при превышении max_entries вытесняется
+    самый давний ключ, поэтому память не растет с числом атакующих адресов.
+    """
+
+    def __init__(self, burst, per_minute, max_entries=LOGIN_THROTTLE_MAX_ENTRIES, clock=time.monotonic):
+        self.burst = burst
+        self.rate = per_minute / 60.0
+        self.max_entries = max_entries
+        self._clock = clock
+        self._buckets = OrderedDict()  # ключ -> [токены, время обновления]
+        self.evictions = 0
+
+    def refill(self, key, now):
+        """Возвращает корзину ключа, пополненную на момент now"""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [float(self.burst), now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+        else:
+            bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def discard(self, key):
+        self._buckets.pop(key, None)
+
+    def retry_after(self, bucket):
+        """Секунды до появления следующего токена"""
+        if self.rate <= 0:
+            return 60
+        return max(1, int((1 - bucket[0]) / self.rate + 0.999))
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class LoginThrottle:
+    """
+    Ограничение частоты попыток входа по IP клиента и по имени пользователя
+
+    Проверка выполняется до чтения shiro.ini и до записи в лог, поэтому
+    отклоненная попытка стоит одного обращения к словарю. Попытка списывает
+    по токену из обеих корзин, только если токены есть в обеих.
+    """
+
+    def __init__(self, ip_burst=LOGIN_THROTTLE_IP_BURST, ip_per_minute=LOGIN_THROTTLE_IP_PER_MINUTE,
+                 user_burst=LOGIN_THROTTLE_USER_BURST, user_per_minute=LOGIN_THROTTLE_USER_PER_MINUTE,
+                 max_entries=LOGIN_THROTTLE_MAX_ENTRIES, clock=time.monotonic):
+        self._clock = clock
+        self._ips = TokenBucketTable(ip_burst, ip_per_minute, max_entries, clock)
+        self._users = TokenBucketTable(user_burst, user_per_minute, max_entries, clock)
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected_ip = 0
+        self.rejected_user = 0
+
+    def check(self, client_ip, username):
+        """
+        Списывает попытку входа
+
+        Args:
+            client_ip (str): IP клиента
+            username (str): Введенное имя пользователя
+
+        Returns:
+            tuple: (allowed: bool, retry_after_seconds: int)
+        """
+        user_key = (username or '').strip().lower()[:LOGIN_THROTTLE_KEY_LENGTH]
+        with self._lock:
+            now = self._clock()
+            ip_bucket = self._ips.refill(client_ip or 'unknown', now)
+            if ip_bucket[0] < 1:
+                self.rejected_ip += 1
+                return False, self._ips.retry_after(ip_bucket)
+            user_bucket = self._users.refill(user_key, now)
+            if user_bucket[0] < 1:
+                self.rejected_user += 1
+                return False, self._users.retry_after(user_bucket)
+            ip_bucket[0] -= 1
+            user_bucket[0] -= 1
+            self.allowed += 1
+            return True, 0
+
+    def reset_user(self, username):
+        """Восстанавливает корзину пользователя после успешного входа"""
+        user_key = (username or '').strip().lower()[:LOGIN_THROTTLE_KEY_LENGTH]
+        with self._lock:
+            self._users.discard(user_key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'allowed': self.allowed,
+                'rejected_ip': self.rejected_ip,
+                'rejected_user': self.rejected_user,
+                'tracked_ips': len(self._ips),
+                'tracked_users': len(self._users),
+                'evictions': self._ips.evictions + self._users.evictions,
+                'max_entries': self._ips.max_entries,
+            }
+
+
+login_throttle = LoginThrottle()
+
+
+class UserStore(Mapping):
+    """
+    Индексированное хранилище пользователей секции [users]
+
+    Для каждого пользователя хранит пароль и упорядоченное множество ролей
+    (dict с ключами-ролями: проверка принадлежности за O(1), порядок ролей
+    сохраняется для записи в файл). Дополнительно поддерживает обратный индекс
+    роль -> множество пользователей. Порядок пользователей соответствует
+    порядку вставки, т.е. порядку строк в shiro.ini.
+
+    Как Mapping возвращает снимки вида {'password': str, 'roles': list}, поэтому
+    существующий код, читающий users[name]['roles'], продолжает работать.
+    Изменения выполняются только через методы хранилища; флаг dirty показывает,
+    отличается ли содержимое от прочитанного из файла.
+    """
+
+    def __init__(self):
+        self._passwords = {}  # username -> password
+        self._roles = {}      # username -> {role: None}
+        self._members = {}    # role -> set(username)
+        self.dirty = False
+
+    def __getitem__(self, username):
+        return {'password': self._passwords[username], 'roles': list(self._roles[username])}
+
+    def __iter__(self):
+        return iter(self._passwords)
+
+    def __len__(self):
+        return len(self._passwords)
+
+    def __contains__(self, username):
+        return username in self._passwords
+
+    def __repr__(self):
+        return f'UserStore({len(self)} users, {len(self._members)} roles in use)'
+
+    def copy(self):
+        """Возвращает независимую копию хранилища вместе с индексами"""
+        clone = UserStore()
+        clone._passwords = dict(self._passwords)
+        clone._roles = {name: dict(user_roles) for name, user_roles in self._roles.items()}
+        clone._members = {role: set(names) for role, names in self._members.items()}
+        clone.dirty = self.dirty
+        return clone
+
+    def mark_clean(self):
+        """Отмечает текущее содержимое как совпадающее с файлом"""
+        self.dirty = False
+
+    def entries(self):
+        """
+        Итерирует пользователей в порядке вставки без создания снимков
+
+        Yields:
+            tuple: (username, password, roles) - roles это представление ключей, только для чтения
+        """
+        for username, password in self._passwords.items():
+            yield username, password, self._roles[username].keys()
+
+    def diff(self, other):
+        """
+        Сравнивает хранилище с более новым состоянием
+
+        Args:
+            other (UserStore): Новое состояние
+
+        Returns:
+            list: (action, username, fields) в порядке строк файла: add/update/delete,
+                fields - изменившиеся поля ('password', 'roles'), для add/delete пустой
+        """
+        if self._passwords == other._passwords and self._roles == other._roles:
+            return []
+        changes = []
+        for username, password in other._passwords.items():
+            if username not in self._passwords:
+                changes.append(('add', username, ()))
+                continue
+            fields = []
+            if password != self._passwords[username]:
+                fields.append('password')
+            if other._roles[username] != self._roles[username]:
+                fields.append('roles')
+            if fields:
+                changes.append(('update', username, tuple(fields)))
+        changes.extend(('delete', username, ()) for username in self._passwords if username not in other._passwords)
+        return changes
+
+    def set_user(self, username, password, roles=()):
+        """
+        Добавляет пользователя или полностью заменяет существующую запись
+
+        Args:
+            username (str): Имя пользователя
+            password (str): Пароль
+            roles (iterable): Роли пользователя
+        """
+        if username in self._passwords:
+            self._unindex(username)
+        self.dirty = True
+        self._passwords[username] = password
+        self._roles[username] = dict.fromkeys(roles)
+        for role in self._roles[username]:
+            self._members.setdefault(role, set()).add(username)
+
+    def remove_user(self, username):
+        """
+        Удаляет пользователя
+
+        Returns:
+            bool: True если пользователь существовал
+        """
+        if username not in self._passwords:
+            return False
+        self._unindex(username)
+        del self._passwords[username]
+        del self._roles[username]
+        self.dirty = True
+        return True
+
+    def get_password(self, username):
+        """Возвращает пароль пользователя или None"""
+        return self._passwords.get(username)
+
+    def set_password(self, username, password):
+        """
+        Меняет пароль существующего пользователя
+
+        Returns:
+            bool: True если пользователь найден
+        """
+        if username not in self._passwords:
+            return False
+        if self._passwords[username] != password:
+            self._passwords[username] = password
+            self.dirty = True
+        return True
+
+    def get_roles(self, username):
+        """Возвращает список ролей пользователя (пустой, если пользователя нет)"""
+        return list(self._roles.get(username, ()))
+
+    def has_role(self, username, role):
+        """Проверяет наличие роли у пользователя за O(1)"""
+        return role in self._roles.get(username, ())
+
+    def assign_role(self, username, role):
+        """
+        Назначает роль пользователю
+
+        Returns:
+            bool: True если роль была добавлена, False если пользователя нет или роль уже назначена
+        """
+        user_roles = self._roles.get(username)
+        if user_roles is None or role in user_roles:
+            return False
+        user_roles[role] = None
+        self._members.setdefault(role, set()).add(username)
+        self.dirty = True
+        return True
+
+    def unassign_role(self, username, role):
+        """
+        Снимает роль с пользователя
+
+        Returns:
+            bool: True если роль была снята
+        """
+        user_roles = self._roles.get(username)
+        if user_roles is None or role not in user_roles:
+            return False
+        del user_roles[role]
+        self._discard_member(role, username)
+        self.dirty = True
+        return True
+
+    def role_members(self, role):
+        """Возвращает множество пользователей с указанной ролью"""
+        return frozenset(self._members.get(role, ()))
+
+    def count_role_members(self, role):
+        """Возвращает количество пользователей с указанной ролью"""
+        return len(self._members.get(role, ()))
+
+    def _unindex(self, username):
+        for role in self._roles[username]:
+            self._discard_member(role, username)
+
+    def _discard_member(self, role, username):
+        members = self._members.get(role)
+        if members is not None:
+            members.discard(username)
+            if not members:
+                del self._members[role]
+
+
+# Кэш разобранного shiro.ini (общий для всех потоков процесса).
+# Ключ - отпечаток файла (путь, устройство, inode, размер, mtime_ns),
+# поэтому на каждый запрос приходится только один stat().
+_shiro_cache = {'key': None, 'data': None}
+_shiro_cache_lock = threading.Lock()
+
+
+def _shiro_fingerprint(path):
+    """
+    Возвращает отпечаток файла для проверки актуальности кэша
+
+    Args:
+        path (str): Путь к файлу
+
+    Returns:
+        tuple: (путь, st_dev, st_ino, st_size, st_mtime_ns) или None, если stat() не удался
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (os.path.abspath(path), st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _copy_shiro_data(users, roles, sections):
+    """
+    Делает независимую копию разобранных данных, чтобы вызывающий код
+    мог изменять их, не портя закэшированный экземпляр
+    """
+    sections_copy = {name: list(lines) for name, lines in sections.items()}
+    return users.copy(), dict(roles), sections_copy
+
+
+def invalidate_shiro_cache():
+    """Сбрасывает кэш разобранного shiro.ini"""
+    with _shiro_cache_lock:
+        _shiro_cache['key'] = None
+        _shiro_cache['data'] = None
+
+
+# Файл межпроцессной блокировки shiro.ini (по умолчанию <shiro.ini>.lock рядом с ним)
+SHIRO_LOCK_PATH = os.environ.get('SHIRO_LOCK_PATH', '')
+
+
+class RealmLock:
+    """
+    Блокировка цикла чтение-изменение-запись shiro.ini
+
+    Потоки процесса сериализуются RLock, процессы (воркеры gunicorn, CLI
+    import-users) - fcntl.flock на отдельном файле блокировки: сам shiro.ini
+    заменяется атомарно, и блокировка на его inode потерялась бы.
+
+    В файле блокировки хранится номер поколения, который увеличивает каждая
+    успешная запись. Войдя в блокировку, процесс сравнивает его с последним
+    известным и при расхождении сбрасывает кэш shiro.ini, поэтому изменение
+    читается от последней записи любого воркера, даже если отпечаток файла
+    (inode, размер, mtime) случайно совпал.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._owner = None
+        self._fd = None
+        self._generation = None  # последнее известное поколение
+        self._after_release = []
+
+    @property
+    def path(self):
+        return SHIRO_LOCK_PATH or shiro_ini_path + '.lock'
+
+    def held(self):
+        """True, если блокировку держит текущий поток"""
+        return self._owner == threading.get_ident()
+
+    def __enter__(self):
+        started = time.perf_counter()
+        self._lock.acquire()
+        self._depth += 1
+        if self._depth > 1:
+            return self
+        self._owner = threading.get_ident()
+        if fcntl is not None:
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            except OSError as e:
+                logger.warning(f"Не удалось открыть файл блокировки {self.path}: {e}; "
+                               f"блокировка только внутри процесса")
+            else:
+                try:
+                    run_blocking(fcntl.flock, fd, fcntl.LOCK_EX)
+                    self._fd = fd
+                    generation = self._read_generation()
+                except BaseException:
+                    # __exit__ не будет вызван: без отката RLock остался бы за этим
+                    # потоком, и все следующие изменения в процессе зависли бы
+                    os.close(fd)
+                    self._fd = None
+                    self._owner = None
+                    self._depth = 0
+                    self._lock.release()
+                    raise
+                if generation != self._generation:
+                    if self._generation is not None:
+                        invalidate_shiro_cache()
+                    self._generation = generation
+        REALM_LOCK_WAIT_SECONDS.observe(time.perf_counter() - started)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        callbacks = ()
+        if self._depth == 0:
+            if self._fd is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+                os.close(self._fd)
+                self._fd = None
+            self._owner = None
+            callbacks, self._after_release = self._after_release, []
+        self._lock.release()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Ошибка отложенного действия после записи shiro.ini: {e}")
+        return False
+
+    def after_release(self, callback):
+        """
+        Выполняет callback после выхода из внешней блокировки
+
+        Нужен для действий, которые не должны задерживать остальных писателей
+        (рассылка по шине). Если блокировку не держит текущий поток, callback
+        выполняется сразу.
+        """
+        if self.held():
+            self._after_release.append(callback)
+        else:
+            callback()
+
+    def _read_generation(self):
+        data = os.pread(self._fd, 32, 0).strip()
+        return int(data) if data.isdigit() else 0
+
+    def committed(self):
+        """Отмечает успешную запись shiro.ini: увеличивает поколение в файле блокировки"""
+        if self._fd is None or not self.held():
+            return
+        self._generation = self._read_generation() + 1
+        data = str(self._generation).encode('ascii')
+        os.ftruncate(self._fd, 0)
+        os.pwrite(self._fd, data, 0)
+
+
+realm_lock = RealmLock()
+
+
+def realm_transaction(f):
+    """Декоратор маршрутов, изменяющих shiro.ini: весь обработчик выполняется под realm_lock"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        with realm_lock:
+            return f(*args, **kwargs)
+    return decorated_function
+
+
+def encode_passwords_unlocked(passwords):
+    """
+    Хэширует пароли до входа в realm_lock
+
+    При PasswordMatcher хэш $shiro1$ стоит сотни миллисекунд, поэтому он
+    вычисляется пулом PasswordService по схеме из снимка shiro.ini, а под
+    блокировкой остаются только чтение, изменение и запись файла.
+
+    Args:
+        passwords (list): Пароли в открытом виде
+
+    Returns:
+        tuple: (scheme: str, values: list) для encoded_for_sections()
+    """
+    _, _, sections = read_shiro_ini(copy=False)
+    scheme = resolve_password_scheme(sections)
+    return scheme, password_service.encode_many(passwords, scheme)
+
+
+def encoded_for_sections(sections, scheme, passwords, values):
+    """
+    Под realm_lock: значения паролей для актуальных секций shiro.ini
+
+    Если схема хэширования сменилась после encode_passwords_unlocked()
+    (PasswordMatcher включили или выключили), пароли хэшируются заново.
+
+    Returns:
+        list: Значения паролей в том же порядке
+    """
+    current = resolve_password_scheme(sections)
+    if current == scheme:
+        return values
+    return password_service.encode_many(passwords, current)
+
+
+# Версия realm: монотонный счетчик, растущий при каждой смене отпечатка shiro.ini
+# (в т.ч. после собственной записи - атомарная замена дает новый inode).
+# ETag строится не из счетчика, а из отпечатка файла, поэтому у всех воркеров
+# (и после перезапуска) он одинаков для одного и того же содержимого.
+_realm_version = {'fingerprint': None, 'version': 0, 'tag': None}
+_realm_version_lock = threading.Lock()
+
+
+def _realm_state():
+    """
+    Текущие версия и тег realm одним stat(), без чтения файла
+
+    Returns:
+        tuple: (version: int, tag: str) или (None, None), если shiro.ini недоступен
+    """
+    fingerprint = _shiro_fingerprint(shiro_ini_path)
+    if fingerprint is None:
+        return None, None
+    with _realm_version_lock:
+        if _realm_version['fingerprint'] != fingerprint:
+            _realm_version['fingerprint'] = fingerprint
+            _realm_version['version'] += 1
+            _realm_version['tag'] = hashlib.sha1(repr(fingerprint).encode('utf-8')).hexdigest()[:16]
+        return _realm_version['version'], _realm_version['tag']
+
+
+def realm_version():
+    """
+    Возвращает текущую версию realm одним stat(), без чтения файла
+
+    Returns:
+        int: Версия или None, если shiro.ini недоступен
+    """
+    return _realm_state()[0]
+
+
+def realm_etag(tag, *variant):
+    """
+    Слабый ETag ответа, зависящего от realm и дополнительных параметров
+
+    Args:
+        tag (str): Тег realm (отпечаток shiro.ini)
+        *variant: Прочие входные данные ответа (пользователь, строка запроса)
+
+    Returns:
+        str: Значение ETag без кавычек
+    """
+    if variant:
+        digest = hashlib.sha1('\0'.join(map(str, variant)).encode('utf-8')).hexdigest()[:12]
+        tag = f'{tag}-{digest}'
+    return tag
+
+
+def realm_conditional(variant=None):
+    """
+    Декоратор условных ответов: ETag по версии realm и 304 на If-None-Match
+
+    При совпадении ETag обработчик не вызывается, т.е. shiro.ini не разбирается
+    и шаблон не рендерится. Версия берется до вызова обработчика: если файл
+    изменится во время рендеринга, ответ получит старый ETag и следующий
+    запрос просто вернет полный ответ.
+
+    Args:
+        variant (callable): Возвращает кортеж прочих входных данных ответа
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            version, tag = _realm_state()
+            g.realm_version = version
+            # Ожидающие flash-сообщения должны попасть в ответ, поэтому без 304
+            if version is None or '_flashes' in session:
+                return f(*args, **kwargs)
+            etag = realm_etag(tag, *(variant() if variant else ()))
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return decorated_function
+    return decorator
+
+
+def _read_lines(path):
+    """Читает текстовый файл построчно с сохранением переводов строк"""
+    with open(path, 'r', encoding='utf-8') as file:
+        return file.readlines()
+
+
+def _parse_shiro_lines(lines):
+    """
+    Разбирает строки shiro.ini на пользователей, роли и секции
+
+    Args:
+        lines (list): Строки файла
+
+    Returns:
+        tuple: (users: UserStore, roles: dict, sections: dict с '_section_order')
+    """
+    users = UserStore()
+    roles = {}
+    sections = {}
+    current_section = None
+    section_order = []  # Сохраняем порядок секций
+
+    # Сначала читаем все строки и определяем секции
+    for i, line in enumerate(lines):
+        stripped_line = line.strip()
+
+        # Определяем начало новой секции
+        if stripped_line.startswith('[') and stripped_line.endswith(']'):
+            current_section = stripped_line[1:-1]
+            if current_section not in sections:
+                sections[current_section] = []
+                section_order.append(current_section)
+
+        # Добавляем строку в текущую секцию (включая заголовок секции)
+        if current_section:
+            sections[current_section].append(line)
+        else:
+            # Строки до первой секции (комментарии в начале файла)
+            if 'header' not in sections:
+                sections['header'] = []
+                section_order.insert(0, 'header')
+            sections['header'].append(line)
+
+        # Парсим пользователей только из секции [users]
+        if current_section == 'users' and '=' in stripped_line and not stripped_line.startswith('['):
+            parts = stripped_line.split('=', 1)  # Разделяем только по первому знаку =
+            if len(parts) == 2:
+                username, data = parts[0].strip(), parts[1].strip()
+                data_parts = [part.strip() for part in data.split(',') if part.strip()]
+                if data_parts:
+                    users.set_user(username, data_parts[0], data_parts[1:])
+
+        # Парсим роли только из секции [roles]
+        elif current_section == 'roles' and '=' in stripped_line and not stripped_line.startswith('['):
+            parts = stripped_line.split('=', 1)  # Разделяем только по первому знаку =
+            if len(parts) == 2:
+                role = parts[0].strip()
+                roles[role] = parts[1].strip()
+
+    # Сохраняем порядок секций
+    sections['_section_order'] = section_order
+    users.mark_clean()
+    return users, roles, sections
+
+
+def read_shiro_ini(copy=True):
+    """
+    Reads the shiro.ini file and parses its contents into users, roles, and sections.
+    Preserves all sections and their original formatting.
+
+    The parsed result is cached process-wide and revalidated with a single stat()
+    per call: the file is re-read only when its inode, size or mtime changes.
+
+    Args:
+        copy (bool): Return an independent copy that the caller may modify. Read-only
+            callers (dashboard, listings, login) pass False to get the cached
+            instance itself and skip the O(n) copy; they must not mutate it.
+
+    Returns:
+        tuple: A tuple containing:
+            - users (UserStore): Users with their passwords and roles.
+            - roles (dict): A dictionary of roles with their permissions.
+            - sections (dict): A dictionary of sections with their original lines.
+    """
+    users = UserStore()
+    roles = {}
+    sections = {}
+
+    # Отпечаток снимаем до чтения: если файл изменится между stat() и open(),
+    # следующий вызов увидит новый отпечаток и перечитает файл
+    started = time.perf_counter()
+    fingerprint = _shiro_fingerprint(shiro_ini_path)
+    if fingerprint is not None:
+        with _shiro_cache_lock:
+            if _shiro_cache['key'] == fingerprint:
+                data = _copy_shiro_data(*_shiro_cache['data']) if copy else _shiro_cache['data']
+                SHIRO_READ_SECONDS.observe(time.perf_counter() - started, 'hit')
+                return data
+
+    try:
+        lines = run_blocking(_read_lines, shiro_ini_path)
+    except FileNotFoundError:
+        logger.error(f"Файл {shiro_ini_path} не найден")
+        if has_request_context():
+            flash(f'Файл конфигурации {shiro_ini_path} не найден', 'error')
+        return users, roles, sections
+    except PermissionError:
+        logger.error(f"Нет прав доступа к файлу {shiro_ini_path}")
+        if has_request_context():
+            flash('Нет прав доступа к файлу конфигурации', 'error')
+        return users, roles, sections
+    except Exception as e:
+        logger.error(f"Ошибка чтения файла {shiro_ini_path}: {str(e)}")
+        if has_request_context():
+            flash('Ошибка чтения файла конфигурации', 'error')
+        return users, roles, sections
+
+    users, roles, sections = run_blocking(_parse_shiro_lines, lines)
+    
+    logger.info(f"Прочитано пользователей: {len(users)}, ролей: {len(roles)}, "
+                f"секций: {len(sections['_section_order'])}")
+
+    if fingerprint is not None:
+        with _shiro_cache_lock:
+            _shiro_cache['key'] = fingerprint
+            _shiro_cache['data'] = _copy_shiro_data(users, roles, sections) if copy else (users, roles, sections)
+
+    SHIRO_READ_SECONDS.observe(time.perf_counter() - started, 'miss')
+    SHIRO_READ_BYTES.inc(amount=sum(map(len, lines)))
+    return users, roles, sections
+
+
+def _parse_roles_section(lines):
+    """Разбирает строки секции [roles] в словарь роль -> права"""
+    roles = {}
+    for line in lines:
+        stripped_line = line.strip()
+        if '=' in stripped_line and not stripped_line.startswith('['):
+            role, perms = stripped_line.split('=', 1)
+            roles[role.strip()] = perms.strip()
+    return roles
+
+
+def _render_shiro_ini(users, roles, sections):
+    """
+    Собирает новое содержимое shiro.ini
+
+    Секции [users] и [roles] формируются заново только если они изменились,
+    все остальные (и неизмененные) секции переносятся байт в байт.
+
+    Returns:
+        tuple: (content: str, changed_sections: list)
+    """
+    chunks = []
+    changed_sections = []
+    section_order = sections.get('_section_order', sections.keys())
+
+    for section_name in section_order:
+        if section_name == '_section_order':
+            continue
+        original_lines = sections.get(section_name, [])
+
+        if section_name == 'users' and users.dirty:
+            rendered = ['[users]\n']
+            for user, password, user_roles in users.entries():
+                roles_str = ', '.join(user_roles)
+                rendered.append(f"{user} = {password}{', ' + roles_str if roles_str else ''}\n")
+            rendered.append('\n')  # Добавляем пустую строку после секции
+        elif section_name == 'roles' and _parse_roles_section(original_lines) != roles:
+            rendered = ['[roles]\n']
+            rendered.extend(f"{role} = {perms}\n" for role, perms in roles.items())
+            rendered.append('\n')  # Добавляем пустую строку после секции
+        else:
+            chunks.extend(original_lines)
+            continue
+
+        # Последняя строка предыдущей секции могла быть без перевода строки
+        if chunks and not chunks[-1].endswith('\n'):
+            chunks.append('\n')
+        chunks.extend(rendered)
+        changed_sections.append(section_name)
+
+    return ''.join(chunks), changed_sections
+
+
+def _backup_shiro_ini(path, hardlink=True):
+    """
+    Создает резервную копию path.backup
+
+    При атомарной замене старый inode остается нетронутым, поэтому вместо
+    копирования достаточно жесткой ссылки. Если ссылки не поддерживаются
+    файловой системой, делается обычная копия.
+    """
+    if not os.path.exists(path):
+        return
+    backup_path = f"{path}.backup"
+    tmp_backup_path = f"{backup_path}.tmp"
+    if os.path.lexists(tmp_backup_path):
+        os.unlink(tmp_backup_path)
+    if hardlink:
+        try:
+            os.link(path, tmp_backup_path)
+            os.replace(tmp_backup_path, backup_path)
+            return
+        except OSError:
+            if os.path.lexists(tmp_backup_path):
+                os.unlink(tmp_backup_path)
+    shutil.copy2(path, tmp_backup_path)
+    os.replace(tmp_backup_path, backup_path)
+
+
+def _fsync_directory(directory):
+    """Сбрасывает на диск запись каталога после rename"""
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def _atomic_write_text(path, content):
+    """
+    Атомарно заменяет содержимое файла
+
+    Данные пишутся во временный файл в том же каталоге, сбрасываются на диск
+    и переносятся на место через os.replace(), поэтому другие процессы видят
+    либо старую, либо новую версию целиком. Права и владелец переносятся
+    с исходного файла.
+
+    Если файл смонтирован в контейнер как отдельный bind mount (rename на него
+    невозможен, EBUSY/EXDEV), выполняется запись на месте с восстановлением
+    из резервной копии при ошибке.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as tmp_file:
+            tmp_file.write(content)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+
+        if os.path.exists(path):
+            st = os.stat(path)
+            os.chmod(tmp_path, stat.S_IMODE(st.st_mode))
+            try:
+                os.chown(tmp_path, st.st_uid, st.st_gid)
+            except (PermissionError, AttributeError):
+                pass
+
+        _backup_shiro_ini(path)
+        try:
+            os.replace(tmp_path, path)
+        except OSError as e:
+            if e.errno not in (errno.EBUSY, errno.EXDEV):
+                raise
+            logger.warning(f"Атомарная замена {path} невозможна ({e.strerror}), записываем на месте")
+            # Жесткая ссылка указывает на тот же inode - нужна настоящая копия
+            _backup_shiro_ini(path, hardlink=False)
+            try:
+                with open(path, 'w', encoding='utf-8') as file:
+                    file.write(content)
+                    file.flush()
+                    os.fsync(file.fileno())
+            except Exception:
+                shutil.copyfile(f"{path}.backup", path)
+                raise
+        else:
+            _fsync_directory(directory)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def write_shiro_ini(users, roles, sections):
+    """
+    Writes the users, roles, and sections back to the shiro.ini file.
+    Preserves all sections and their original formatting, only modifying [users] and [roles].
+
+    Only the [users]/[roles] sections that actually changed are re-rendered; every
+    other section is copied verbatim. The file is replaced atomically, so a torn
+    shiro.ini is never visible, and the previous version is kept as shiro.ini.backup.
+
+    Args:
+        users (UserStore): Users with their passwords and roles.
+        roles (dict): A dictionary of roles with their permissions.
+        sections (dict): A dictionary of sections with their original lines.
+    
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    started = time.perf_counter()
+    result = 'failed'
+    try:
+        content, changed_sections = run_blocking(_render_shiro_ini, users, roles, sections)
+        if not changed_sections:
+            logger.info(f"Изменений для записи в {shiro_ini_path} нет")
+            result = 'skipped'
+            return True
+
+        logger.info(f"Начинаем запись в {shiro_ini_path}, измененные секции: {', '.join(changed_sections)}")
+        logger.info(f"Пользователей для записи: {len(users)}, ролей: {len(roles)}")
+
+        run_blocking(_atomic_write_text, shiro_ini_path, content)
+        users.mark_clean()
+        realm_lock.committed()
+        # Наблюдатель shiro.ini припишет это изменение пользователю, а не внешнему редактору
+        fingerprint = _shiro_fingerprint(shiro_ini_path)
+        actor = session.get('username') if has_request_context() else None
+        shiro_watcher.expect(fingerprint, actor)
+        # Рассылка воркерам - после снятия блокировки, чтобы не держать ее на отправке
+        realm_message = {'worker': worker_id(), 'fingerprint': fingerprint, 'actor': actor}
+        realm_lock.after_release(lambda: message_bus.publish('realm', realm_message))
+        SHIRO_WRITE_BYTES.inc(amount=len(content.encode('utf-8')))
+        result = 'written'
+        return True
+        
+    except PermissionError:
+        logger.error(f"Нет прав записи в файл {shiro_ini_path}")
+        if has_request_context():
+            flash('Нет прав записи в файл конфигурации', 'error')
+        return False
     except Exception as e:
         logger.error(f"Ошибка записи в файл {shiro_ini_path}: {str(e)}")
         logger.error(f"Тип ошибки: {type(e).__name__}")
-        flash(f'Ошибка записи в файл конфигурации: {str(e)}', 'error')
-        # Восстанавливаем из резервной копии
-        try:
-            backup_path = f"{shiro_ini_path}.backup"
-            if os.path.exists(backup_path):
-                logger.info("Восстанавливаем из резервной копии")
-                with open(backup_path, 'r', encoding='utf-8') as src:
-                    with open(shiro_ini_path, 'w', encoding='utf-8') as dst:
-                        dst.write(src.read())
-        except Exception as restore_error:
-            logger.error(f"Ошибка восстановления из резервной копии: {str(restore_error)}")
+        if has_request_context():
+            flash(f'Ошибка записи в файл конфигурации: {str(e)}', 'error')
+        return False
+    finally:
+        # Любая запись (в т.ч. неудачная) делает кэш неактуальным
+        invalidate_shiro_cache()
+        SHIRO_WRITE_SECONDS.observe(time.perf_counter() - started, result)
+
+
+PROC_ROOT = '/proc'
+
+
+def _format_bytes(size):
+    """Форматирует размер в байтах в стиле systemd (512.0M, 1.2G)"""
+    for unit in ('B', 'K', 'M', 'G'):
+        if size < 1024 or unit == 'G':
+            return f"{size}{unit}" if unit == 'B' else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}T"
+
+
+def _format_duration(seconds):
+    """Форматирует длительность: 2d 3h 4min"""
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    parts = [f"{value}{unit}" for value, unit in ((days, 'd'), (hours, 'h'), (minutes, 'min')) if value]
+    return ' '.join(parts) if parts else f"{seconds}s"
+
+
+def _is_zeppelin_process(pid, proc_root=PROC_ROOT):
+    """Проверяет, что PID принадлежит живому процессу Zeppelin (защита от устаревших pid-файлов)"""
+    try:
+        with open(os.path.join(proc_root, str(pid), 'cmdline'), 'rb') as f:
+            return b'zeppelin' in f.read().lower()
+    except OSError:
         return False
 
 
+def find_zeppelin_pid(system_info, status_output='', proc_root=PROC_ROOT):
+    """
+    Находит PID JVM Zeppelin без запуска дополнительных процессов
+
+    Для systemd используется MainPID из уже полученного вывода systemctl status,
+    для zeppelin-daemon.sh - pid-файл в ZEPPELIN_PID_DIR
+    (по умолчанию $ZEPPELIN_HOME/run).
+
+    Args:
+        system_info (dict): Информация о системе (get_system_info)
+        status_output (str): Вывод команды status
+        proc_root (str): Корень procfs
+
+    Returns:
+        int: PID или None, если процесс не найден
+    """
+    candidates = []
+    for line in status_output.split('\n'):
+        if 'Main PID:' in line:
+            pid_match = line.split('Main PID:')[1].strip().split()
+            if pid_match and pid_match[0].isdigit():
+                candidates.append(int(pid_match[0]))
+
+    if system_info.get('zeppelin_type') == 'daemon':
+        pid_dir = os.environ.get('ZEPPELIN_PID_DIR')
+        if not pid_dir:
+            zeppelin_home = os.environ.get('ZEPPELIN_HOME')
+            if not zeppelin_home and system_info.get('daemon_path'):
+                zeppelin_home = os.path.dirname(os.path.dirname(os.path.abspath(system_info['daemon_path'])))
+            pid_dir = os.path.join(zeppelin_home, 'run') if zeppelin_home else None
+        if pid_dir:
+            # zeppelin-daemon.sh пишет zeppelin-<ident>-<hostname>.pid
+            for pid_file in sorted(glob.glob(os.path.join(pid_dir, 'zeppelin-*.pid'))):
+                if 'interpreter' in os.path.basename(pid_file):
+                    continue
+                try:
+                    with open(pid_file, 'r') as f:
+                        content = f.read().strip()
+                except OSError:
+                    continue
+                if content.isdigit():
+                    candidates.append(int(content))
+
+    for pid in candidates:
+        if _is_zeppelin_process(pid, proc_root):
+            return pid
+    return None
+
+
+def read_process_metrics(pid, proc_root=PROC_ROOT):
+    """
+    Читает метрики процесса напрямую из /proc/<pid>
+
+    Args:
+        pid (int): PID процесса
+        proc_root (str): Корень procfs
+
+    Returns:
+        dict: pid, rss_bytes, cpu_seconds, threads, open_fds, start_time,
+              uptime_seconds, read_bytes, write_bytes (None, если значение
+              недоступно) или None, если процесс не существует
+    """
+    proc_dir = os.path.join(proc_root, str(pid))
+    try:
+        with open(os.path.join(proc_dir, 'stat'), 'r') as f:
+            stat_line = f.read()
+        with open(os.path.join(proc_root, 'stat'), 'r') as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith('btime '))
+    except (OSError, StopIteration, ValueError):
+        return None
+
+    clock_ticks = os.sysconf('SC_CLK_TCK')
+    page_size = os.sysconf('SC_PAGE_SIZE')
+
+    # Имя процесса в скобках может содержать пробелы - разбираем поля после ')'
+    fields = stat_line.rsplit(')', 1)[1].split()
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / clock_ticks
+    threads = int(fields[17])
+    start_timestamp = boot_time + int(fields[19]) / clock_ticks
+
+    metrics = {
+        'pid': pid,
+        'rss_bytes': None,
+        'cpu_seconds': round(cpu_seconds, 2),
+        'threads': threads,
+        'open_fds': None,
+        'start_time': datetime.fromtimestamp(start_timestamp).isoformat(timespec='seconds'),
+        'uptime_seconds': max(0, int(time.time() - start_timestamp)),
+        'read_bytes': None,
+        'write_bytes': None
+    }
+
+    try:
+        with open(os.path.join(proc_dir, 'statm'), 'r') as f:
+            metrics['rss_bytes'] = int(f.read().split()[1]) * page_size
+    except (OSError, IndexError, ValueError):
+        pass
+
+    try:
+        with open(os.path.join(proc_dir, 'status'), 'r') as f:
+            for line in f:
+                if line.startswith('Threads:'):
+                    metrics['threads'] = int(line.split()[1])
+                elif line.startswith('VmRSS:') and metrics['rss_bytes'] is None:
+                    metrics['rss_bytes'] = int(line.split()[1]) * 1024
+    except (OSError, IndexError, ValueError):
+        pass
+
+    # fd и io доступны только владельцу процесса или root
+    try:
+        metrics['open_fds'] = len(os.listdir(os.path.join(proc_dir, 'fd')))
+    except OSError:
+        pass
+
+    try:
+        with open(os.path.join(proc_dir, 'io'), 'r') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('read_bytes', 'write_bytes'):
+                    metrics[key] = int(value)
+    except (OSError, ValueError):
+        pass
+
+    return metrics
+
+
 def check_zeppelin_status():
     """
     Проверяет статус сервиса Zeppelin для разных операционных систем
@@ -513,8 +2748,8 @@ def check_zeppelin_status():
     try:
         # Проверяем статус сервиса
         status_cmd = system_info['commands']['status']
-        result = subprocess.run(
-            status_cmd,
+        result = run_timed_command(
+            'status', status_cmd,
             capture_output=True,
             text=True,
             timeout=30
@@ -528,8 +2763,8 @@ def check_zeppelin_status():
         if system_info['zeppelin_type'] == 'systemd':
             # Для systemctl получаем дополнительную информацию
             if 'is_active' in system_info['commands']:
-                is_active_result = subprocess.run(
-                    system_info['commands']['is_active'],
+                is_active_result = run_timed_command(
+                    'is_active', system_info['commands']['is_active'],
                     capture_output=True,
                     text=True,
                     timeout=10
@@ -537,8 +2772,8 @@ def check_zeppelin_status():
                 active_status = is_active_result.stdout.strip()
             
             if 'is_enabled' in system_info['commands']:
-                is_enabled_result = subprocess.run(
-                    system_info['commands']['is_enabled'],
+                is_enabled_result = run_timed_command(
+                    'is_enabled', system_info['commands']['is_enabled'],
                     capture_output=True,
                     text=True,
                     timeout=10
@@ -630,6 +2865,18 @@ def check_zeppelin_status():
             elif 'Memory:' in line:
                 memory_usage = line.split('Memory:')[1].strip()
         
+        # Точные метрики процесса из /proc (работают и для zeppelin-daemon.sh)
+        process_metrics = None
+        if status == 'running':
+            zeppelin_pid = find_zeppelin_pid(system_info, status_output)
+            if zeppelin_pid is not None:
+                process_metrics = read_process_metrics(zeppelin_pid)
+        if process_metrics:
+            pid = str(process_metrics['pid'])
+            uptime = f"{process_metrics['start_time']} ({_format_duration(process_metrics['uptime_seconds'])})"
+            if process_metrics['rss_bytes'] is not None:
+                memory_usage = _format_bytes(process_metrics['rss_bytes'])
+        
         return {
             'status': status,
             'status_class': status_class,
@@ -643,7 +2890,8 @@ def check_zeppelin_status():
             'error': None,
             'os': system_info['os'],
             'service_manager': system_info['service_manager'],
-            'zeppelin_type': system_info['zeppelin_type']
+            'zeppelin_type': system_info['zeppelin_type'],
+            'process': process_metrics
         }
         
     except subprocess.TimeoutExpired:
@@ -675,20 +2923,124 @@ def check_zeppelin_status():
         }
 
 
-def execute_service_command(command_type):
+# Адрес веб-интерфейса Zeppelin для проверки готовности после запуска
+ZEPPELIN_URL = os.environ.get('ZEPPELIN_URL', 'http://localhost:8080')
+# Максимальное время ожидания готовности (секунды, 0 - не ждать)
+ZEPPELIN_READY_TIMEOUT = float(os.environ.get('ZEPPELIN_READY_TIMEOUT', '120'))
+
+
+class ReadinessChecker:
+    """
+    Проверка готовности Zeppelin по HTTP с экспоненциальной задержкой
+
+    Сервис считается готовым, когда порт принимает соединения и легкий
+    эндпоинт (по умолчанию /api/version, доступен анонимно) отвечает кодом < 500.
+    """
+
+    def __init__(self, base_url=ZEPPELIN_URL, path='/api/version', initial_delay=0.25, max_delay=5.0,
+                 request_timeout=2.0):
+        parsed = urlparse(base_url)
+        self.base_url = base_url
+        self.scheme = parsed.scheme or 'http'
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or (443 if self.scheme == 'https' else 80)
+        self.path = (parsed.path.rstrip('/') + path) if parsed.path else path
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.request_timeout = request_timeout
+
+    def port_open(self):
+        """Проверяет, принимает ли порт TCP-соединения"""
+        try:
+            with socket.create_connection((self.host, self.port), timeout=self.request_timeout):
+                return True
+        except OSError:
+            return False
+
+    def probe(self):
+        """
+        Однократная проверка готовности
+
+        Returns:
+            bool: True если эндпоинт ответил кодом < 500
+        """
+        connection_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        connection = connection_class(self.host, self.port, timeout=self.request_timeout)
+        try:
+            connection.request('GET', self.path, headers={'Connection': 'close'})
+            response = connection.getresponse()
+            response.read()
+            return response.status < 500
+        except (OSError, http.client.HTTPException):
+            return False
+        finally:
+            connection.close()
+
+    def _poll(self, check, timeout):
+        started = time.monotonic()
+        deadline = started + timeout
+        delay = self.initial_delay
+        while True:
+            if check():
+                return True, time.monotonic() - started
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False, time.monotonic() - started
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, self.max_delay)
+
+    def wait_until_ready(self, timeout):
+        """
+        Ждет готовности сервиса
+
+        Returns:
+            tuple: (ready: bool, elapsed_seconds: float)
+        """
+        return self._poll(self.probe, timeout)
+
+    def wait_until_down(self, timeout):
+        """
+        Ждет, пока порт перестанет принимать соединения
+
+        Returns:
+            tuple: (down: bool, elapsed_seconds: float)
+        """
+        return self._poll(lambda: not self.port_open(), timeout)
+
+
+zeppelin_readiness = ReadinessChecker()
+
+
+def execute_service_command(command_type, progress=None):
     """
     Выполняет команду управления сервисом Zeppelin
     
     Args:
         command_type (str): Тип команды ('start', 'stop', 'restart')
+        progress (callable): Вызывается с (phase, message) при переходе между этапами
     
     Returns:
         tuple: (success: bool, message: str)
     """
+    def report(phase, message):
+        if progress:
+            progress(phase, message)
+
+    def wait_ready():
+        """Ждет готовности HTTP Zeppelin; возвращает (ready или None, если проверка отключена, суффикс сообщения)"""
+        if ZEPPELIN_READY_TIMEOUT <= 0:
+            return None, ''
+        report('ready_wait', f'Ожидание готовности {zeppelin_readiness.base_url}')
+        ready, elapsed = zeppelin_readiness.wait_until_ready(ZEPPELIN_READY_TIMEOUT)
+        if ready:
+            return True, f', готов через {elapsed:.1f} с'
+        return False, f', но {zeppelin_readiness.base_url} не ответил за {ZEPPELIN_READY_TIMEOUT:.0f} с'
+
     system_info = get_system_info()
     
     if system_info['demo_mode']:
         logger.info(f"Демо режим: {command_type} Zeppelin на {system_info['os']}")
+        report('demo', f'Демо режим: выполняем {command_type}')
         time.sleep(2)  # Имитируем работу
         return True, f"Демо режим: команда {command_type} выполнена"
     
@@ -696,22 +3048,25 @@ def execute_service_command(command_type):
         if command_type == 'restart':
             # Для перезапуска используем специальную команду или stop+start
             if 'restart' in system_info['commands']:
-                result = subprocess.run(
-                    system_info['commands']['restart'],
+                report('restart', 'Перезапуск сервиса')
+                result = run_timed_command(
+                    'restart', system_info['commands']['restart'],
                     capture_output=True,
                     text=True,
                     timeout=90
                 )
                 if result.returncode == 0:
+                    _, ready_message = wait_ready()
                     service_type = f"({system_info['zeppelin_type']})"
-                    return True, f"Сервис успешно перезапущен {service_type}"
+                    return True, f"Сервис успешно перезапущен {service_type}{ready_message}"
                 else:
                     error_msg = result.stderr or result.stdout
                     return False, f"Ошибка перезапуска: {error_msg}"
             else:
                 # Останавливаем
-                result_stop = subprocess.run(
-                    system_info['commands']['stop'],
+                report('stop', 'Остановка сервиса')
+                result_stop = run_timed_command(
+                    'stop', system_info['commands']['stop'],
                     capture_output=True,
                     text=True,
                     timeout=60
@@ -721,13 +3076,15 @@ def execute_service_command(command_type):
                     error_msg = result_stop.stderr or result_stop.stdout
                     return False, f"Ошибка остановки: {error_msg}"
                 
-                # Ждем меньше для daemon
+                # Ждем освобождения порта, но не дольше прежней паузы (меньше для daemon)
                 wait_time = 10 if system_info['zeppelin_type'] == 'daemon' else 30
-                time.sleep(wait_time)
+                report('wait', f'Ожидание остановки (до {wait_time} с)')
+                zeppelin_readiness.wait_until_down(wait_time)
                 
                 # Запускаем
-                result_start = subprocess.run(
-                    system_info['commands']['start'],
+                report('start', 'Запуск сервиса')
+                result_start = run_timed_command(
+                    'start', system_info['commands']['start'],
                     capture_output=True,
                     text=True,
                     timeout=60
@@ -737,16 +3094,18 @@ def execute_service_command(command_type):
                     error_msg = result_start.stderr or result_start.stdout
                     return False, f"Ошибка запуска: {error_msg}"
                 
+                _, ready_message = wait_ready()
                 service_type = f"({system_info['zeppelin_type']})"
-                return True, f"Сервис успешно перезапущен {service_type}"
+                return True, f"Сервис успешно перезапущен {service_type}{ready_message}"
         
         else:
             # Для start и stop
             if command_type in system_info['commands']:
                 logger.info(f"Выполняем команду {command_type}: {' '.join(system_info['commands'][command_type])}")
+                report(command_type, f"Выполняем {command_type}")
                 
-                result = subprocess.run(
-                    system_info['commands'][command_type],
+                result = run_timed_command(
+                    command_type, system_info['commands'][command_type],
                     capture_output=True,
                     text=True,
                     timeout=60
@@ -759,13 +3118,17 @@ def execute_service_command(command_type):
                 # Для daemon скрипта проверяем результат по-особому
                 if system_info['zeppelin_type'] == 'daemon':
                     if command_type == 'start':
-                        # Для start команды daemon может возвращать 0 даже если уже запущен
-                        # Проверим статус через несколько секунд
-                        time.sleep(3)
+                        # Для start команды daemon может возвращать 0 даже если уже запущен:
+                        # ждем, пока Zeppelin начнет отвечать по HTTP, вместо фиксированной паузы
+                        ready, ready_message = wait_ready()
+                        service_type = f"({system_info['zeppelin_type']})"
+                        if ready:
+                            return True, f"Сервис успешно запущен {service_type}{ready_message}"
                         
                         # Проверяем статус после запуска
-                        status_result = subprocess.run(
-                            system_info['commands']['status'],
+                        report('check', 'Проверка статуса после запуска')
+                        status_result = run_timed_command(
+                            'status', system_info['commands']['status'],
                             capture_output=True,
                             text=True,
                             timeout=30
@@ -774,31 +3137,33 @@ def execute_service_command(command_type):
                         logger.info(f"Проверка статуса после start: {status_result.stdout}")
                         
                         if 'running' in status_result.stdout.lower() or 'started' in status_result.stdout.lower():
-                            service_type = f"({system_info['zeppelin_type']})"
-                            return True, f"Сервис успешно запущен {service_type}"
+                            return True, f"Сервис успешно запущен {service_type}{ready_message}"
                         else:
                             # Попробуем альтернативный способ - через restart
                             logger.info("Обычный start не сработал, пробуем restart")
-                            restart_result = subprocess.run(
-                                system_info['commands']['restart'],
+                            report('restart', 'Обычный start не сработал, пробуем restart')
+                            restart_result = run_timed_command(
+                                'restart', system_info['commands']['restart'],
                                 capture_output=True,
                                 text=True,
                                 timeout=60
                             )
                             
                             if restart_result.returncode == 0:
+                                ready, ready_message = wait_ready()
+                                if ready:
+                                    return True, f"Сервис успешно запущен через restart {service_type}{ready_message}"
+                                
                                 # Проверяем статус еще раз
-                                time.sleep(3)
-                                final_status = subprocess.run(
-                                    system_info['commands']['status'],
+                                final_status = run_timed_command(
+                                    'status', system_info['commands']['status'],
                                     capture_output=True,
                                     text=True,
                                     timeout=30
                                 )
                                 
                                 if 'running' in final_status.stdout.lower():
-                                    service_type = f"({system_info['zeppelin_type']})"
-                                    return True, f"Сервис успешно запущен через restart {service_type}"
+                                    return True, f"Сервис успешно запущен через restart {service_type}{ready_message}"
                             
                             error_msg = result.stderr or result.stdout or "Не удалось запустить сервис"
                             return False, f"Ошибка запуска daemon: {error_msg}"
@@ -816,7 +3181,8 @@ def execute_service_command(command_type):
                     if result.returncode == 0:
                         action_text = {'start': 'запущен', 'stop': 'остановлен'}
                         service_type = f"({system_info['zeppelin_type']})"
-                        return True, f"Сервис успешно {action_text.get(command_type, command_type)} {service_type}"
+                        ready_message = wait_ready()[1] if command_type == 'start' else ''
+                        return True, f"Сервис успешно {action_text.get(command_type, command_type)} {service_type}{ready_message}"
                     else:
                         error_msg = result.stderr or result.stdout
                         return False, f"Ошибка {command_type}: {error_msg}"
@@ -837,30 +3203,585 @@ def execute_service_command(command_type):
         return False, f"Неожиданная ошибка: {str(e)}"
 
 
-def restart_zeppelin():
+# Время жизни закэшированного статуса Zeppelin (секунды)
+ZEPPELIN_STATUS_TTL = float(os.environ.get('ZEPPELIN_STATUS_TTL', '10'))
+
+
+class StatusCache:
+    """
+    Общий кэш статуса Zeppelin с объединением одновременных проверок
+
+    - результат живет ttl секунд, повторные запросы в этот период не запускают
+      subprocess;
+    - одновременные вызовы ждут одну и ту же выполняющуюся проверку
+      (single-flight) вместо запуска собственных;
+    - с allow_stale=True устаревший результат возвращается сразу, а обновление
+      запускается в фоновом потоке (stale-while-revalidate);
+    - при нескольких воркерах (follow) проверяет только ведущий: пока он жив,
+      остальные никогда не запускают проверку сами, а отдают последний
+      присланный им статус и раз в ttl просят ведущего обновить его.
+    """
+
+    # Сколько ждать первый статус от ведущего воркера (секунды)
+    LEADER_WAIT = 5.0
+
+    def __init__(self, probe, ttl):
+        self._probe = probe
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._status = None
+        self._updated = None     # time.monotonic() последней успешной проверки
+        self._generation = 0     # увеличивается при invalidate()
+        self._inflight = None    # threading.Event выполняющейся проверки
+        self._leader = None
+        self._request_refresh = None
+        self._requested_at = None  # time.monotonic() последнего запроса к ведущему
+        self._invalidated = False  # invalidate() еще не передан ведущему
+        self._primed = threading.Event()
+
+    def follow(self, leader, request_refresh):
+        """
+        Включает режим нескольких воркеров
+
+        Args:
+            leader (LeaderElection): Выбор ведущего воркера
+            request_refresh (callable): Просит ведущего проверить статус, аргумент invalidate (bool)
+        """
+        self._leader = leader
+        self._request_refresh = request_refresh
+
+    def _from_leader(self, wait):
+        """Статус, присланный ведущим воркером; сам воркер статус не проверяет"""
+        with self._lock:
+            now = time.monotonic()
+            invalidate = self._invalidated
+            send = invalidate or self._requested_at is None or now - self._requested_at >= self.ttl
+            if send:
+                self._requested_at = now
+                self._invalidated = False
+            status = self._status
+        if send:
+            self._request_refresh(invalidate)
+        if status is None and wait:
+            self._primed.wait(self.LEADER_WAIT)
+            status = self._status
+        STATUS_CACHE_REQUESTS.inc('leader')
+        if status is None and wait:
+            return {
+                'status': 'unknown',
+                'status_class': 'secondary',
+                'status_text': 'Проверка...',
+                'error': 'Статус еще не получен от ведущего воркера'
+            }
+        return status
+
+    def _is_fresh(self, max_age=None):
+        ttl = self.ttl if max_age is None else min(self.ttl, max_age)
+        return self._updated is not None and time.monotonic() - self._updated < ttl
+
+    def _run_probe(self, done, generation):
+        status = None
+        try:
+            status = {**self._probe(), 'checked_at': datetime.now().isoformat()}
+        except Exception as e:
+            logger.error(f"Ошибка фоновой проверки статуса Zeppelin: {e}")
+        finally:
+            with self._lock:
+                if status is not None:
+                    self._status = status
+                    # Проверка, начатая до invalidate(), не считается свежей
+                    if generation == self._generation:
+                        self._updated = time.monotonic()
+                self._inflight = None
+            done.set()
+
+    def get(self, allow_stale=False, wait=True, max_age=None):
+        """
+        Возвращает статус Zeppelin
+
+        Args:
+            allow_stale (bool): Вернуть устаревший статус сразу и обновить его в фоне
+            wait (bool): Ждать проверку, если статуса еще нет совсем
+            max_age (float): Допустимый возраст результата, если он меньше ttl
+
+        Returns:
+            dict: Статус (с ключом 'stale': True, если он устарел) или None,
+                  если wait=False и статус еще ни разу не получен
+        """
+        with self._lock:
+            if self._status is not None and self._is_fresh(max_age):
+                STATUS_CACHE_REQUESTS.inc('hit')
+                return self._status
+        if self._leader is not None and not self._leader.is_leader():
+            return self._from_leader(wait)
+
+        with self._lock:
+            if self._status is not None and self._is_fresh(max_age):
+                STATUS_CACHE_REQUESTS.inc('hit')
+                return self._status
+
+            done = self._inflight
+            owner = done is None
+            if owner:
+                done = self._inflight = threading.Event()
+                generation = self._generation
+
+            STATUS_CACHE_REQUESTS.inc('stale' if self._status is not None and allow_stale else 'miss')
+            if (self._status is not None and allow_stale) or not wait:
+                if owner:
+                    threading.Thread(target=self._run_probe, args=(done, generation), daemon=True).start()
+                return {**self._status, 'stale': True} if self._status is not None else None
+
+        if owner:
+            self._run_probe(done, generation)
+        else:
+            done.wait()
+
+        with self._lock:
+            if self._status is not None:
+                return self._status
+        return {
+            'status': 'error',
+            'status_class': 'danger',
+            'status_text': 'Ошибка проверки',
+            'error': 'Не удалось получить статус'
+        }
+
+    def prime(self, status):
+        """Сохраняет статус, проверенный другим воркером, как свежий"""
+        with self._lock:
+            self._status = status
+            self._updated = time.monotonic()
+        self._primed.set()
+
+    def invalidate(self):
+        """Помечает статус устаревшим (например, после start/stop/restart)"""
+        with self._lock:
+            self._generation += 1
+            self._updated = None
+            self._invalidated = True
+
+
+status_cache = StatusCache(lambda: check_zeppelin_status(), ZEPPELIN_STATUS_TTL)
+
+
+def restart_zeppelin():
+    """
+    Restarts the Zeppelin service.
+    
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    success, message = execute_service_command('restart')
+    if not success:
+        logger.error(f"Ошибка перезапуска Zeppelin: {message}")
+    return success
+
+
+# Общее состояние задач управления сервисом для нескольких воркеров (JSON-файл под flock).
+# По умолчанию service-jobs.json в каталоге шины сообщений; один процесс обходится без файла
+SERVICE_JOBS_STATE = os.environ.get('SERVICE_JOBS_STATE', '')
+
+
+def _worker_alive(worker):
+    """Жив ли процесс воркера (процессы других хостов считаются живыми)"""
+    host, _, pid = worker.rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedJobState:
+    """
+    Задачи управления сервисом, общие для всех воркеров
+
+    JSON-файл {'jobs': {id: снимок задачи}, 'active': [id, ...]} читается и
+    переписывается на месте под fcntl.flock, поэтому блокировка и данные
+    относятся к одному inode. Порядок 'active' - порядок постановки в очередь
+    любым воркером.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def update(self, func):
+        """
+        Выполняет func(state) под исключительной блокировкой и сохраняет state
+
+        Returns:
+            Результат func
+        """
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            run_blocking(fcntl.flock, fd, fcntl.LOCK_EX)
+            state = self._load(fd)
+            result = func(state)
+            data = json.dumps(state, ensure_ascii=False).encode('utf-8')
+            os.ftruncate(fd, 0)
+            os.pwrite(fd, data, 0)
+            return result
+        finally:
+            os.close(fd)
+
+    def read(self):
+        """Возвращает состояние под разделяемой блокировкой"""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            run_blocking(fcntl.flock, fd, fcntl.LOCK_SH)
+            return self._load(fd)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _load(fd):
+        size = os.fstat(fd).st_size
+        try:
+            state = json.loads(os.pread(fd, size, 0)) if size else {}
+        except ValueError:
+            logger.error('Файл состояния задач поврежден, начинаем с пустого')
+            state = {}
+        state.setdefault('jobs', {})
+        state.setdefault('active', [])
+        return state
+
+
+class ServiceJobQueue:
+    """
+    Очередь фоновых операций start/stop/restart для Zeppelin
+
+    Операции выполняются по одной в отдельном рабочем потоке, поэтому
+    конфликтующие команды (stop во время restart) не пересекаются, а запрос
+    возвращается сразу с идентификатором задачи. Повторная отправка той же
+    команды, пока она последней стоит в очереди или выполняется, возвращает
+    уже существующую задачу.
+
+    С shared (SharedJobState) очередь общая для всех воркеров: объединение
+    одинаковых команд и порядок выполнения учитывают задачи других воркеров,
+    задача выполняется воркером, который ее принял, когда она становится первой
+    в общей очереди, а get()/list_jobs() видят задачи всех воркеров.
     """
-    Restarts the Zeppelin service.
-    
+
+    MAX_FINISHED_JOBS = 100
+    # Как часто воркер проверяет, не подошла ли очередь его задачи (секунды)
+    SHARED_POLL_INTERVAL = 0.2
+
+    def __init__(self, executor, on_progress=None, on_finish=None, shared=None):
+        self._executor = executor
+        self._on_progress = on_progress
+        self._on_finish = on_finish
+        self._shared = shared
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._jobs = OrderedDict()   # job_id -> job
+        self._active = []            # id задач в очереди/выполняемых, в порядке отправки
+        self._worker = None
+
+    def submit(self, command, user, client_ip=None):
+        """
+        Ставит операцию в очередь
+
+        Args:
+            command (str): 'start', 'stop' или 'restart'
+            user (str): Инициатор
+            client_ip (str): IP инициатора для журнала
+
+        Returns:
+            tuple: (job: dict, created: bool) - created=False, если задача объединена с существующей
+        """
+        with self._lock:
+            if self._shared is None and self._active and self._jobs[self._active[-1]]['command'] == command:
+                return self._snapshot(self._jobs[self._active[-1]]), False
+
+            job = {
+                'id': uuid.uuid4().hex,
+                'command': command,
+                'user': user,
+                'worker': worker_id(),
+                'client_ip': client_ip,
+                'state': 'queued',
+                'phase': 'queued',
+                'message': 'Ожидает выполнения',
+                'success': None,
+                'created_at': datetime.now().isoformat(),
+                'started_at': None,
+                'finished_at': None,
+                'history': []
+            }
+            if self._shared is not None:
+                existing = self._shared.update(lambda state: self._register_shared(state, job))
+                if existing is not None:
+                    return existing, False
+            self._jobs[job['id']] = job
+            self._active.append(job['id'])
+            self._trim()
+            self._queue.put(job['id'])
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='service-jobs', daemon=True)
+                self._worker.start()
+            snapshot = self._snapshot(job)
+        self._notify(snapshot)
+        return snapshot, True
+
+    def get(self, job_id):
+        """Возвращает копию задачи или None"""
+        if self._shared is not None:
+            return self._shared.read()['jobs'].get(job_id)
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._snapshot(job) if job else None
+
+    def list_jobs(self):
+        """Возвращает копии задач, начиная с последних"""
+        if self._shared is not None:
+            return list(reversed(self._shared.read()['jobs'].values()))
+        with self._lock:
+            return [self._snapshot(job) for job in reversed(self._jobs.values())]
+
+    def _register_shared(self, state, job):
+        """Добавляет задачу в общую очередь или возвращает такую же последнюю активную"""
+        self._prune_shared(state)
+        active = state['active']
+        if active and state['jobs'][active[-1]]['command'] == job['command']:
+            return state['jobs'][active[-1]]
+        state['jobs'][job['id']] = self._snapshot(job)
+        active.append(job['id'])
+        finished = [job_id for job_id, item in state['jobs'].items() if item['state'] in ('succeeded', 'failed')]
+        for job_id in finished[:max(0, len(finished) - self.MAX_FINISHED_JOBS)]:
+            del state['jobs'][job_id]
+        return None
+
+    @staticmethod
+    def _prune_shared(state):
+        # Задачи воркеров, завершившихся до окончания задачи, уже не выполнятся
+        for job_id in list(state['active']):
+            job = state['jobs'].get(job_id)
+            if job is not None and _worker_alive(job['worker']):
+                continue
+            state['active'].remove(job_id)
+            if job is not None:
+                job.update(state='failed', phase='finished', success=False,
+                           message='Воркер, принявший задачу, завершился', finished_at=datetime.now().isoformat())
+
+    def _wait_turn(self, job_id):
+        """Ждет, пока задача станет первой в общей очереди всех воркеров"""
+        def first_active(state):
+            self._prune_shared(state)
+            return state['active'][0] if state['active'] else None
+
+        while self._shared.update(first_active) not in (job_id, None):
+            time.sleep(self.SHARED_POLL_INTERVAL)
+
+    def _store_shared(self, snapshot, finished=False):
+        def store(state):
+            state['jobs'][snapshot['id']] = snapshot
+            if finished and snapshot['id'] in state['active']:
+                state['active'].remove(snapshot['id'])
+        self._shared.update(store)
+
+    def _snapshot(self, job):
+        snapshot = dict(job)
+        snapshot['history'] = list(job['history'])
+        snapshot.pop('client_ip', None)
+        return snapshot
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job['state'] in ('succeeded', 'failed')]
+        for job_id in finished[:max(0, len(finished) - self.MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def _notify(self, snapshot):
+        if self._on_progress:
+            try:
+                self._on_progress(snapshot)
+            except Exception as e:
+                logger.error(f"Ошибка отправки прогресса задачи {snapshot['id']}: {e}")
+
+    def _update(self, job_id, **changes):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(changes)
+            job['history'].append({'phase': job['phase'], 'message': job['message'],
+                                   'timestamp': datetime.now().isoformat()})
+            snapshot = self._snapshot(job)
+        if self._shared is not None:
+            self._store_shared(snapshot, finished=job['state'] in ('succeeded', 'failed'))
+        self._notify(snapshot)
+        return snapshot
+
+    def _run(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._execute(job_id)
+            finally:
+                self._queue.task_done()
+
+    def _execute(self, job_id):
+        if self._shared is not None:
+            self._wait_turn(job_id)
+        with self._lock:
+            command = self._jobs[job_id]['command']
+        self._update(job_id, state='running', phase='started', message='Выполняется',
+                     started_at=datetime.now().isoformat())
+        try:
+            success, message = self._executor(
+                command, progress=lambda phase, text: self._update(job_id, phase=phase, message=text))
+        except Exception as e:
+            logger.error(f"Ошибка выполнения задачи {command}: {e}")
+            success, message = False, f"Неожиданная ошибка: {str(e)}"
+
+        with self._lock:
+            self._active.remove(job_id)
+            client_ip = self._jobs[job_id]['client_ip']
+        snapshot = self._update(job_id, state='succeeded' if success else 'failed', phase='finished',
+                                message=message, success=success, finished_at=datetime.now().isoformat())
+        if self._on_finish:
+            try:
+                self._on_finish(snapshot, client_ip)
+            except Exception as e:
+                logger.error(f"Ошибка завершения задачи {job_id}: {e}")
+
+
+def emit_job_progress(job):
+    """Рассылает состояние задачи управления сервисом"""
+    emit_event('job_progress', job)
+
+
+def finish_service_job(job, client_ip=None):
+    """Журналирует результат задачи и рассылает новый статус Zeppelin"""
+    action = f"{job['command'].upper()}_ZEPPELIN"
+    if job['success']:
+        log_user_action(f'{action}_SUCCESS', job['user'], job['message'], client_ip=client_ip)
+        broadcast_status_change(job['command'], job['user'], job['message'])
+    else:
+        log_user_action(f'{action}_FAILED', job['user'], job['message'], client_ip=client_ip)
+        broadcast_status_change(f"{job['command']}_failed", job['user'], job['message'])
+
+
+def _create_service_jobs():
+    path = SERVICE_JOBS_STATE
+    if not path and message_bus.multi_process:
+        path = os.path.join(message_bus.directory, 'service-jobs.json')
+    shared = SharedJobState(path) if path and fcntl is not None else None
+    return ServiceJobQueue(lambda command, progress: execute_service_command(command, progress),
+                           on_progress=emit_job_progress, on_finish=finish_service_job, shared=shared)
+
+
+service_jobs = _create_service_jobs()
+
+
+# Токен для доступа к /metrics (пустой - без авторизации, например за обратным прокси)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    Метрики в текстовом формате Prometheus
+
     Returns:
-        bool: True if successful, False otherwise
+        Response: text/plain; version=0.0.4
     """
-    success, message = execute_service_command('restart')
-    if not success:
-        logger.error(f"Ошибка перезапуска Zeppelin: {message}")
-    return success
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get('Authorization', ''),
+                                                 f'Bearer {METRICS_TOKEN}'):
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/api/version')
+@realm_conditional(lambda: (get_app_version(),))
 def api_version():
-    """API endpoint для получения версии приложения"""
-    from flask import jsonify
+    """API endpoint для получения версии приложения и версии realm"""
     return jsonify({
         'version': get_app_version(),
+        'realm_version': realm_version(),
         'name': 'Zeppelin User Management',
         'description': 'Modern web interface for Apache Zeppelin user management'
     })
 
 
+@app.route('/api/system_info')
+@login_required
+def api_system_info():
+    """
+    Возвращает закэшированную информацию о системе и способе запуска Zeppelin
+
+    Returns:
+        JSON: Информация о системе, время определения и его длительность
+    """
+    return jsonify(system_info_cache.describe())
+
+
+@app.route('/api/login_throttle')
+@login_required
+def api_login_throttle():
+    """
+    Счетчики ограничения попыток входа для мониторинга
+
+    Returns:
+        JSON: Пропущенные и отклоненные попытки, число отслеживаемых ключей и вытеснений
+    """
+    return jsonify(login_throttle.stats())
+
+
+@app.route('/api/audit')
+@login_required
+def api_audit():
+    """
+    Постраничный журнал аудита из SQLite-хранилища
+
+    Параметры запроса: actor, target, action, since, until (ISO 8601),
+    limit (до AUDIT_PAGE_MAX), cursor (next_cursor предыдущей страницы).
+
+    Returns:
+        JSON: {'events': [...], 'next_cursor': str | None}
+    """
+    if audit_store is None:
+        return jsonify({'success': False, 'error': 'Хранилище аудита отключено'}), 503
+
+    try:
+        bounds = {}
+        for name in ('since', 'until'):
+            value = request.args.get(name)
+            bounds[name] = datetime.fromisoformat(value).timestamp() if value else None
+        limit = int(request.args.get('limit', 50))
+        page = audit_store.query(
+            actor=request.args.get('actor'),
+            target=request.args.get('target'),
+            action=request.args.get('action'),
+            since=bounds['since'],
+            until=bounds['until'],
+            cursor=request.args.get('cursor'),
+            limit=limit,
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Некорректный параметр: {e}'}), 400
+    return jsonify(page)
+
+
+@app.route('/api/system_info/refresh', methods=['POST'])
+@login_required
+def api_system_info_refresh():
+    """
+    Принудительно повторяет определение способа установки Zeppelin
+
+    Returns:
+        JSON: Обновленная информация о системе
+    """
+    current_user = session['username']
+    system_info_cache.refresh()
+    info = system_info_cache.describe()
+    log_user_action('REFRESH_SYSTEM_INFO', current_user,
+                    f"Detected {info['zeppelin_type']} in {info['detection_ms']} ms")
+    return jsonify(info)
+
+
 @app.route('/')
 def login_page():
     """
@@ -882,9 +3803,16 @@ def login():
     """
     username = request.form['username']
     password = request.form['password']
-    users, _, _ = read_shiro_ini()
-    if username in users and users[username]['password'] == password:
+    # Троттлинг до разбора shiro.ini и логирования: перебор паролей не должен нагружать сервер
+    allowed, retry_after = login_throttle.check(request.remote_addr, username)
+    if not allowed:
+        return Response('Слишком много попыток входа. Повторите позже.', status=429,
+                        headers={'Retry-After': str(retry_after)}, mimetype='text/plain')
+    users, _, _ = read_shiro_ini(copy=False)
+    if password_service.verify(username, password, users.get_password(username)):
+        login_throttle.reset_user(username)
         session['username'] = username
+        session['client_id'] = uuid.uuid4().hex
         session['last_activity'] = datetime.now().isoformat()
         session.permanent = True
         log_user_action('LOGIN_SUCCESS', username)
@@ -894,31 +3822,212 @@ def login():
     return redirect(url_for('login_page'))
 
 
+class FragmentCache:
+    """
+    Кэш отрисованных фрагментов HTML, зависящих только от realm
+
+    Ключ - версия realm и набор защищенных пользователей, поэтому любое
+    изменение shiro.ini (в т.ч. внешнее) делает фрагмент неактуальным.
+    Версию нужно снять до чтения shiro.ini: если файл изменится во время
+    отрисовки, фрагмент попадет в кэш под старой версией и следующий
+    запрос отрисует его заново.
+    """
+
+    def __init__(self):
+        self._entries = {}  # имя -> (ключ, значение)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name, version, render):
+        """
+        Возвращает фрагмент из кэша или отрисовывает его
+
+        Args:
+            name (str): Имя фрагмента
+            version (int): Версия realm (None - без кэширования)
+            render (callable): Отрисовка фрагмента
+
+        Returns:
+            Значение, возвращенное render()
+        """
+        key = (version, frozenset(PROTECTED_USERS))
+        with self._lock:
+            entry = self._entries.get(name)
+            if version is not None and entry is not None and entry[0] == key:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # Отрисовка вне блокировки: параллельные промахи отрисуют фрагмент каждый сам
+        value = render()
+        if version is not None:
+            with self._lock:
+                self._entries[name] = (key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+fragment_cache = FragmentCache()
+
+
+def render_realm_fragments():
+    """
+    Отрисовывает части dashboard, зависящие от shiro.ini: списки ролей и число пользователей
+
+    Returns:
+        dict: role_options (Markup) и user_total (int)
+    """
+    users, roles, _ = read_shiro_ini(copy=False)
+    return {
+        'role_options': Markup(render_template('_role_options.html', roles=roles)),
+        'user_total': len(users),
+    }
+
+
+# Поля статуса, которые отрисовывает карточка dashboard и от которых зависит ETag.
+# checked_at и счетчики процесса (CPU время, FD) меняются при каждой проверке:
+# с ними ETag простаивающей вкладки менялся бы каждые ZEPPELIN_STATUS_TTL секунд,
+# а живые значения вкладка все равно получает событием auto_status_update.
+DASHBOARD_STATUS_ETAG_FIELDS = ('status', 'status_class', 'status_text', 'active', 'pid', 'memory_usage',
+                                'uptime', 'enabled', 'service_manager', 'error')
+
+
+def dashboard_status():
+    """
+    Статус Zeppelin для карточки dashboard: последний известный, без ожидания subprocess
+
+    Значение запоминается в g, чтобы ETag страницы и отрисованная карточка
+    строились по одному и тому же статусу.
+    """
+    status = g.get('dashboard_status')
+    if status is None:
+        status = g.dashboard_status = status_cache.get(allow_stale=True, wait=False) or {
+            'status': 'unknown',
+            'status_class': 'secondary',
+            'status_text': 'Проверка...',
+            'active': 'неизвестно',
+            'pid': 'N/A',
+            'memory_usage': 'N/A',
+            'uptime': 'N/A',
+            'stale': True
+        }
+    return status
+
+
+def dashboard_status_variant():
+    """Часть ETag dashboard: только отрисовываемые поля статуса, без времени проверки"""
+    status = dashboard_status()
+    return tuple(str(status.get(field)) for field in DASHBOARD_STATUS_ETAG_FIELDS)
+
+
 @app.route('/dashboard')
 @login_required
+@realm_conditional(lambda: (session['username'], get_app_version(), dashboard_status_variant()))
 def dashboard():
     """
     Renders the dashboard page if the user is logged in.
 
+    The ETag covers the realm version, the user and the rendered Zeppelin status,
+    so a 304 never serves a stale status card.
+
     Returns:
         str: The rendered HTML of the dashboard page.
     """
-    users, roles, _ = read_shiro_ini()
-    zeppelin_status = check_zeppelin_status()
-    
-    # Фильтруем пользователей для отображения (скрываем пароли защищенных пользователей)
-    display_users = {}
-    for username, user_roles in {k: v['roles'] for k, v in users.items()}.items():
-        if is_protected_user(username):
-            display_users[username] = {'roles': user_roles, 'protected': True}
-        else:
-            display_users[username] = {'roles': user_roles, 'protected': False}
-    
+    # Списки ролей берутся из кэша фрагментов: пока shiro.ini не менялся,
+    # файл не читается, а заново рендерятся только flash-сообщения, статус и пользователь
+    fragments = fragment_cache.get('dashboard', g.get('realm_version'), render_realm_fragments)
+    # Не ждем subprocess: показываем последний известный статус, обновление идет в фоне
+    zeppelin_status = dashboard_status()
+
+    # Таблица пользователей подгружается страницами через /api/users,
+    # поэтому размер страницы не зависит от числа пользователей
     return render_template('dashboard.html', 
-                         users=display_users, 
-                         roles=roles,
                          zeppelin_status=zeppelin_status,
-                         protected_users=PROTECTED_USERS)
+                         protected_users=PROTECTED_USERS,
+                         users_page_size=USERS_PAGE_SIZE,
+                         **fragments)
+
+
+USERS_PAGE_SIZE = 50
+USERS_PAGE_MAX = 500
+
+
+def query_users(users, q='', role='', status='', sort='name', offset=0, limit=USERS_PAGE_SIZE):
+    """
+    Фильтрует, сортирует и вырезает страницу пользователей
+
+    Args:
+        users (UserStore): Пользователи
+        q (str): Подстрока имени (без учета регистра)
+        role (str): Только пользователи с этой ролью (через обратный индекс ролей)
+        status (str): protected | normal | '' (все)
+        sort (str): name | -name | file (порядок в shiro.ini)
+        offset (int): Смещение
+        limit (int): Размер страницы
+
+    Returns:
+        tuple: (total: int - всего подходящих, page: list[dict])
+    """
+    if role:
+        # Роли защищенных пользователей скрыты, поэтому по роли они не находятся
+        candidates = [name for name in users.role_members(role) if not is_protected_user(name)]
+        if sort == 'file':
+            member_set = set(candidates)
+            candidates = [name for name in users if name in member_set]
+    else:
+        candidates = list(users)
+
+    needle = q.strip().lower()
+    if needle:
+        candidates = [name for name in candidates if needle in name.lower()]
+    if status == 'protected':
+        candidates = [name for name in candidates if is_protected_user(name)]
+    elif status == 'normal':
+        candidates = [name for name in candidates if not is_protected_user(name)]
+
+    if sort in ('name', '-name'):
+        candidates.sort(key=str.lower, reverse=sort == '-name')
+
+    page = []
+    for name in candidates[offset:offset + limit]:
+        protected = is_protected_user(name)
+        page.append({
+            'username': name,
+            'roles': [] if protected else users.get_roles(name),
+            'protected': protected,
+        })
+    return len(candidates), page
+
+
+@app.route('/api/users')
+@login_required
+@realm_conditional(lambda: (request.query_string.decode('latin-1'),))
+def api_users():
+    """
+    Страница списка пользователей с фильтрацией на сервере
+
+    Параметры запроса: offset, limit (до USERS_PAGE_MAX), q (подстрока имени),
+    role, status (protected|normal), sort (name|-name|file).
+
+    Returns:
+        JSON: {'total', 'offset', 'limit', 'users': [{'username', 'roles', 'protected'}]}
+    """
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = max(1, min(int(request.args.get('limit', USERS_PAGE_SIZE)), USERS_PAGE_MAX))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'offset и limit должны быть числами'}), 400
+    sort = request.args.get('sort', 'name')
+    if sort not in ('name', '-name', 'file'):
+        return jsonify({'success': False, 'error': 'sort: name, -name или file'}), 400
+
+    users, _, _ = read_shiro_ini(copy=False)
+    total, page = query_users(users, q=request.args.get('q', ''), role=request.args.get('role', '').strip(),
+                              status=request.args.get('status', ''), sort=sort, offset=offset, limit=limit)
+    return jsonify({'total': total, 'offset': offset, 'limit': limit, 'users': page})
 
 
 @app.route('/logout')
@@ -960,24 +4069,28 @@ def add_user():
         flash(password_msg, 'error')
         return redirect(url_for('dashboard'))
     
-    users, roles, sections = read_shiro_ini()
-    
-    if new_username not in users:
-        users[new_username] = {'password': password, 'roles': []}
-        if write_shiro_ini(users, roles, sections):
-            flash(f'Пользователь {new_username} успешно добавлен', 'success')
-            log_user_action('ADD_USER', current_user, f'Added user: {new_username}')
+    # Хэш вычисляется до realm_lock, чтобы не задерживать изменения других запросов и воркеров
+    scheme, values = encode_passwords_unlocked([password])
+    with realm_lock:
+        users, roles, sections = read_shiro_ini()
+
+        if new_username not in users:
+            users.set_user(new_username, encoded_for_sections(sections, scheme, [password], values)[0])
+            if write_shiro_ini(users, roles, sections):
+                flash(f'Пользователь {new_username} успешно добавлен', 'success')
+                log_user_action('ADD_USER', current_user, f'Added user: {new_username}', target=new_username)
+            else:
+                log_user_action('ADD_USER_FAILED', current_user, f'Failed to write user: {new_username}', target=new_username)
         else:
-            log_user_action('ADD_USER_FAILED', current_user, f'Failed to write user: {new_username}')
-    else:
-        flash(f'Пользователь {new_username} уже существует', 'warning')
-        log_user_action('ADD_USER_FAILED', current_user, f'User already exists: {new_username}')
+            flash(f'Пользователь {new_username} уже существует', 'warning')
+            log_user_action('ADD_USER_FAILED', current_user, f'User already exists: {new_username}', target=new_username)
     
     return redirect(url_for('dashboard'))
 
 
 @app.route('/delete_user', methods=['POST'])
 @login_required
+@realm_transaction
 def delete_user():
     """
     Deletes a user from the shiro.ini file.
@@ -1000,27 +4113,27 @@ def delete_user():
     # Защита от удаления защищенных пользователей
     if is_protected_user(target_username):
         flash(f'Пользователь {target_username} защищен от удаления', 'error')
-        log_user_action('DELETE_USER_BLOCKED', current_user, f'Attempted to delete protected user: {target_username}')
+        log_user_action('DELETE_USER_BLOCKED', current_user, f'Attempted to delete protected user: {target_username}', target=target_username)
         return redirect(url_for('dashboard'))
     
     users, roles, sections = read_shiro_ini()
     
-    if target_username in users:
-        del users[target_username]
+    if users.remove_user(target_username):
         if write_shiro_ini(users, roles, sections):
             flash(f'Пользователь {target_username} успешно удален', 'success')
-            log_user_action('DELETE_USER', current_user, f'Deleted user: {target_username}')
+            log_user_action('DELETE_USER', current_user, f'Deleted user: {target_username}', target=target_username)
         else:
-            log_user_action('DELETE_USER_FAILED', current_user, f'Failed to delete user: {target_username}')
+            log_user_action('DELETE_USER_FAILED', current_user, f'Failed to delete user: {target_username}', target=target_username)
     else:
         flash(f'Пользователь {target_username} не найден', 'warning')
-        log_user_action('DELETE_USER_FAILED', current_user, f'User not found: {target_username}')
+        log_user_action('DELETE_USER_FAILED', current_user, f'User not found: {target_username}', target=target_username)
     
     return redirect(url_for('dashboard'))
 
 
 @app.route('/assign_user_role', methods=['POST'])
 @login_required
+@realm_transaction
 def assign_user_role():
     """
     Assigns a role to a user in the shiro.ini file.
@@ -1039,31 +4152,31 @@ def assign_user_role():
     # Защита от изменения ролей защищенных пользователей
     if is_protected_user(target_username):
         flash(f'Роли пользователя {target_username} защищены от изменений', 'error')
-        log_user_action('ASSIGN_ROLE_BLOCKED', current_user, f'Attempted to modify protected user: {target_username}')
+        log_user_action('ASSIGN_ROLE_BLOCKED', current_user, f'Attempted to modify protected user: {target_username}', target=target_username)
         return redirect(url_for('dashboard'))
     
     users, roles, sections = read_shiro_ini()
     
     if target_username in users and role in roles:
-        if role not in users[target_username]['roles']:
-            users[target_username]['roles'].append(role)
+        if users.assign_role(target_username, role):
             if write_shiro_ini(users, roles, sections):
                 flash(f'Роль "{role}" назначена пользователю "{target_username}"', 'success')
-                log_user_action('ASSIGN_ROLE', current_user, f'Assigned role "{role}" to user "{target_username}"')
+                log_user_action('ASSIGN_ROLE', current_user, f'Assigned role "{role}" to user "{target_username}"', target=target_username)
             else:
-                log_user_action('ASSIGN_ROLE_FAILED', current_user, f'Failed to assign role "{role}" to user "{target_username}"')
+                log_user_action('ASSIGN_ROLE_FAILED', current_user, f'Failed to assign role "{role}" to user "{target_username}"', target=target_username)
         else:
             flash(f'Роль "{role}" уже назначена пользователю "{target_username}"', 'warning')
-            log_user_action('ASSIGN_ROLE_FAILED', current_user, f'Role "{role}" already assigned to user "{target_username}"')
+            log_user_action('ASSIGN_ROLE_FAILED', current_user, f'Role "{role}" already assigned to user "{target_username}"', target=target_username)
     else:
         flash('Неверный пользователь или роль', 'error')
-        log_user_action('ASSIGN_ROLE_FAILED', current_user, f'Invalid user "{target_username}" or role "{role}"')
+        log_user_action('ASSIGN_ROLE_FAILED', current_user, f'Invalid user "{target_username}" or role "{role}"', target=target_username)
     
     return redirect(url_for('dashboard'))
 
 
 @app.route('/unassign_user_role', methods=['POST'])
 @login_required
+@realm_transaction
 def unassign_user_role():
     """
     Unassigns a role from a user in the shiro.ini file.
@@ -1082,104 +4195,579 @@ def unassign_user_role():
     # Защита от изменения ролей защищенных пользователей
     if is_protected_user(target_username):
         flash(f'Роли пользователя {target_username} защищены от изменений', 'error')
-        log_user_action('UNASSIGN_ROLE_BLOCKED', current_user, f'Attempted to modify protected user: {target_username}')
+        log_user_action('UNASSIGN_ROLE_BLOCKED', current_user, f'Attempted to modify protected user: {target_username}', target=target_username)
         return redirect(url_for('dashboard'))
     
     users, roles, sections = read_shiro_ini()
     
-    if target_username in users and role in users[target_username]['roles']:
-        users[target_username]['roles'].remove(role)
+    if users.unassign_role(target_username, role):
         if write_shiro_ini(users, roles, sections):
             flash(f'Роль "{role}" снята с пользователя "{target_username}"', 'success')
-            log_user_action('UNASSIGN_ROLE', current_user, f'Removed role "{role}" from user "{target_username}"')
+            log_user_action('UNASSIGN_ROLE', current_user, f'Removed role "{role}" from user "{target_username}"', target=target_username)
         else:
-            log_user_action('UNASSIGN_ROLE_FAILED', current_user, f'Failed to remove role "{role}" from user "{target_username}"')
+            log_user_action('UNASSIGN_ROLE_FAILED', current_user, f'Failed to remove role "{role}" from user "{target_username}"', target=target_username)
     else:
         flash(f'Роль "{role}" не найдена у пользователя "{target_username}"', 'warning')
-        log_user_action('UNASSIGN_ROLE_FAILED', current_user, f'Role "{role}" not found for user "{target_username}"')
+        log_user_action('UNASSIGN_ROLE_FAILED', current_user, f'Role "{role}" not found for user "{target_username}"', target=target_username)
+    
+    return redirect(url_for('dashboard'))
+
+
+@app.route('/change_password', methods=['POST'])
+@login_required
+def change_password():
+    """
+    Changes password for an existing user in the shiro.ini file.
+
+    Returns:
+        Response: Redirects to the dashboard.
+    """
+    target_username = request.form.get('username', '').strip()
+    new_password = request.form.get('new_password', '').strip()
+    current_user = session['username']
+    
+    if not target_username or not new_password:
+        flash('Не выбран пользователь или не указан новый пароль', 'error')
+        return redirect(url_for('dashboard'))
+    
+    # Защита от изменения пароля защищенных пользователей
+    if is_protected_user(target_username):
+        flash(f'Пароль пользователя {target_username} защищен от изменений', 'error')
+        log_user_action('CHANGE_PASSWORD_BLOCKED', current_user, f'Attempted to change password for protected user: {target_username}', target=target_username)
+        return redirect(url_for('dashboard'))
+    
+    # Валидация нового пароля
+    valid_password, password_msg = validate_input(new_password, 'Новый пароль', 3, 50)
+    if not valid_password:
+        flash(password_msg, 'error')
+        return redirect(url_for('dashboard'))
+    
+    # Хэш вычисляется до realm_lock, чтобы не задерживать изменения других запросов и воркеров
+    scheme, values = encode_passwords_unlocked([new_password])
+    with realm_lock:
+        users, roles, sections = read_shiro_ini()
+
+        value = encoded_for_sections(sections, scheme, [new_password], values)[0]
+        if users.set_password(target_username, value):
+            if write_shiro_ini(users, roles, sections):
+                flash(f'Пароль пользователя {target_username} успешно изменен', 'success')
+                log_user_action('CHANGE_PASSWORD', current_user, f'Changed password for user: {target_username}', target=target_username)
+            else:
+                log_user_action('CHANGE_PASSWORD_FAILED', current_user, f'Failed to change password for user: {target_username}', target=target_username)
+        else:
+            flash(f'Пользователь {target_username} не найден', 'warning')
+            log_user_action('CHANGE_PASSWORD_FAILED', current_user, f'User not found: {target_username}', target=target_username)
+    
+    return redirect(url_for('dashboard'))
+
+
+@app.route('/add_role', methods=['POST'])
+@login_required
+@realm_transaction
+def add_role():
+    """
+    Adds a new role to the shiro.ini file.
+
+    Returns:
+        Response: Redirects to the dashboard.
+    """
+    role_name = request.form.get('role_name', '').strip()
+    current_user = session['username']
+    
+    # Валидация входных данных
+    valid_role, role_msg = validate_input(role_name, 'Название роли', 2, 30)
+    if not valid_role:
+        flash(role_msg, 'error')
+        return redirect(url_for('dashboard'))
+    
+    users, roles, sections = read_shiro_ini()
+    
+    if role_name not in roles:
+        roles[role_name] = '*'
+        if write_shiro_ini(users, roles, sections):
+            flash(f'Роль "{role_name}" успешно добавлена', 'success')
+            log_user_action('ADD_ROLE', current_user, f'Added role: {role_name}', target=role_name)
+        else:
+            log_user_action('ADD_ROLE_FAILED', current_user, f'Failed to add role: {role_name}', target=role_name)
+    else:
+        flash(f'Роль "{role_name}" уже существует', 'warning')
+        log_user_action('ADD_ROLE_FAILED', current_user, f'Role already exists: {role_name}', target=role_name)
     
     return redirect(url_for('dashboard'))
 
 
-@app.route('/change_password', methods=['POST'])
-@login_required
-def change_password():
+# Максимальное количество операций в одном пакетном запросе
+MAX_BATCH_OPERATIONS = 5000
+
+
+def _operation_password(operation):
+    """Пароль операции add_user/change_password, если он пройдет проверку, иначе None"""
+    if not isinstance(operation, dict) or operation.get('op') not in ('add_user', 'change_password'):
+        return None
+    field = 'password' if operation['op'] == 'add_user' else 'new_password'
+    password = str(operation.get(field) or '').strip()
+    return password if validate_input(password, 'Пароль', 3, 50)[0] else None
+
+
+def apply_user_operation(users, roles, operation, current_user, sections=None, password_value=None):
+    """
+    Применяет одну операцию над пользователями/ролями в памяти
+
+    Правила проверки совпадают с правилами одиночных маршрутов
+    (validate_input, is_protected_user, запрет удаления самого себя).
+
+    Args:
+        users (UserStore): Пользователи
+        roles (dict): Роли
+        operation (dict): Операция, например {'op': 'add_user', 'username': 'bob', 'password': 'secret'}
+        current_user (str): Пользователь, выполняющий операцию
+        sections (dict): Секции shiro.ini, определяют схему хэширования паролей
+        password_value (str): Пароль, заранее подготовленный encode_passwords_unlocked();
+                              None - хэшируется здесь
+
+    Returns:
+        tuple: (success: bool, message: str, action: str, details: str)
+    """
+    if not isinstance(operation, dict):
+        return False, 'Операция должна быть объектом', 'BATCH_INVALID', 'Operation is not an object'
+
+    op = operation.get('op')
+    username = str(operation.get('username') or '').strip()
+    role = str(operation.get('role') or '').strip()
+
+    if op == 'add_user':
+        password = str(operation.get('password') or '').strip()
+        valid_username, username_msg = validate_input(username, 'Имя пользователя', 3, 30)
+        if not valid_username:
+            return False, username_msg, 'ADD_USER_FAILED', f'Invalid username: {username}'
+        valid_password, password_msg = validate_input(password, 'Пароль', 3, 50)
+        if not valid_password:
+            return False, password_msg, 'ADD_USER_FAILED', f'Invalid password for user: {username}'
+        if username in users:
+            return False, f'Пользователь {username} уже существует', 'ADD_USER_FAILED', f'User already exists: {username}'
+        users.set_user(username, password_value or password_service.encode(password, sections or {}))
+        return True, f'Пользователь {username} успешно добавлен', 'ADD_USER', f'Added user: {username}'
+
+    if op == 'delete_user':
+        if not username:
+            return False, 'Не выбран пользователь для удаления', 'DELETE_USER_FAILED', 'Empty username'
+        if username == current_user:
+            return False, 'Нельзя удалить самого себя', 'DELETE_USER_FAILED', f'Attempted to delete self: {username}'
+        if is_protected_user(username):
+            return (False, f'Пользователь {username} защищен от удаления', 'DELETE_USER_BLOCKED',
+                    f'Attempted to delete protected user: {username}')
+        if not users.remove_user(username):
+            return False, f'Пользователь {username} не найден', 'DELETE_USER_FAILED', f'User not found: {username}'
+        return True, f'Пользователь {username} успешно удален', 'DELETE_USER', f'Deleted user: {username}'
+
+    if op in ('assign_role', 'unassign_role'):
+        prefix = 'ASSIGN_ROLE' if op == 'assign_role' else 'UNASSIGN_ROLE'
+        if not username or not role:
+            return False, 'Не выбран пользователь или роль', f'{prefix}_FAILED', 'Empty username or role'
+        if is_protected_user(username):
+            return (False, f'Роли пользователя {username} защищены от изменений', f'{prefix}_BLOCKED',
+                    f'Attempted to modify protected user: {username}')
+        if op == 'assign_role':
+            if username not in users or role not in roles:
+                return (False, 'Неверный пользователь или роль', 'ASSIGN_ROLE_FAILED',
+                        f'Invalid user "{username}" or role "{role}"')
+            if not users.assign_role(username, role):
+                return (False, f'Роль "{role}" уже назначена пользователю "{username}"', 'ASSIGN_ROLE_FAILED',
+                        f'Role "{role}" already assigned to user "{username}"')
+            return (True, f'Роль "{role}" назначена пользователю "{username}"', 'ASSIGN_ROLE',
+                    f'Assigned role "{role}" to user "{username}"')
+        if not users.unassign_role(username, role):
+            return (False, f'Роль "{role}" не найдена у пользователя "{username}"', 'UNASSIGN_ROLE_FAILED',
+                    f'Role "{role}" not found for user "{username}"')
+        return (True, f'Роль "{role}" снята с пользователя "{username}"', 'UNASSIGN_ROLE',
+                f'Removed role "{role}" from user "{username}"')
+
+    if op == 'change_password':
+        new_password = str(operation.get('new_password') or '').strip()
+        if not username or not new_password:
+            return (False, 'Не выбран пользователь или не указан новый пароль', 'CHANGE_PASSWORD_FAILED',
+                    'Empty username or password')
+        if is_protected_user(username):
+            return (False, f'Пароль пользователя {username} защищен от изменений', 'CHANGE_PASSWORD_BLOCKED',
+                    f'Attempted to change password for protected user: {username}')
+        valid_password, password_msg = validate_input(new_password, 'Новый пароль', 3, 50)
+        if not valid_password:
+            return False, password_msg, 'CHANGE_PASSWORD_FAILED', f'Invalid password for user: {username}'
+        if not users.set_password(username, password_value or password_service.encode(new_password, sections or {})):
+            return (False, f'Пользователь {username} не найден', 'CHANGE_PASSWORD_FAILED',
+                    f'User not found: {username}')
+        return (True, f'Пароль пользователя {username} успешно изменен', 'CHANGE_PASSWORD',
+                f'Changed password for user: {username}')
+
+    if op == 'add_role':
+        role_name = str(operation.get('role_name') or '').strip()
+        valid_role, role_msg = validate_input(role_name, 'Название роли', 2, 30)
+        if not valid_role:
+            return False, role_msg, 'ADD_ROLE_FAILED', f'Invalid role name: {role_name}'
+        if role_name in roles:
+            return False, f'Роль "{role_name}" уже существует', 'ADD_ROLE_FAILED', f'Role already exists: {role_name}'
+        roles[role_name] = '*'
+        return True, f'Роль "{role_name}" успешно добавлена', 'ADD_ROLE', f'Added role: {role_name}'
+
+    return False, f'Неизвестная операция: {op}', 'BATCH_INVALID', f'Unknown operation: {op}'
+
+
+@app.route('/api/batch', methods=['POST'])
+@login_required
+def api_batch():
+    """
+    Пакетное изменение пользователей и ролей
+
+    Принимает JSON-список операций (или объект {"operations": [...]}), проверяет
+    и применяет их по порядку в памяти и сохраняет shiro.ini одной записью.
+    Если хотя бы одна операция не прошла проверку, ничего не сохраняется.
+    Пароли add_user/change_password хэшируются параллельно пулом
+    PasswordService до входа в realm_lock.
+
+    Returns:
+        JSON: {'success': bool, 'applied': int, 'results': [...]}
+    """
+    current_user = session['username']
+    payload = request.get_json(silent=True)
+    operations = payload.get('operations') if isinstance(payload, dict) else payload
+
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'success': False, 'error': 'Ожидается непустой JSON-список операций'}), 400
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({'success': False,
+                        'error': f'Слишком много операций: максимум {MAX_BATCH_OPERATIONS}'}), 400
+
+    # Пароли хэшируются до realm_lock, под блокировкой результаты только применяются
+    passwords = {}
+    for index, operation in enumerate(operations):
+        password = _operation_password(operation)
+        if password is not None:
+            passwords[index] = password
+    scheme, values = encode_passwords_unlocked(list(passwords.values()))
+
+    with realm_lock:
+        users, roles, sections = read_shiro_ini()
+        values = encoded_for_sections(sections, scheme, list(passwords.values()), values)
+        prepared = dict(zip(passwords, values))
+
+        results = []
+        audit = []
+        for index, operation in enumerate(operations):
+            success, message, action, details = apply_user_operation(users, roles, operation, current_user,
+                                                                     sections, prepared.get(index))
+            op = operation.get('op') if isinstance(operation, dict) else None
+            results.append({'index': index, 'op': op, 'success': success, 'message': message})
+            target = (operation.get('username') or operation.get('role_name')) if isinstance(operation, dict) else None
+            audit.append((action, details, target))
+
+        failed = [result for result in results if not result['success']]
+        if failed:
+            log_user_action('BATCH_REJECTED', current_user,
+                            f'{len(failed)} of {len(operations)} operations failed validation, nothing written')
+            return jsonify({'success': False, 'applied': 0, 'results': results}), 400
+
+        if not write_shiro_ini(users, roles, sections):
+            log_user_action('BATCH_FAILED', current_user, f'Failed to write {len(operations)} operations')
+            return jsonify({'success': False, 'applied': 0, 'results': results,
+                            'error': 'Ошибка записи в файл конфигурации'}), 500
+
+        for action, details, target in audit:
+            log_user_action(action, current_user, details, target=target)
+        log_user_action('BATCH', current_user, f'Applied {len(operations)} operations')
+        return jsonify({'success': True, 'applied': len(operations), 'results': results})
+
+
+# Как часто (в строках) отправлять прогресс импорта через SocketIO
+IMPORT_PROGRESS_EVERY = 1000
+# Сколько паролей импорта хэшируется одной партией в пуле PasswordService
+IMPORT_HASH_BATCH = 256
+
+
+def iter_import_records(text_stream, fmt):
     """
-    Changes password for an existing user in the shiro.ini file.
+    Построчно читает файл импорта, не загружая его целиком в память
+
+    CSV: колонки username, password, roles (роли через запятую/точку с запятой
+    внутри одной колонки), строка заголовка необязательна.
+    JSONL: по одному объекту {"username", "password", "roles"} на строку,
+    roles - список или строка.
+
+    Args:
+        text_stream: Итерируемый текстовый поток (строки с переводами строк)
+        fmt (str): 'csv' или 'jsonl'
+
+    Yields:
+        tuple: (line_no: int, record: dict | None, error: str | None)
+    """
+    if fmt == 'jsonl':
+        for line_no, line in enumerate(text_stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_no, None, f'Некорректный JSON: {e}'
+                continue
+            if not isinstance(record, dict):
+                yield line_no, None, 'Строка должна быть JSON-объектом'
+                continue
+            yield line_no, record, None
+        return
+
+    columns = ('username', 'password', 'roles')
+    for line_no, row in enumerate(csv.reader(text_stream), start=1):
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        if line_no == 1 and row[0].strip().lower() == 'username':
+            columns = tuple(cell.strip().lower() for cell in row)
+            continue
+        yield line_no, dict(zip(columns, row)), None
+
+
+def _validate_import_record(record, users, roles, update_existing):
+    """
+    Проверяет одну запись импорта
 
     Returns:
-        Response: Redirects to the dashboard.
+        tuple: (error: str | None, username, password, user_roles)
     """
-    target_username = request.form.get('username', '').strip()
-    new_password = request.form.get('new_password', '').strip()
-    current_user = session['username']
-    
-    if not target_username or not new_password:
-        flash('Не выбран пользователь или не указан новый пароль', 'error')
-        return redirect(url_for('dashboard'))
-    
-    # Защита от изменения пароля защищенных пользователей
-    if is_protected_user(target_username):
-        flash(f'Пароль пользователя {target_username} защищен от изменений', 'error')
-        log_user_action('CHANGE_PASSWORD_BLOCKED', current_user, f'Attempted to change password for protected user: {target_username}')
-        return redirect(url_for('dashboard'))
-    
-    # Валидация нового пароля
-    valid_password, password_msg = validate_input(new_password, 'Новый пароль', 3, 50)
+    username = str(record.get('username') or '').strip()
+    password = str(record.get('password') or '').strip()
+    raw_roles = record.get('roles') or []
+    if isinstance(raw_roles, str):
+        raw_roles = re.split(r'[,;]', raw_roles)
+    user_roles = [str(role).strip() for role in raw_roles if str(role).strip()]
+
+    valid_username, username_msg = validate_input(username, 'Имя пользователя', 3, 30)
+    if not valid_username:
+        return username_msg, username, password, user_roles
+    valid_password, password_msg = validate_input(password, 'Пароль', 3, 50)
     if not valid_password:
-        flash(password_msg, 'error')
-        return redirect(url_for('dashboard'))
-    
-    users, roles, sections = read_shiro_ini()
-    
-    if target_username in users:
-        old_password = users[target_username]['password']
-        users[target_username]['password'] = new_password
-        
-        if write_shiro_ini(users, roles, sections):
-            flash(f'Пароль пользователя {target_username} успешно изменен', 'success')
-            log_user_action('CHANGE_PASSWORD', current_user, f'Changed password for user: {target_username}')
+        return password_msg, username, password, user_roles
+    if is_protected_user(username):
+        return f'Пользователь {username} защищен от изменений', username, password, user_roles
+    if username in users and not update_existing:
+        return f'Пользователь {username} уже существует', username, password, user_roles
+    unknown_roles = [role for role in user_roles if role not in roles]
+    if unknown_roles:
+        return f'Неизвестные роли: {", ".join(unknown_roles)}', username, password, user_roles
+    return None, username, password, user_roles
+
+
+def import_users(records, current_user, update_existing=False, progress_callback=None):
+    """
+    Импортирует пользователей из потока записей одной атомарной записью shiro.ini
+
+    Некорректные строки пропускаются и сразу же отдаются вызывающему коду.
+    Корректные строки проверяются по снимку shiro.ini, а их пароли хэшируются
+    партиями в пуле PasswordService без блокировки: при PasswordMatcher хэш
+    стоит сотни миллисекунд, и realm_lock на все время импорта остановил бы
+    остальные изменения. Блокировка берется только на слияние с актуальным
+    файлом и запись; строки, которые за это время стали конфликтовать
+    (пользователь появился, роль удалена), отклоняются.
+
+    Args:
+        records: Итератор (line_no, record, error) из iter_import_records
+        current_user (str): Пользователь, выполняющий импорт
+        update_existing (bool): Перезаписывать существующих пользователей
+        progress_callback (callable): Вызывается с (processed, imported, errors)
+
+    Yields:
+        dict: {'line': n, 'error': str} для каждой ошибочной строки и итоговый
+              {'summary': {...}} последним элементом
+    """
+    snapshot_users, snapshot_roles, snapshot_sections = read_shiro_ini(copy=False)
+    scheme = resolve_password_scheme(snapshot_sections)
+    accepted = {}  # username -> (line_no, значение пароля, роли); повторная строка заменяет прежнюю
+    batch = []
+    seen = set()
+    processed = errors = 0
+
+    def encode_batch():
+        encoded = password_service.encode_many([password for _, _, password, _ in batch], scheme)
+        for (line_no, username, _, user_roles), value in zip(batch, encoded):
+            accepted[username] = (line_no, value, user_roles)
+        batch.clear()
+
+    for line_no, record, error in records:
+        processed += 1
+        if error is None:
+            error, username, password, user_roles = _validate_import_record(
+                record, snapshot_users, snapshot_roles, update_existing)
+            if error is None and not update_existing and username in seen:
+                error = f'Пользователь {username} уже существует'
+        if error is not None:
+            errors += 1
+            yield {'line': line_no, 'error': error}
         else:
-            log_user_action('CHANGE_PASSWORD_FAILED', current_user, f'Failed to change password for user: {target_username}')
+            seen.add(username)
+            batch.append((line_no, username, password, user_roles))
+            if len(batch) >= IMPORT_HASH_BATCH:
+                encode_batch()
+
+        if progress_callback and processed % IMPORT_PROGRESS_EVERY == 0:
+            progress_callback(processed, len(accepted) + len(batch), errors)
+    encode_batch()
+
+    conflicts = []
+    written = True
+    imported = 0
+    if accepted:
+        with realm_lock:
+            users, roles, sections = read_shiro_ini()
+            if resolve_password_scheme(sections) != scheme:
+                # Схема хэширования сменилась во время импорта: хэши не подходят
+                conflicts.append({'line': 0, 'error': 'Настройки хэширования паролей изменились во время импорта'})
+                written = False
+            else:
+                for username, (line_no, value, user_roles) in accepted.items():
+                    conflict = None
+                    if username in users and not update_existing:
+                        conflict = f'Пользователь {username} уже существует'
+                    elif any(role not in roles for role in user_roles):
+                        conflict = f'Неизвестные роли: {", ".join(r for r in user_roles if r not in roles)}'
+                    if conflict is not None:
+                        conflicts.append({'line': line_no, 'error': conflict})
+                        continue
+                    users.set_user(username, value, user_roles)
+                    imported += 1
+                if imported:
+                    written = write_shiro_ini(users, roles, sections)
+
+    for conflict in conflicts:
+        errors += 1
+        yield conflict
+    if progress_callback:
+        progress_callback(processed, imported if written else 0, errors)
+
+    summary = {'processed': processed, 'imported': imported if written else 0,
+               'errors': errors, 'success': written}
+    if written:
+        log_user_action('IMPORT_USERS', current_user,
+                        f'Imported {imported} users, {errors} rows rejected out of {processed}')
     else:
-        flash(f'Пользователь {target_username} не найден', 'warning')
-        log_user_action('CHANGE_PASSWORD_FAILED', current_user, f'User not found: {target_username}')
-    
-    return redirect(url_for('dashboard'))
+        log_user_action('IMPORT_USERS_FAILED', current_user, f'Failed to write {imported} imported users')
+    yield {'summary': summary}
 
 
-@app.route('/add_role', methods=['POST'])
+def _detect_import_format(filename, requested=None):
+    """Определяет формат файла импорта по параметру или расширению"""
+    fmt = (requested or '').lower() or ('jsonl' if (filename or '').lower().endswith(('.jsonl', '.ndjson')) else 'csv')
+    return fmt if fmt in ('csv', 'jsonl') else None
+
+
+@app.route('/api/import', methods=['POST'])
 @login_required
-def add_role():
+def api_import_users():
     """
-    Adds a new role to the shiro.ini file.
+    Потоковый импорт пользователей из CSV/JSONL
+
+    Файл передается полем формы "file" или телом запроса. Ответ отдается
+    построчно в формате NDJSON: ошибки строк по мере обработки, в конце
+    итоговая сводка. Прогресс дополнительно отправляется событием
+    import_progress через SocketIO вкладкам сессии, запустившей импорт.
+
+    Query params:
+        format: csv | jsonl (по умолчанию определяется по расширению)
+        update_existing: 1 чтобы перезаписывать существующих пользователей
 
     Returns:
-        Response: Redirects to the dashboard.
+        Response: application/x-ndjson
     """
-    role_name = request.form.get('role_name', '').strip()
     current_user = session['username']
-    
-    # Валидация входных данных
-    valid_role, role_msg = validate_input(role_name, 'Название роли', 2, 30)
-    if not valid_role:
-        flash(role_msg, 'error')
-        return redirect(url_for('dashboard'))
-    
-    users, roles, sections = read_shiro_ini()
-    
-    if role_name not in roles:
-        roles[role_name] = '*'
-        if write_shiro_ini(users, roles, sections):
-            flash(f'Роль "{role_name}" успешно добавлена', 'success')
-            log_user_action('ADD_ROLE', current_user, f'Added role: {role_name}')
-        else:
-            log_user_action('ADD_ROLE_FAILED', current_user, f'Failed to add role: {role_name}')
-    else:
-        flash(f'Роль "{role_name}" уже существует', 'warning')
-        log_user_action('ADD_ROLE_FAILED', current_user, f'Role already exists: {role_name}')
-    
-    return redirect(url_for('dashboard'))
+    upload = request.files.get('file')
+    raw_stream = upload.stream if upload else request.stream
+    fmt = _detect_import_format(upload.filename if upload else None, request.args.get('format'))
+    if fmt is None:
+        return jsonify({'success': False, 'error': 'Поддерживаются форматы csv и jsonl'}), 400
+
+    update_existing = request.args.get('update_existing', '').lower() in ('1', 'true', 'yes')
+    import_id = uuid.uuid4().hex
+    # Прогресс нужен только сессии, запустившей импорт
+    session.setdefault('client_id', uuid.uuid4().hex)
+    room = session_room()
+    log_user_action('IMPORT_USERS_STARTED', current_user, f'Import {import_id} ({fmt})')
+
+    def emit_progress(processed, imported, errors, done=False):
+        emit_event('import_progress', {
+            'import_id': import_id,
+            'user': current_user,
+            'processed': processed,
+            'imported': imported,
+            'errors': errors,
+            'done': done,
+            'timestamp': datetime.now().isoformat()
+        }, room=room)
+
+    def generate():
+        # Декодируем построчно: TextIOWrapper не работает с SpooledTemporaryFile в Python < 3.11
+        text_lines = (line.decode('utf-8-sig', errors='replace') for line in raw_stream)
+        records = iter_import_records(text_lines, fmt)
+        # Первое событие сразу показывает индикатор во вкладке, не дожидаясь IMPORT_PROGRESS_EVERY строк
+        emit_progress(0, 0, 0)
+        for event in import_users(records, current_user, update_existing, emit_progress):
+            if 'summary' in event:
+                summary = event['summary']
+                emit_progress(summary['processed'], summary['imported'], summary['errors'], done=True)
+                event = {'import_id': import_id, **summary}
+            yield json.dumps(event, ensure_ascii=False) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.cli.command('audit-compact')
+def audit_compact_command():
+    """Удаляет события аудита старше AUDIT_RETENTION_DAYS и сжимает базу"""
+    if audit_store is None:
+        raise click.ClickException('Хранилище аудита отключено')
+    deleted = audit_store.compact()
+    click.echo(f'Удалено событий: {deleted}, осталось: {audit_store.count()}')
+
+
+@app.cli.command('vendor-assets')
+@click.option('--force', is_flag=True, help='Загрузить заново уже скачанные файлы')
+def vendor_assets_command(force):
+    """Скачивает закрепленные версии Bootstrap, Popper и клиента socket.io в static/vendor"""
+    for name, url in VENDOR_ASSETS.items():
+        path = os.path.join(app.static_folder, vendor_filename(name))
+        if os.path.exists(path) and not force:
+            click.echo(f'{name}: уже есть ({path})')
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            with urllib.request.urlopen(url, timeout=30) as response:
+                content = response.read()
+        except OSError as e:
+            raise click.ClickException(f'{name}: не удалось загрузить {url}: {e}')
+        with open(path + '.tmp', 'wb') as f:
+            f.write(content)
+        os.replace(path + '.tmp', path)
+        click.echo(f'{name}: {len(content)} байт -> {path}')
+
+
+@app.cli.command('import-users')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default=None,
+              help='Формат файла (по умолчанию по расширению)')
+@click.option('--update-existing', is_flag=True, help='Перезаписывать существующих пользователей')
+@click.option('--actor', default='cli', help='Имя пользователя для журнала действий')
+def import_users_command(path, fmt, update_existing, actor):
+    """Импортирует пользователей из CSV/JSONL файла в shiro.ini"""
+    fmt = _detect_import_format(path, fmt)
+
+    def print_progress(processed, imported, errors):
+        click.echo(f'\rОбработано: {processed}, импортировано: {imported}, ошибок: {errors}', nl=False, err=True)
+
+    with open(path, 'r', encoding='utf-8-sig', newline='') as text_stream:
+        for event in import_users(iter_import_records(text_stream, fmt), actor, update_existing, print_progress):
+            if 'summary' in event:
+                summary = event['summary']
+                click.echo('', err=True)
+                click.echo(json.dumps(summary, ensure_ascii=False))
+                if not summary['success']:
+                    raise SystemExit(1)
+            else:
+                click.echo(f"\rСтрока {event['line']}: {event['error']}", err=True)
 
 
 @app.route('/check_zeppelin_status')
@@ -1196,86 +4784,94 @@ def check_status():
     current_user = session['username']
     log_user_action('CHECK_ZEPPELIN_STATUS', current_user, 'Checked Zeppelin service status')
     
-    status = check_zeppelin_status()
+    status = status_cache.get()
     return jsonify(status)
 
 
+def _submit_service_job(command, action):
+    """
+    Ставит операцию управления сервисом в очередь и формирует ответ
+
+    JSON-клиенты получают 202 с задачей, формы - редирект на dashboard с сообщением.
+    """
+    current_user = session['username']
+    job, created = service_jobs.submit(command, current_user, request.remote_addr)
+    if created:
+        log_user_action(action, current_user, f"Queued Zeppelin service {command} (job {job['id']})")
+    else:
+        log_user_action(f'{action}_DEDUPLICATED', current_user, f"Joined running job {job['id']}")
+
+    if request.accept_mimetypes.best == 'application/json' or request.is_json:
+        return jsonify({'job': job, 'created': created}), 202
+
+    if created:
+        flash(f'Операция {command} поставлена в очередь (задача {job["id"][:8]})', 'info')
+    else:
+        flash(f'Операция {command} уже выполняется (задача {job["id"][:8]})', 'warning')
+    return redirect(url_for('dashboard'))
+
+
 @app.route('/start_zeppelin', methods=['POST'])
 @login_required
 def start_zeppelin():
     """
-    Запускает сервис Zeppelin
+    Запускает сервис Zeppelin в фоновой задаче
     
     Returns:
-        Response: Redirects to the dashboard.
+        Response: Redirects to the dashboard (или 202 с задачей для JSON-клиентов).
     """
-    current_user = session['username']
-    log_user_action('START_ZEPPELIN', current_user, 'Initiated Zeppelin service start')
-    
-    success, message = execute_service_command('start')
-    
-    if success:
-        flash(f'Сервис Zeppelin: {message}', 'success')
-        log_user_action('START_ZEPPELIN_SUCCESS', current_user, message)
-        broadcast_status_change('start', current_user, message)
-    else:
-        flash(f'Ошибка запуска Zeppelin: {message}', 'error')
-        log_user_action('START_ZEPPELIN_FAILED', current_user, message)
-        broadcast_status_change('start_failed', current_user, message)
-    
-    return redirect(url_for('dashboard'))
+    return _submit_service_job('start', 'START_ZEPPELIN')
 
 
 @app.route('/stop_zeppelin', methods=['POST'])
 @login_required
 def stop_zeppelin():
     """
-    Останавливает сервис Zeppelin
+    Останавливает сервис Zeppelin в фоновой задаче
     
     Returns:
-        Response: Redirects to the dashboard.
+        Response: Redirects to the dashboard (или 202 с задачей для JSON-клиентов).
     """
-    current_user = session['username']
-    log_user_action('STOP_ZEPPELIN', current_user, 'Initiated Zeppelin service stop')
-    
-    success, message = execute_service_command('stop')
-    
-    if success:
-        flash(f'Сервис Zeppelin: {message}', 'success')
-        log_user_action('STOP_ZEPPELIN_SUCCESS', current_user, message)
-        broadcast_status_change('stop', current_user, message)
-    else:
-        flash(f'Ошибка остановки Zeppelin: {message}', 'error')
-        log_user_action('STOP_ZEPPELIN_FAILED', current_user, message)
-        broadcast_status_change('stop_failed', current_user, message)
-    
-    return redirect(url_for('dashboard'))
+    return _submit_service_job('stop', 'STOP_ZEPPELIN')
 
 
 @app.route('/restart_zeppelin', methods=['POST'])
 @login_required
 def restart():
     """
-    Restarts the Zeppelin service.
+    Restarts the Zeppelin service in a background job.
 
     Returns:
-        Response: Redirects to the dashboard.
+        Response: Redirects to the dashboard (or 202 with the job for JSON clients).
     """
-    current_user = session['username']
-    log_user_action('RESTART_ZEPPELIN', current_user, 'Initiated Zeppelin service restart')
-    
-    success, message = execute_service_command('restart')
-    
-    if success:
-        flash(f'Сервис Zeppelin: {message}', 'success')
-        log_user_action('RESTART_ZEPPELIN_SUCCESS', current_user, message)
-        broadcast_status_change('restart', current_user, message)
-    else:
-        flash(f'Ошибка перезапуска Zeppelin: {message}', 'error')
-        log_user_action('RESTART_ZEPPELIN_FAILED', current_user, message)
-        broadcast_status_change('restart_failed', current_user, message)
-    
-    return redirect(url_for('dashboard'))
+    return _submit_service_job('restart', 'RESTART_ZEPPELIN')
+
+
+@app.route('/api/jobs')
+@login_required
+def api_jobs():
+    """
+    Возвращает последние задачи управления сервисом
+
+    Returns:
+        JSON: Список задач, начиная с последних
+    """
+    return jsonify(service_jobs.list_jobs())
+
+
+@app.route('/api/jobs/<job_id>')
+@login_required
+def api_job(job_id):
+    """
+    Возвращает состояние задачи управления сервисом
+
+    Returns:
+        JSON: Задача с историей этапов или 404
+    """
+    job = service_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Задача не найдена'}), 404
+    return jsonify(job)
 
 
 # WebSocket события
@@ -1287,11 +4883,16 @@ def handle_connect():
         return False
     
     logger.info(f"WebSocket подключение: {session['username']} ({request.remote_addr})")
+    status_publisher.client_connected(request.sid)
+    shiro_watcher.start()
+    if session_room():
+        join_room(session_room())
     emit('connected', {'message': f'Добро пожаловать, {session["username"]}!'})
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Обработка отключения клиента"""
+    status_publisher.client_disconnected(request.sid)
     if 'username' in session:
         logger.info(f"WebSocket отключение: {session['username']}")
 
@@ -1302,7 +4903,7 @@ def handle_status_request():
         return
     
     try:
-        status = check_zeppelin_status()
+        status = status_cache.get()
         emit('status_update', {
             'status': status,
             'timestamp': datetime.now().isoformat(),
@@ -1315,8 +4916,11 @@ def handle_status_request():
 def broadcast_status_change(action, user, details=None):
     """Рассылка изменений статуса всем подключенным клиентам"""
     try:
-        status = check_zeppelin_status()
-        socketio.emit('status_change', {
+        # После start/stop/restart закэшированный статус неактуален
+        status_cache.invalidate()
+        status = status_cache.get()
+        status_publisher.notify_action(status)
+        emit_event('status_change', {
             'action': action,
             'user': user,
             'details': details,
@@ -1326,41 +4930,604 @@ def broadcast_status_change(action, user, details=None):
     except Exception as e:
         logger.error(f"Ошибка при рассылке статуса: {e}")
 
-def broadcast_user_change(action, username, user_data=None):
-    """Рассылка изменений пользователей всем подключенным клиентам"""
+def broadcast_user_change(action, username, user_data=None, total_users=None, user=None, source='app'):
+    """
+    Рассылка изменения пользователей клиентам этого воркера
+
+    Каждый воркер сам замечает изменение shiro.ini (ShiroWatcher), поэтому
+    событие не передается через шину сообщений.
+
+    Args:
+        action (str): add/delete/update, roles (изменена секция [roles]) или bulk (сводка)
+        username (str): Пользователь (None для roles/bulk)
+        user_data (dict): Подробности изменения, без паролей
+        total_users (int): Число пользователей после изменения
+        user (str): Кто изменил (None, если неизвестно)
+        source (str): app - изменение через приложение, external - файл изменен напрямую
+    """
     try:
-        socketio.emit('user_change', {
+        emit_event('user_change', {
             'action': action,
             'username': username,
             'user_data': user_data,
+            'user': user,
+            'source': source,
             'timestamp': datetime.now().isoformat(),
-            'total_users': len(users)
-        })
+            'total_users': total_users
+        }, local=True)
     except Exception as e:
         logger.error(f"Ошибка при рассылке изменений пользователей: {e}")
 
-# Автоматическое обновление статуса каждые 30 секунд
-def auto_status_broadcast():
-    """Автоматическая рассылка статуса каждые 30 секунд"""
-    while True:
-        try:
-            time.sleep(30)
-            # Используем функцию check_zeppelin_status
-            with app.app_context():
-                status = check_zeppelin_status()
-                socketio.emit('auto_status_update', {
-                    'status': status,
-                    'timestamp': datetime.now().isoformat()
-                })
-        except Exception as e:
-            logger.error(f"Ошибка автоматического обновления статуса: {e}")
 
-# Запускаем фоновый поток для автообновлений
-status_thread = threading.Thread(target=auto_status_broadcast, daemon=True)
-status_thread.start()
+# Наблюдение за shiro.ini: auto (inotify, если доступен, иначе опрос), poll или off
+SHIRO_WATCH = os.environ.get('SHIRO_WATCH', 'auto').lower()
+# Тишина после последнего события, после которой изменение обрабатывается (секунды)
+SHIRO_WATCH_DEBOUNCE = float(os.environ.get('SHIRO_WATCH_DEBOUNCE', '0.3'))
+# Интервал опроса stat() без inotify (секунды)
+SHIRO_WATCH_POLL_INTERVAL = float(os.environ.get('SHIRO_WATCH_POLL_INTERVAL', '2'))
+# Больше изменений за раз - одно сводное событие bulk вместо события на пользователя
+SHIRO_WATCH_MAX_EVENTS = int(os.environ.get('SHIRO_WATCH_MAX_EVENTS', '50'))
+
+
+class InotifyWatch:
+    """
+    inotify на каталоге через ctypes (Linux, без сторонних пакетов)
+
+    Следим за каталогом, а не за файлом: атомарная замена (write_shiro_ini,
+    редакторы, системы управления конфигурацией) подменяет inode, и наблюдение
+    за самим файлом потерялось бы после первой же записи.
+    """
+
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_IGNORED = 0x8000
+    IN_CLOEXEC = 0o2000000
+    MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    _EVENT = struct.Struct('iIII')  # struct inotify_event без поля name
+
+    def __init__(self, directory):
+        libc_name = ctypes.util.find_library('c')
+        libc = ctypes.CDLL(libc_name, use_errno=True) if libc_name else None
+        if libc is None or not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify недоступен')
+        fd = libc.inotify_init1(os.O_NONBLOCK | self.IN_CLOEXEC)
+        if fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        if libc.inotify_add_watch(fd, os.fsencode(directory), self.MASK) < 0:
+            error = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(error, os.strerror(error), directory)
+        self.fd = fd
+        self.directory = directory
+        self.lost = False  # каталог удален или перемонтирован: наблюдение больше не работает
+
+    def fileno(self):
+        return self.fd
+
+    def read(self):
+        """
+        Читает накопленные события без блокировки
+
+        Returns:
+            list: Имена файлов каталога, с которыми что-то произошло
+        """
+        names = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return names
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = self._EVENT.unpack_from(data, offset)
+                offset += self._EVENT.size
+                names.append(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+                offset += length
+                if mask & self.IN_IGNORED:
+                    self.lost = True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ShiroWatcher:
+    """
+    Наблюдатель shiro.ini: рассылает user_change о любых изменениях файла
+
+    Изменения через приложение и прямые правки (администратор, системы
+    управления конфигурацией) проходят один путь: событие inotify (или
+    изменившийся stat() при опросе) -> ожидание debounce секунд тишины, чтобы
+    серия событий одного сохранения в редакторе обработалась один раз ->
+    однократный разбор через read_shiro_ini (результат сразу попадает в кэш
+    для запросов) -> сравнение с прошлым состоянием -> события по каждому
+    изменившемуся пользователю.
+
+    write_shiro_ini сообщает отпечаток записанного файла и автора (expect),
+    поэтому такие изменения рассылаются с source='app' и именем пользователя,
+    остальные - с source='external'. Прошлое состояние - закэшированный
+    экземпляр данных, который никто не изменяет, поэтому копия не нужна.
+    """
+
+    def __init__(self, mode=SHIRO_WATCH, debounce=SHIRO_WATCH_DEBOUNCE, poll_interval=SHIRO_WATCH_POLL_INTERVAL,
+                 max_events=SHIRO_WATCH_MAX_EVENTS, notify=broadcast_user_change):
+        self.mode = mode
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.max_events = max_events
+        self._notify = notify
+        self._lock = threading.Lock()
+        self._started = False
+        self._stopped = False
+        self._inotify = None
+        self._path = None
+        self._fingerprint = None  # отпечаток разобранного состояния
+        self._seen = None         # последний отпечаток, замеченный опросом
+        self._state = None        # (users, roles)
+        self._expected = OrderedDict()  # отпечаток записи приложения -> автор
+        self.changes = {'app': 0, 'external': 0}
+
+    @property
+    def backend(self):
+        """inotify, poll или None, если наблюдатель не запущен"""
+        if not self._started:
+            return None
+        return 'inotify' if self._inotify is not None else 'poll'
+
+    def start(self):
+        """Запускает наблюдение (повторные вызовы ничего не делают)"""
+        if self.mode == 'off':
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        socketio.start_background_task(self.run)
+
+    def stop(self):
+        self._stopped = True
+
+    def expect(self, fingerprint, actor):
+        """Отмечает запись shiro.ini приложением (вызывается после записи, в т.ч. другими воркерами)"""
+        if fingerprint is None:
+            return
+        with self._lock:
+            self._expected[tuple(fingerprint)] = actor
+            while len(self._expected) > 32:
+                self._expected.popitem(last=False)
+
+    def reset(self):
+        """Запоминает текущее состояние файла без рассылки (запуск или смена пути)"""
+        self._path = shiro_ini_path
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+        if self.mode != 'poll':
+            try:
+                self._inotify = InotifyWatch(os.path.dirname(os.path.abspath(self._path)))
+            except OSError as e:
+                logger.info(f"inotify недоступен ({e}), shiro.ini проверяется раз в {self.poll_interval} с")
+        self._fingerprint = self._seen = _shiro_fingerprint(self._path)
+        users, roles, _ = read_shiro_ini(copy=False)
+        self._state = (users, roles)
+
+    def _wait_change(self, timeout):
+        """
+        Ждет события для shiro.ini не дольше timeout секунд
+
+        Returns:
+            bool: True если файл (возможно) изменился
+        """
+        if self._inotify is not None:
+            # События других файлов каталога (временные файлы редакторов) не прерывают ожидание
+            name = os.path.basename(self._path)
+            deadline = time.monotonic() + timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not select.select([self._inotify], [], [], remaining)[0]:
+                    return False
+                changed = name in self._inotify.read()
+                if self._inotify.lost:
+                    logger.warning('Наблюдение inotify за каталогом shiro.ini потеряно, переходим на опрос')
+                    self._inotify.close()
+                    self._inotify = None
+                    return True
+                if changed:
+                    return True
+        time.sleep(timeout)
+        fingerprint = _shiro_fingerprint(self._path)
+        changed = fingerprint != self._seen
+        self._seen = fingerprint
+        return changed
+
+    def run(self):
+        """Основной цикл фоновой задачи"""
+        while not self._stopped:
+            try:
+                if self._path != shiro_ini_path:
+                    self.reset()
+                if not self._wait_change(self.poll_interval):
+                    continue
+                # Серия событий одного сохранения: ждем debounce секунд тишины
+                deadline = time.monotonic() + max(10 * self.debounce, self.poll_interval)
+                while time.monotonic() < deadline and self._wait_change(self.debounce):
+                    pass
+                self.check()
+            except Exception as e:
+                logger.error(f"Ошибка наблюдения за shiro.ini: {e}")
+                time.sleep(self.poll_interval)
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def check(self):
+        """
+        Разбирает shiro.ini, если он изменился, и рассылает различия
+
+        Returns:
+            list: Разосланные изменения пользователей (action, username, fields)
+        """
+        fingerprint = _shiro_fingerprint(self._path)
+        if fingerprint is None or fingerprint == self._fingerprint:
+            # Файла нет (идет замена или он удален) - ждем следующего события
+            return []
+        users, roles, _ = read_shiro_ini(copy=False)
+        old_users, old_roles = self._state
+        self._fingerprint = self._seen = fingerprint
+        self._state = (users, roles)
+        with self._lock:
+            source = 'app' if fingerprint in self._expected else 'external'
+            actor = self._expected.pop(fingerprint, None)
+
+        changes = old_users.diff(users)
+        role_changes = {
+            'added': [role for role in roles if role not in old_roles],
+            'removed': [role for role in old_roles if role not in roles],
+            'changed': [role for role in roles if role in old_roles and roles[role] != old_roles[role]],
+        }
+        if not changes and not any(role_changes.values()):
+            return []
+        self.changes[source] += 1
+        if source == 'external':
+            logger.info(f"shiro.ini изменен вне приложения: пользователей изменено {len(changes)}, "
+                        f"ролей {sum(len(names) for names in role_changes.values())}")
+
+        total = len(users)
+        if any(role_changes.values()):
+            self._notify('roles', None, role_changes, total, actor, source)
+        if len(changes) > self.max_events:
+            summary = {action: sum(1 for change in changes if change[0] == action)
+                       for action in ('add', 'update', 'delete')}
+            self._notify('bulk', None, summary, total, actor, source)
+            return changes
+        for action, username, fields in changes:
+            user_data = {'roles': users[username]['roles'] if action != 'delete' else [],
+                         'fields': list(fields)}
+            self._notify(action, username, user_data, total, actor, source)
+        return changes
+
+
+shiro_watcher = ShiroWatcher()
+
+# Интервалы фоновой проверки статуса (секунды)
+STATUS_POLL_INTERVAL = float(os.environ.get('STATUS_POLL_INTERVAL', '30'))
+STATUS_POLL_FAST_INTERVAL = float(os.environ.get('STATUS_POLL_FAST_INTERVAL', '3'))
+STATUS_POLL_MAX_INTERVAL = float(os.environ.get('STATUS_POLL_MAX_INTERVAL', '120'))
+STATUS_POLL_BOOST_WINDOW = float(os.environ.get('STATUS_POLL_BOOST_WINDOW', '60'))
+# Принудительная рассылка без изменений (0 - отключена)
+STATUS_HEARTBEAT_INTERVAL = float(os.environ.get('STATUS_HEARTBEAT_INTERVAL', '300'))
+
+
+class LeaderElection:
+    """
+    Выбор ведущего воркера через неблокирующий fcntl.flock
+
+    Блокировку держит ровно один процесс. Когда он завершается, ОС снимает
+    блокировку, и ведущим становится первый воркер, вызвавший is_leader().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            # Дескриптор, унаследованный через fork, разделял бы блокировку с родителем
+            os.register_at_fork(after_in_child=self._forget)
+
+    def _forget(self):
+        self._fd = None
+        self._lock = threading.Lock()
+
+    def is_leader(self):
+        """True, если текущий процесс ведущий (пытается захватить блокировку, если нет)"""
+        with self._lock:
+            if self._fd is not None:
+                return True
+            if fcntl is None:
+                return True
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+            os.ftruncate(fd, 0)
+            os.write(fd, worker_id().encode('utf-8'))
+            self._fd = fd
+        logger.info(f"Воркер {worker_id()} стал ведущим: проверяет статус Zeppelin и рассылает его")
+        return True
+
+    def resign(self):
+        """Снимает блокировку ведущего (при остановке процесса это делает ОС)"""
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+class StatusPublisher:
+    """
+    Фоновая рассылка статуса Zeppelin подключенным клиентам
+
+    - пока нет ни одного WebSocket-клиента, статус не проверяется вообще;
+    - событие auto_status_update отправляется только при изменении отпечатка
+      статуса (и раз в heartbeat секунд, если он включен);
+    - после start/stop/restart статус проверяется часто (fast_interval в течение
+      boost_window), в стабильном состоянии интервал растет до max_interval.
+    """
+
+    # Поля, изменение которых считается изменением статуса
+    FINGERPRINT_FIELDS = ('status', 'active', 'enabled', 'pid', 'service_manager', 'zeppelin_type', 'error')
+
+    def __init__(self, status_source, emit_func, interval=STATUS_POLL_INTERVAL,
+                 fast_interval=STATUS_POLL_FAST_INTERVAL, max_interval=STATUS_POLL_MAX_INTERVAL,
+                 boost_window=STATUS_POLL_BOOST_WINDOW, heartbeat=STATUS_HEARTBEAT_INTERVAL,
+                 leader=None, announce=None):
+        self._status_source = status_source
+        self._emit = emit_func
+        # При нескольких воркерах статус проверяет и рассылает только ведущий,
+        # остальные сообщают ему число своих клиентов через announce
+        self.leader = leader
+        self._announce = announce
+        self._remote_clients = {}  # воркер -> (число клиентов, время истечения)
+        self.base_interval = interval
+        self.fast_interval = fast_interval
+        self.max_interval = max(max_interval, interval)
+        self.boost_window = boost_window
+        self.heartbeat = heartbeat
+        self.interval = interval
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._started = False
+        self._boost_until = 0.0
+        self._last_fingerprint = None
+        self._last_emit = 0.0
+        self.probes = 0
+        self.emitted = 0
+
+    @property
+    def client_count(self):
+        """Количество подключенных WebSocket-клиентов"""
+        return len(self._clients)
+
+    def listeners(self):
+        """Клиенты этого воркера и (для ведущего) клиенты остальных воркеров"""
+        now = time.monotonic()
+        with self._lock:
+            remote = sum(count for count, expires in self._remote_clients.values() if expires > now)
+        return len(self._clients) + remote
+
+    def remote_clients(self, worker, count):
+        """Учитывает клиентов другого воркера (сообщение clients из шины)"""
+        with self._lock:
+            if count:
+                self._remote_clients[worker] = (count, time.monotonic() + 3 * self.max_interval)
+            else:
+                self._remote_clients.pop(worker, None)
+        if count:
+            self._ensure_started()
+            self._wakeup.set()
+
+    def _ensure_started(self):
+        with self._lock:
+            start = not self._started
+            self._started = True
+        if start:
+            socketio.start_background_task(self.run)
+
+    @classmethod
+    def fingerprint(cls, status):
+        """Отпечаток значимых полей статуса"""
+        return tuple(str(status.get(field)) for field in cls.FINGERPRINT_FIELDS)
+
+    def client_connected(self, sid):
+        """Регистрирует клиента и при необходимости запускает фоновую задачу"""
+        with self._lock:
+            self._clients.add(sid)
+            first_client = len(self._clients) == 1
+        self._ensure_started()
+        if first_client:
+            self._wakeup.set()
+
+    def client_disconnected(self, sid):
+        """Удаляет клиента из списка слушателей"""
+        with self._lock:
+            self._clients.discard(sid)
+            last_client = not self._clients
+        if last_client and self._announce:
+            self._announce(0)
+
+    def notify_action(self, status=None):
+        """
+        Сообщает о start/stop/restart: включает частый опрос
+
+        Args:
+            status (dict): Уже разосланный статус, чтобы не отправлять его повторно
+        """
+        with self._lock:
+            self._boost_until = time.monotonic() + self.boost_window
+            self.interval = self.fast_interval
+            if status is not None:
+                self._last_fingerprint = self.fingerprint(status)
+                self._last_emit = time.monotonic()
+        self._wakeup.set()
+
+    def _next_interval(self, changed):
+        if time.monotonic() < self._boost_until:
+            return self.fast_interval
+        if changed:
+            return self.base_interval
+        return min(max(self.interval, self.base_interval) * 1.5, self.max_interval)
+
+    def tick(self):
+        """
+        Одна итерация: проверяет статус и рассылает его, если он изменился
+
+        Returns:
+            bool: True если событие было отправлено
+        """
+        if self.leader is not None and not self.leader.is_leader():
+            return False
+        status = self._status_source(self.interval)
+        self.probes += 1
+        fingerprint = self.fingerprint(status)
+        now = time.monotonic()
+        with self._lock:
+            changed = fingerprint != self._last_fingerprint
+            heartbeat_due = bool(self.heartbeat) and now - self._last_emit >= self.heartbeat
+            if changed or heartbeat_due:
+                self._last_fingerprint = fingerprint
+                self._last_emit = now
+            self.interval = self._next_interval(changed)
+        if changed or heartbeat_due:
+            self._emit(status)
+            self.emitted += 1
+            return True
+        return False
+
+    def run(self):
+        """Основной цикл фоновой задачи"""
+        while True:
+            try:
+                if self._clients and self._announce:
+                    self._announce(len(self._clients))
+                if not self.listeners():
+                    # Никто не слушает - спим до первого подключения
+                    self._wakeup.wait()
+                    self._wakeup.clear()
+                    continue
+                self._wakeup.wait(self.interval)
+                self._wakeup.clear()
+                if self.listeners():
+                    self.tick()
+            except Exception as e:
+                logger.error(f"Ошибка автоматического обновления статуса: {e}")
+                time.sleep(self.base_interval)
+
+
+def emit_auto_status(status):
+    """Рассылает событие auto_status_update всем клиентам (и статус остальным воркерам)"""
+    if message_bus.multi_process:
+        message_bus.publish('status', status)
+    with app.app_context():
+        emit_event('auto_status_update', {
+            'status': status,
+            'timestamp': datetime.now().isoformat()
+        })
+
+
+# Файл выбора ведущего воркера (по умолчанию leader.lock в каталоге шины сообщений)
+WORKER_LEADER_LOCK = os.environ.get('WORKER_LEADER_LOCK', '')
+
+
+def _create_status_publisher():
+    leader = announce = None
+    if message_bus.multi_process:
+        leader = LeaderElection(WORKER_LEADER_LOCK or os.path.join(message_bus.directory, 'leader.lock'))
+
+        def announce(count):
+            message_bus.publish('clients', {'worker': worker_id(), 'count': count})
+
+        status_cache.follow(leader, lambda invalidate: message_bus.publish(
+            'status_request', {'worker': worker_id(), 'invalidate': invalidate}))
+    return StatusPublisher(lambda max_age: status_cache.get(max_age=max_age), emit_auto_status,
+                           leader=leader, announce=announce)
+
+
+status_publisher = _create_status_publisher()
+
+
+def _on_realm_changed(message):
+    # Другой воркер записал shiro.ini: сбрасываем кэши, не дожидаясь stat()
+    if message.get('worker') != worker_id():
+        invalidate_shiro_cache()
+        fragment_cache.clear()
+        shiro_watcher.expect(message.get('fingerprint'), message.get('actor'))
+
+
+def _on_remote_status(status):
+    # Статус, проверенный ведущим воркером: остальным не нужно запускать свои проверки
+    status_cache.prime(status)
+
+
+def _on_status_request(message):
+    # Статус устарел у другого воркера: проверяет только ведущий и рассылает результат всем
+    leader = status_publisher.leader
+    if leader is None or not leader.is_leader():
+        return
+
+    def answer():
+        if message.get('invalidate'):
+            status_cache.invalidate()
+            status_publisher.notify_action()
+        # Изменившийся статус tick() рассылает сам (emit_auto_status), неизменный - только воркерам
+        if not status_publisher.tick():
+            message_bus.publish('status', status_cache.get())
+
+    socketio.start_background_task(answer)
+
+
+def _on_remote_clients(message):
+    if message.get('worker') != worker_id():
+        status_publisher.remote_clients(message['worker'], message['count'])
+
+
+message_bus.subscribe('realm', _on_realm_changed)
+message_bus.subscribe('status', _on_remote_status)
+message_bus.subscribe('status_request', _on_status_request)
+message_bus.subscribe('clients', _on_remote_clients)
+
+# Метрики, которые берутся из уже существующих счетчиков компонентов
+CallbackMetric('websocket_clients', 'Подключенные WebSocket-клиенты', 'gauge',
+               lambda: status_publisher.client_count)
+CallbackMetric('status_probes', 'Проверки статуса Zeppelin фоновым публикатором', 'counter',
+               lambda: status_publisher.probes)
+CallbackMetric('password_verify_cache', 'Обращения к кэшу проверок паролей', 'counter',
+               lambda: {(result,): password_service.stats()[f'cache_{result}'] for result in ('hits', 'misses')},
+               ('result',))
+CallbackMetric('password_hash_computations', 'Вычисления хэшей паролей', 'counter',
+               lambda: password_service.stats()['hash_computations'])
+CallbackMetric('login_attempts', 'Попытки входа после ограничения частоты', 'counter',
+               lambda: {(result,): login_throttle.stats()[result]
+                        for result in ('allowed', 'rejected_ip', 'rejected_user')},
+               ('result',))
+CallbackMetric('dashboard_fragment_cache', 'Обращения к кэшу фрагментов dashboard', 'counter',
+               lambda: {('hits',): fragment_cache.hits, ('misses',): fragment_cache.misses}, ('result',))
+CallbackMetric('shiro_watch_changes', 'Изменения shiro.ini, замеченные наблюдателем', 'counter',
+               lambda: {(source,): count for source, count in shiro_watcher.changes.items()}, ('source',))
+CallbackMetric('log_records_dropped', 'Записи лога, отброшенные из-за переполнения очереди', 'counter',
+               lambda: log_queue_handler.dropped)
 
 if __name__ == '__main__':
     """
     Runs the Flask application.
     """
-    socketio.run(app, host='0.0.0.0', port=5003, debug=False, allow_unsafe_werkzeug=True)
\ No newline at end of file
+    # Определяем способ установки Zeppelin один раз при старте
+    system_info_cache.refresh()
+    socketio.run(app, host='0.0.0.0', port=5003, debug=False, **socketio_server_options())
@@ -0,0 +1,126 @@
+"""
+Общие функции бенчмарков: синтетический shiro.ini, статистика задержек, заглушки Zeppelin
+
+Скрипты запускаются как `python benchmarks/<script>.py`, поэтому модуль
+импортируется как `common`, а корень репозитория добавляется в sys.path.
+"""
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+import app as app_module  # noqa: E402
+
+FAKE_STATUS = {
+    'status': 'running',
+    'status_class': 'success',
+    'status_text': 'Запущен',
+    'active': 'active',
+    'enabled': 'enabled',
+    'pid': '4242',
+    'uptime': '1h 0m',
+    'memory_usage': '1.0G',
+    'full_output': 'benchmark stub',
+    'error': None,
+    'os': 'Linux',
+}
+
+FAKE_SYSTEM_INFO = {
+    'os': 'Linux',
+    'service_manager': 'stub',
+    'zeppelin_type': 'stub',
+    'zeppelin_available': True,
+    'commands': {},
+}
+
+
+def percentile(values, fraction):
+    """Перцентиль по методу ближайшего ранга"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(latencies):
+    """Сводка по списку длительностей в секундах (значения в миллисекундах)"""
+    return {
+        'iterations': len(latencies),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'min_ms': round(min(latencies) * 1000, 3),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(max(latencies) * 1000, 3),
+    }
+
+
+def generate_shiro_ini(path, users, roles=200, main_lines=500, url_lines=2000, seed=42):
+    """
+    Пишет синтетический shiro.ini
+
+    Args:
+        path (str): Куда записать файл
+        users (int): Число пользователей (admin добавляется отдельно)
+        roles (int): Число ролей, у каждого пользователя от 1 до 5
+        main_lines (int): Строк в [main]
+        url_lines (int): Строк в [urls]
+    """
+    rng = random.Random(seed)
+    role_names = [f'role{index}' for index in range(roles)]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('# synthetic shiro.ini for benchmarks\n[users]\nadmin = admin123, admin\n')
+        for index in range(users):
+            user_roles = ', '.join(rng.sample(role_names, rng.randint(1, 5)))
+            f.write(f'user{index} = pass{index}, {user_roles}\n')
+        f.write('\n[main]\nsessionManager = org.apache.shiro.web.session.mgt.DefaultWebSessionManager\n')
+        for index in range(main_lines):
+            f.write(f'realm{index}.property{index % 7} = value-{index}\n')
+        f.write('\n[roles]\nadmin = *\n')
+        for role in role_names:
+            f.write(f'{role} = notebook:read:{role}, notebook:write:{role}\n')
+        f.write('\n[urls]\n')
+        for index in range(url_lines):
+            f.write(f'/api/notebook/{index}/** = authc, roles[{role_names[index % roles]}]\n')
+        f.write('/** = authc\n')
+
+
+def install_stubs(shiro_path):
+    """
+    Направляет app.py на временный shiro.ini и заглушает Zeppelin и сервис-менеджер
+
+    Статус отдается из FAKE_STATUS без subprocess, логирование отключается,
+    ограничение попыток входа не мешает повторным входам.
+    """
+    logging.disable(logging.CRITICAL)
+    app_module.app.config['TESTING'] = True
+    app_module.shiro_ini_path = shiro_path
+    app_module.invalidate_shiro_cache()
+    app_module.get_system_info = lambda: dict(FAKE_SYSTEM_INFO)
+    app_module.check_zeppelin_status = lambda: dict(FAKE_STATUS)
+    app_module.status_cache = app_module.StatusCache(lambda: dict(FAKE_STATUS), 3600)
+    app_module.status_cache.get()
+    app_module.login_throttle = app_module.LoginThrottle(ip_burst=10 ** 9, user_burst=10 ** 9)
+    return app_module
+
+
+def environment():
+    """Описание окружения для сопоставления результатов между коммитами"""
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                  capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        revision = None
+    return {
+        'revision': revision,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+    }
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест app.py с поддельным Zeppelin
+
+Запускает приложение на локальном порту (werkzeug, как socketio.run) против
+временного shiro.ini и поддельного бэкенда, у которого задаются задержки
+проверки статуса и команд start/stop/restart. Операторы - потоки, которые
+по реальному HTTP (новое соединение на запрос) выполняют смесь входов,
+загрузок dashboard, изменений пользователей и проверок статуса. WebSocket-клиенты (тестовые
+клиенты Flask-SocketIO в том же процессе) запрашивают статус и принимают
+рассылки. В конце печатается JSON с пропускной способностью и перцентилями.
+
+Работает полностью офлайн.
+
+Пример:
+    python benchmarks/loadtest.py --operators 20 --ws-clients 200 --duration 30 --probe-latency 0.5
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+from werkzeug.serving import make_server
+
+from common import FAKE_STATUS, app_module, environment, generate_shiro_ini, install_stubs, summarize
+
+
+class FakeZeppelinBackend:
+    """Поддельный сервис-менеджер: статус и команды отвечают с заданной задержкой"""
+
+    def __init__(self, probe_latency, command_latency):
+        self.probe_latency = probe_latency
+        self.command_latency = command_latency
+        self.probes = 0
+        self.commands = 0
+        self._lock = threading.Lock()
+
+    def check_status(self):
+        with self._lock:
+            self.probes += 1
+        time.sleep(self.probe_latency)
+        return dict(FAKE_STATUS)
+
+    def execute(self, command, progress=None):
+        with self._lock:
+            self.commands += 1
+        if progress:
+            progress(command, f'Поддельная команда {command}')
+        time.sleep(self.command_latency)
+        return True, f'Поддельная команда {command} выполнена'
+
+
+class Recorder:
+    """Потокобезопасный сбор задержек и ошибок по типам операций"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def add(self, operation, seconds, ok=True):
+        with self._lock:
+            self.latencies.setdefault(operation, []).append(seconds)
+            if not ok:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+
+    def report(self, elapsed):
+        with self._lock:
+            result = {}
+            for operation, values in sorted(self.latencies.items()):
+                result[operation] = {
+                    **summarize(values),
+                    'throughput_per_s': round(len(values) / elapsed, 2),
+                    'errors': self.errors.get(operation, 0),
+                }
+            return result
+
+
+class Operator:
+    """Оператор панели: HTTP-клиент с собственной cookie сессии"""
+
+    def __init__(self, index, port, recorder):
+        self.index = index
+        self.port = port
+        self.recorder = recorder
+        self.cookie = None
+        self.step = 0
+
+    def request(self, method, path, form=None):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        try:
+            headers = {'Cookie': self.cookie} if self.cookie else {}
+            body = None
+            if form is not None:
+                body = urlencode(form)
+                headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            set_cookie = response.getheader('Set-Cookie')
+            if set_cookie:
+                self.cookie = set_cookie.split(';', 1)[0]
+            return response.status, response.getheader('Location') or ''
+        finally:
+            connection.close()
+
+    def timed(self, operation, method, path, form=None, expect=(200,)):
+        started = time.perf_counter()
+        try:
+            status, location = self.request(method, path, form)
+            ok = status in expect
+            if operation == 'login':
+                ok = ok and location.endswith('/dashboard')
+        except OSError:
+            ok = False
+        self.recorder.add(operation, time.perf_counter() - started, ok)
+
+    def login(self):
+        self.timed('login', 'POST', '/login', {'username': 'admin', 'password': 'admin123'}, expect=(302,))
+
+    def mutate(self):
+        # Цикл изменений над собственным пользователем, чтобы операторы не мешали друг другу
+        username = f'load{self.index}'
+        steps = [
+            ('add_user', '/add_user', {'username': username, 'password': 'loadpass'}),
+            ('assign_user_role', '/assign_user_role', {'username': username, 'role': 'role1'}),
+            ('unassign_user_role', '/unassign_user_role', {'username': username, 'role': 'role1'}),
+            ('delete_user', '/delete_user', {'username': username}),
+        ]
+        operation, path, form = steps[self.step % len(steps)]
+        self.step += 1
+        self.timed(operation, 'POST', path, form, expect=(302,))
+
+    def run(self, deadline, weights, rng):
+        self.login()
+        operations = list(weights)
+        while time.monotonic() < deadline:
+            operation = rng.choices(operations, [weights[name] for name in operations])[0]
+            if operation == 'login':
+                self.login()
+            elif operation == 'dashboard':
+                self.timed('dashboard', 'GET', '/dashboard')
+            elif operation == 'mutation':
+                self.mutate()
+            elif operation == 'status':
+                self.timed('check_status', 'GET', '/check_zeppelin_status', expect=(200, 302))
+            elif operation == 'restart':
+                self.timed('restart_job', 'POST', '/restart_zeppelin', expect=(302,))
+
+
+def run_ws_client(recorder, deadline, request_interval, counters, counters_lock):
+    """WebSocket-клиент: периодически запрашивает статус и принимает рассылки"""
+    flask_client = app_module.app.test_client()
+    with flask_client.session_transaction() as sess:
+        sess['username'] = 'admin'
+    client = app_module.socketio.test_client(app_module.app, flask_test_client=flask_client)
+    received = {}
+    try:
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            client.emit('request_status_update')
+            events = client.get_received()
+            ok = any(event['name'] == 'status_update' for event in events)
+            recorder.add('ws_status_request', time.perf_counter() - started, ok)
+            for event in events:
+                received[event['name']] = received.get(event['name'], 0) + 1
+            time.sleep(request_interval)
+        for event in client.get_received():
+            received[event['name']] = received.get(event['name'], 0) + 1
+    finally:
+        client.disconnect()
+    with counters_lock:
+        for name, count in received.items():
+            counters[name] = counters.get(name, 0) + count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--operators', type=int, default=10, help='Одновременных операторов (HTTP)')
+    parser.add_argument('--ws-clients', type=int, default=50, help='WebSocket-клиентов')
+    parser.add_argument('--duration', type=float, default=20, help='Длительность нагрузки, секунды')
+    parser.add_argument('--users', type=int, default=1000, help='Пользователей в синтетическом shiro.ini')
+    parser.add_argument('--probe-latency', type=float, default=0.2, help='Задержка проверки статуса, секунды')
+    parser.add_argument('--command-latency', type=float, default=1.0, help='Задержка start/stop/restart, секунды')
+    parser.add_argument('--status-ttl', type=float, default=app_module.ZEPPELIN_STATUS_TTL,
+                        help='TTL кэша статуса, секунды')
+    parser.add_argument('--poll-interval', type=float, default=5, help='Интервал фоновой рассылки статуса')
+    parser.add_argument('--ws-interval', type=float, default=1.0, help='Пауза между запросами статуса по WS')
+    parser.add_argument('--mix', default='login=1,dashboard=4,mutation=4,status=1,restart=0.05',
+                        help='Веса операций операторов')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Сохранить JSON в файл')
+    args = parser.parse_args()
+
+    weights = {name: float(weight) for name, weight in (item.split('=') for item in args.mix.split(','))}
+    backend = FakeZeppelinBackend(args.probe_latency, args.command_latency)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'shiro.ini')
+        generate_shiro_ini(path, args.users)
+        install_stubs(path)
+        app_module.check_zeppelin_status = backend.check_status
+        app_module.execute_service_command = backend.execute
+        app_module.status_cache = app_module.StatusCache(backend.check_status, args.status_ttl)
+        app_module.status_publisher = app_module.StatusPublisher(
+            lambda max_age: app_module.status_cache.get(max_age=max_age), app_module.emit_auto_status,
+            interval=args.poll_interval, fast_interval=min(args.poll_interval, 1.0))
+        app_module.service_jobs = app_module.ServiceJobQueue(
+            backend.execute, on_progress=app_module.emit_job_progress, on_finish=app_module.finish_service_job)
+
+        server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+
+        recorder = Recorder()
+        counters, counters_lock = {}, threading.Lock()
+        started = time.monotonic()
+        deadline = started + args.duration
+        rng = random.Random(args.seed)
+        threads = [threading.Thread(target=Operator(index, server.server_port, recorder).run,
+                                    args=(deadline, weights, random.Random(rng.random())))
+                   for index in range(args.operators)]
+        threads += [threading.Thread(target=run_ws_client,
+                                     args=(recorder, deadline, args.ws_interval, counters, counters_lock))
+                    for _ in range(args.ws_clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        server.shutdown()
+
+    operations = recorder.report(elapsed)
+    report = {
+        'benchmark': 'loadtest',
+        'environment': environment(),
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'elapsed_seconds': round(elapsed, 2),
+        'total_throughput_per_s': round(sum(op['iterations'] for op in operations.values()) / elapsed, 2),
+        'operations': operations,
+        'ws_events_received': counters,
+        'backend': {'probes': backend.probes, 'commands': backend.commands},
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
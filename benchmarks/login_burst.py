@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк входа: всплеск одновременных логинов с хэшированными паролями
+
+Создает временный shiro.ini с пользователями в формате $shiro1$SHA-256,
+запускает два всплеска по --concurrency одновременных POST /login через
+тестовый клиент Flask (холодный - кэш проверок пуст, теплый - повторный вход)
+и печатает JSON с перцентилями задержки и статистикой PasswordService.
+
+Пример:
+    python benchmarks/login_burst.py --concurrency 200 --users 20
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from common import app_module, percentile
+
+
+def run_burst(concurrency, users):
+    barrier = threading.Barrier(concurrency)
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def worker(index):
+        username = f'user{index % users}'
+        with app_module.app.test_client() as client:
+            barrier.wait()
+            started = time.perf_counter()
+            response = client.post('/login', data={'username': username, 'password': f'{username}-pass'})
+            elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if not response.headers.get('Location', '').endswith('/dashboard'):
+                failures.append(username)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    return {
+        'requests': concurrency,
+        'failures': len(failures),
+        'wall_seconds': round(wall, 4),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'max_ms': round(max(latencies) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=200, help='Одновременных входов во всплеске')
+    parser.add_argument('--users', type=int, default=20, help='Число различных пользователей')
+    parser.add_argument('--iterations', type=int, default=app_module.SHIRO_HASH_ITERATIONS,
+                        help='Итерации SHA-256 в хэшах пользователей')
+    parser.add_argument('--workers', type=int, default=app_module.PASSWORD_HASH_WORKERS,
+                        help='Размер пула проверки паролей')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    app_module.app.config['TESTING'] = True
+
+    with tempfile.TemporaryDirectory() as workdir:
+        lines = ['[users]\n']
+        for index in range(args.users):
+            username = f'user{index}'
+            credential = app_module.hash_password(f'{username}-pass', 'sha256', iterations=args.iterations)
+            lines.append(f'{username} = {credential}, role1\n')
+        lines.append('\n[roles]\nrole1 = *\n')
+        path = os.path.join(workdir, 'shiro.ini')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+
+        app_module.shiro_ini_path = path
+        app_module.invalidate_shiro_cache()
+        app_module.password_service = app_module.PasswordService(max_workers=args.workers)
+        # Все входы идут с одного адреса - ограничение попыток здесь не измеряется
+        app_module.login_throttle = app_module.LoginThrottle(ip_burst=10 ** 9, user_burst=10 ** 9)
+
+        cold = run_burst(args.concurrency, args.users)
+        warm = run_burst(args.concurrency, args.users)
+
+    print(json.dumps({
+        'benchmark': 'login_burst',
+        'concurrency': args.concurrency,
+        'users': args.users,
+        'iterations': args.iterations,
+        'workers': args.workers,
+        'cold': cold,
+        'warm': warm,
+        'password_service': app_module.password_service.stats(),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
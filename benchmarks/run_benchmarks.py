@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Набор бенчмарков пути shiro.ini и HTTP-маршрутов
+
+Для каждого размера генерирует синтетический shiro.ini (много ролей, большие
+[main] и [urls]), заглушает сервис-менеджер и Zeppelin и измеряет:
+read_shiro_ini (без кэша и из кэша), write_shiro_ini, вход, отрисовку
+dashboard, страницы /api/users и каждый маршрут изменения пользователей
+через тестовый клиент Flask.
+Результат печатается в JSON; с --compare выводится сравнение p50 с прошлым
+запуском.
+
+Пример:
+    python benchmarks/run_benchmarks.py --sizes 1000,10000,100000 --output bench.json
+    python benchmarks/run_benchmarks.py --compare bench.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from common import app_module, environment, generate_shiro_ini, install_stubs, summarize
+
+
+def measure(func, repeat, setup=None):
+    """Запускает func repeat раз и возвращает сводку; setup выполняется перед каждым замером без учета времени"""
+    latencies = []
+    for index in range(repeat):
+        if setup:
+            setup(index)
+        started = time.perf_counter()
+        func(index)
+        latencies.append(time.perf_counter() - started)
+    return summarize(latencies)
+
+
+def expect(response, status=302):
+    if response.status_code != status:
+        raise RuntimeError(f'{response.request.path}: ожидался код {status}, получен {response.status_code}')
+    return response
+
+
+def bench_size(users, repeat, workdir):
+    path = os.path.join(workdir, f'shiro-{users}.ini')
+    generate_shiro_ini(path, users)
+    install_stubs(path)
+    results = {'file_bytes': os.path.getsize(path)}
+
+    results['read_shiro_ini_cold'] = measure(lambda i: app_module.read_shiro_ini(), repeat,
+                                             setup=lambda i: app_module.invalidate_shiro_cache())
+    app_module.read_shiro_ini()
+    results['read_shiro_ini_cached'] = measure(lambda i: app_module.read_shiro_ini(), repeat)
+
+    def write(index):
+        users_store, roles, sections = app_module.read_shiro_ini()
+        users_store.set_password('user0', f'changed{index}')
+        started = time.perf_counter()
+        if not app_module.write_shiro_ini(users_store, roles, sections):
+            raise RuntimeError('write_shiro_ini не удался')
+        return time.perf_counter() - started
+
+    write_latencies = [write(index) for index in range(repeat)]
+    results['write_shiro_ini'] = summarize(write_latencies)
+
+    client = app_module.app.test_client()
+    results['login'] = measure(
+        lambda i: expect(client.post('/login', data={'username': 'user1', 'password': 'pass1'})), repeat)
+    with client.session_transaction() as sess:
+        sess['username'] = 'admin'
+    results['dashboard'] = measure(lambda i: expect(client.get('/dashboard'), 200), repeat)
+    results['api_users_page'] = measure(lambda i: expect(client.get('/api/users?offset=100&limit=50'), 200), repeat)
+    results['api_users_search'] = measure(lambda i: expect(client.get('/api/users?q=99&role=role7'), 200), repeat)
+
+    routes = {
+        'add_user': lambda i: client.post('/add_user', data={'username': f'bench{i}', 'password': 'benchpass'}),
+        'assign_user_role': lambda i: client.post('/assign_user_role',
+                                                  data={'username': f'bench{i}', 'role': 'role1'}),
+        'unassign_user_role': lambda i: client.post('/unassign_user_role',
+                                                    data={'username': f'bench{i}', 'role': 'role1'}),
+        'change_password': lambda i: client.post('/change_password',
+                                                 data={'username': f'bench{i}', 'new_password': 'newpass'}),
+        'delete_user': lambda i: client.post('/delete_user', data={'username': f'bench{i}'}),
+        'add_role': lambda i: client.post('/add_role', data={'role_name': f'benchrole{i}'}),
+    }
+    for name, route in routes.items():
+        results[name] = measure(lambda i, route=route: expect(route(i)), repeat)
+
+    final_users, final_roles, _ = app_module.read_shiro_ini()
+    if any(f'bench{i}' in final_users for i in range(repeat)) or f'benchrole{repeat - 1}' not in final_roles:
+        raise RuntimeError('Маршруты изменения отработали не так, как ожидалось')
+    return results
+
+
+def compare(previous, current):
+    """Печатает изменение p50 по каждому замеру относительно прошлого результата"""
+    lines = []
+    for size, metrics in current['results'].items():
+        old_metrics = previous.get('results', {}).get(size, {})
+        for name, stats in metrics.items():
+            old = old_metrics.get(name)
+            if not isinstance(stats, dict) or not isinstance(old, dict) or not old.get('p50_ms'):
+                continue
+            ratio = stats['p50_ms'] / old['p50_ms']
+            lines.append(f"{size:>7} {name:<24} {old['p50_ms']:>10.3f} -> {stats['p50_ms']:>10.3f} мс  x{ratio:.2f}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000', help='Размеры shiro.ini через запятую')
+    parser.add_argument('--repeat', type=int, default=5, help='Повторов каждого замера')
+    parser.add_argument('--output', help='Сохранить JSON в файл')
+    parser.add_argument('--compare', help='JSON прошлого запуска для сравнения p50')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    with tempfile.TemporaryDirectory() as workdir:
+        results = {str(size): bench_size(size, args.repeat, workdir) for size in sizes}
+
+    report = {
+        'benchmark': 'suite',
+        'environment': environment(),
+        'repeat': args.repeat,
+        'results': results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    print(text)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print(compare(json.load(f), report), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
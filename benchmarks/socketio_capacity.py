@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Емкость SocketIO: число подключенных клиентов и задержка рассылки по режимам сервера
+
+Для каждого режима (SOCKETIO_ASYNC_MODE) и числа клиентов запускает
+socketio_server.py отдельным процессом, подключает клиентов по WebSocket
+(Engine.IO v4 поверх wsproto, все клиенты в одном потоке через selectors)
+и несколько раз вызывает рассылку всем клиентам. В отчете: сколько клиентов
+подключилось и за какое время, задержка доставки рассылки (от отправки до
+разбора сообщения клиентом) и память/потоки процесса сервера.
+Режимы, для которых не установлен пакет (eventlet, gevent), пропускаются.
+
+Пример:
+    python benchmarks/socketio_capacity.py --modes threading,eventlet,gevent --clients 1000,5000
+"""
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import selectors
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+from wsproto import ConnectionType, WSConnection
+from wsproto.events import (AcceptConnection, CloseConnection, Message, Ping, RejectConnection, Request,
+                            TextMessage)
+
+from common import environment, summarize
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'socketio_server.py')
+
+
+class EngineIOClient:
+    """Минимальный клиент Socket.IO: подключение к '/', ответы на ping, прием событий"""
+
+    def __init__(self, port, cookie):
+        self.sock = socket.create_connection(('127.0.0.1', port), timeout=30)
+        self.ws = WSConnection(ConnectionType.CLIENT)
+        self.started = time.perf_counter()
+        self.connected_at = None
+        self.failed = False
+        self.received = {}  # время отправки рассылки -> время получения
+        self._text = ''
+        self.sock.sendall(self.ws.send(Request(host=f'127.0.0.1:{port}',
+                                               target='/socket.io/?EIO=4&transport=websocket',
+                                               extra_headers=[(b'cookie', cookie.encode())])))
+
+    def send_text(self, text):
+        self.sock.sendall(self.ws.send(Message(data=text)))
+
+    def on_readable(self):
+        try:
+            data = self.sock.recv(65536)
+        except OSError:
+            data = b''
+        if not data:
+            self.failed = self.connected_at is None
+            return False
+        self.ws.receive_data(data)
+        for event in self.ws.events():
+            if isinstance(event, TextMessage):
+                self._text += event.data
+                if event.message_finished:
+                    self.handle_packet(self._text)
+                    self._text = ''
+            elif isinstance(event, Ping):
+                self.sock.sendall(self.ws.send(event.response()))
+            elif isinstance(event, (RejectConnection, CloseConnection)):
+                self.failed = self.connected_at is None
+                return False
+            elif isinstance(event, AcceptConnection):
+                pass
+        return True
+
+    def handle_packet(self, packet):
+        if packet.startswith('0'):
+            self.send_text('40')
+        elif packet.startswith('40'):
+            self.connected_at = time.perf_counter()
+        elif packet.startswith('44'):
+            self.failed = True
+        elif packet == '2':
+            self.send_text('3')
+        elif packet.startswith('42'):
+            name, *payload = json.loads(packet[2:])
+            if name == 'bench_broadcast':
+                self.received[payload[0]['ts']] = time.time()
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ClientPool:
+    """Все клиенты в одном потоке: чтение через selectors"""
+
+    def __init__(self, port, cookie):
+        self.port = port
+        self.cookie = cookie
+        self.selector = selectors.DefaultSelector()
+        self.clients = []
+        self.open_errors = 0
+
+    def pump(self, timeout):
+        for key, _ in self.selector.select(timeout):
+            client = key.data
+            if not client.on_readable():
+                self.selector.unregister(client.sock)
+                client.close()
+
+    @property
+    def connected(self):
+        return [client for client in self.clients if client.connected_at is not None]
+
+    def connect(self, count, window, deadline):
+        """Подключает count клиентов, держа не больше window незавершенных рукопожатий"""
+        while time.monotonic() < deadline:
+            pending = sum(1 for client in self.clients if client.connected_at is None and not client.failed)
+            while len(self.clients) + self.open_errors < count and pending < window:
+                try:
+                    client = EngineIOClient(self.port, self.cookie)
+                except OSError:
+                    self.open_errors += 1
+                    continue
+                self.clients.append(client)
+                self.selector.register(client.sock, selectors.EVENT_READ, client)
+                pending += 1
+            if len(self.clients) + self.open_errors >= count and pending == 0:
+                break
+            self.pump(0.05)
+
+    def close(self):
+        for client in self.clients:
+            client.close()
+        self.selector.close()
+
+
+def http_request(port, method, path, form=None, cookie=None):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    try:
+        headers = {'Cookie': cookie} if cookie else {}
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        return response.status, response.getheader('Set-Cookie'), response.read()
+    finally:
+        connection.close()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def read_process_status(pid):
+    """VmRSS (МБ) и число потоков процесса из /proc"""
+    result = {}
+    try:
+        with open(f'/proc/{pid}/status', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    result['rss_mb'] = round(int(line.split()[1]) / 1024, 1)
+                elif line.startswith('Threads:'):
+                    result['threads'] = int(line.split()[1])
+    except OSError:
+        pass
+    return result
+
+
+def run_capacity(mode, clients, args):
+    port = free_port()
+    env = {**os.environ, 'SOCKETIO_ASYNC_MODE': mode}
+    with tempfile.TemporaryFile() as server_log:
+        server = subprocess.Popen([sys.executable, SERVER_SCRIPT, '--port', str(port), '--users', str(args.users)],
+                                  env=env, stdout=server_log, stderr=server_log)
+        pool = None
+        try:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    http_request(port, 'GET', '/api/version')
+                    break
+                except OSError:
+                    if server.poll() is not None or time.monotonic() > deadline:
+                        server_log.seek(0)
+                        raise RuntimeError(f'Сервер {mode} не запустился: {server_log.read().decode()[-2000:]}')
+                    time.sleep(0.1)
+
+            _, set_cookie, _ = http_request(port, 'POST', '/login', {'username': 'admin', 'password': 'admin123'})
+            cookie = set_cookie.split(';', 1)[0]
+
+            pool = ClientPool(port, cookie)
+            started = time.perf_counter()
+            pool.connect(clients, args.window, time.monotonic() + args.connect_timeout)
+            connected = pool.connected
+            connect_seconds = time.perf_counter() - started
+            result = {
+                'requested': clients,
+                'connected': len(connected),
+                'failed': clients - len(connected),
+                'connect_seconds': round(connect_seconds, 2),
+                'connects_per_s': round(len(connected) / connect_seconds, 1) if connect_seconds else None,
+                'handshake': summarize([client.connected_at - client.started for client in connected])
+                if connected else None,
+                'server_idle': read_process_status(server.pid),
+            }
+
+            latencies, full_delivery, emit_ms = [], [], []
+            for _ in range(args.broadcasts):
+                responses = []
+                sender = threading.Thread(
+                    target=lambda: responses.append(http_request(port, 'POST', '/bench/broadcast', {}, cookie)))
+                before = {id(client): len(client.received) for client in connected}
+                sender.start()
+                wait_until = time.monotonic() + args.broadcast_timeout
+                while time.monotonic() < wait_until:
+                    pool.pump(0.05)
+                    if all(len(client.received) > before[id(client)] for client in connected):
+                        break
+                sender.join()
+                if responses and responses[0][0] == 200:
+                    emit_ms.append(json.loads(responses[0][2])['emit_ms'] / 1000)
+                delivered = []
+                for client in connected:
+                    if len(client.received) > before[id(client)]:
+                        ts = max(client.received)
+                        delivered.append(client.received[ts] - ts)
+                latencies.extend(delivered)
+                if len(delivered) == len(connected) and delivered:
+                    full_delivery.append(max(delivered))
+                time.sleep(args.broadcast_interval)
+
+            result.update({
+                'broadcasts': args.broadcasts,
+                'delivery': summarize(latencies) if latencies else None,
+                'undelivered': args.broadcasts * len(connected) - len(latencies),
+                'full_delivery': summarize(full_delivery) if full_delivery else None,
+                'server_emit': summarize(emit_ms) if emit_ms else None,
+                'server_after_broadcasts': read_process_status(server.pid),
+            })
+            return result
+        finally:
+            if pool is not None:
+                pool.close()
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modes', default='threading,eventlet,gevent', help='Режимы SOCKETIO_ASYNC_MODE')
+    parser.add_argument('--clients', default='1000,5000', help='Числа клиентов через запятую')
+    parser.add_argument('--broadcasts', type=int, default=5, help='Рассылок на каждый замер')
+    parser.add_argument('--broadcast-interval', type=float, default=0.5, help='Пауза между рассылками, секунды')
+    parser.add_argument('--broadcast-timeout', type=float, default=60, help='Ожидание доставки рассылки, секунды')
+    parser.add_argument('--connect-timeout', type=float, default=180, help='Время на подключение клиентов')
+    parser.add_argument('--window', type=int, default=100, help='Одновременных рукопожатий')
+    parser.add_argument('--users', type=int, default=100, help='Пользователей в синтетическом shiro.ini')
+    parser.add_argument('--output', help='Сохранить JSON в файл')
+    args = parser.parse_args()
+
+    results = {}
+    for mode in [mode.strip() for mode in args.modes.split(',') if mode.strip()]:
+        if mode != 'threading' and importlib.util.find_spec(mode) is None:
+            results[mode] = {'skipped': f'пакет {mode} не установлен'}
+            continue
+        results[mode] = {}
+        for clients in [int(value) for value in args.clients.split(',') if value.strip()]:
+            results[mode][str(clients)] = run_capacity(mode, clients, args)
+
+    report = {
+        'benchmark': 'socketio_capacity',
+        'environment': environment(),
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'results': results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
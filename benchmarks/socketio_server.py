@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Сервер для socketio_capacity.py: app.py на временном shiro.ini в режиме SOCKETIO_ASYNC_MODE
+
+Режим читается при импорте app.py (там же выполняется monkey patching для
+eventlet/gevent), поэтому common импортируется раньше остальных модулей.
+Добавляет маршрут POST /bench/broadcast, который рассылает всем клиентам
+событие bench_broadcast с временем отправки.
+"""
+from common import app_module, generate_shiro_ini, install_stubs
+
+import argparse  # noqa: E402
+import os  # noqa: E402
+import tempfile  # noqa: E402
+import time  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--users', type=int, default=100, help='Пользователей в синтетическом shiro.ini')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'shiro.ini')
+        generate_shiro_ini(path, args.users)
+        install_stubs(path)
+
+        @app_module.app.route('/bench/broadcast', methods=['POST'])
+        def bench_broadcast():
+            started = time.perf_counter()
+            app_module.emit_event('bench_broadcast', {'ts': time.time()})
+            return app_module.jsonify({'emit_ms': round((time.perf_counter() - started) * 1000, 3)})
+
+        app_module.socketio.run(app_module.app, host='127.0.0.1', port=args.port, log_output=False,
+                                **app_module.socketio_server_options())
+
+
+if __name__ == '__main__':
+    main()
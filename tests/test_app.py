@@ -1,10 +1,39 @@
 import pytest
 import sys
 import os
+import errno
+import io
+import json
+import tempfile
+import threading
+import time
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Фоновый наблюдатель shiro.ini в тестах не запускается: тесты подменяют файл и open()
+os.environ.setdefault('SHIRO_WATCH', 'off')
+# Журналы и аудит тестов (и запускаемых ими процессов) не попадают в logs/ репозитория
+os.environ['LOG_DIR'] = tempfile.mkdtemp(prefix='zeppelin-user-mgmt-tests-')
+os.environ['AUDIT_DB_PATH'] = ''
 
+import app as app_module
 from app import app
 
+SAMPLE_SHIRO_INI = """[users]
+admin = admin123, admin
+alice = alicepass, role1, role2
+bob = bobpass
+
+[main]
+sessionManager = org.apache.shiro.web.session.mgt.DefaultWebSessionManager
+
+[roles]
+admin = *
+role1 = *
+role2 = notebook:read
+
+[urls]
+/** = authc
+"""
+
 @pytest.fixture
 def client():
     app.config['TESTING'] = True
@@ -12,6 +41,16 @@ def client():
     with app.test_client() as client:
         yield client
 
+@pytest.fixture
+def shiro_file(tmp_path, monkeypatch):
+    """Temporary shiro.ini used instead of the real one"""
+    path = tmp_path / 'shiro.ini'
+    path.write_text(SAMPLE_SHIRO_INI, encoding='utf-8')
+    monkeypatch.setattr(app_module, 'shiro_ini_path', str(path))
+    app_module.invalidate_shiro_cache()
+    yield path
+    app_module.invalidate_shiro_cache()
+
 def test_login_page(client):
     """Test login page loads"""
     rv = client.get('/')
@@ -95,4 +134,1308 @@ def test_protected_routes_require_login(client):
     
     for route in protected_routes:
         rv = client.get(route) if route == '/dashboard' or route == '/check_zeppelin_status' else client.post(route)
-        assert rv.status_code == 302, f"Route {route} should redirect to login"
\ No newline at end of file
+        assert rv.status_code == 302, f"Route {route} should redirect to login"
+
+def test_read_shiro_ini_uses_cache(shiro_file, monkeypatch):
+    """Unchanged shiro.ini is parsed once and served from cache afterwards"""
+    users, roles, _ = app_module.read_shiro_ini()
+    assert users['alice']['roles'] == ['role1', 'role2']
+    assert 'role2' in roles
+
+    def fail_open(*args, **kwargs):
+        raise AssertionError('shiro.ini should not be re-read')
+
+    monkeypatch.setattr('builtins.open', fail_open)
+    cached_users, _, _ = app_module.read_shiro_ini()
+    assert cached_users == users
+
+def test_read_shiro_ini_cache_returns_copies(shiro_file):
+    """Mutating the returned data does not leak into the cache"""
+    users, roles, sections = app_module.read_shiro_ini()
+    users.assign_role('alice', 'admin')
+    roles['extra'] = '*'
+    sections['users'].clear()
+
+    users, roles, sections = app_module.read_shiro_ini()
+    assert users['alice']['roles'] == ['role1', 'role2']
+    assert 'extra' not in roles
+    assert sections['users']
+
+def test_read_shiro_ini_cache_invalidation(shiro_file):
+    """Both our own writes and external edits are picked up"""
+    users, roles, sections = app_module.read_shiro_ini()
+    users.set_user('carol', 'carolpass', ['role1'])
+    assert app_module.write_shiro_ini(users, roles, sections)
+    assert 'carol' in app_module.read_shiro_ini()[0]
+
+    shiro_file.write_text(SAMPLE_SHIRO_INI + '\n', encoding='utf-8')
+    assert 'carol' not in app_module.read_shiro_ini()[0]
+
+def test_user_store_role_index():
+    """UserStore keeps the role -> users index in sync with mutations"""
+    store = app_module.UserStore()
+    store.set_user('alice', 'a', ['role1', 'role2'])
+    store.set_user('bob', 'b', ['role2'])
+    assert store.role_members('role2') == {'alice', 'bob'}
+    assert store.has_role('alice', 'role1')
+
+    assert store.assign_role('bob', 'role1')
+    assert not store.assign_role('bob', 'role1')
+    assert store.role_members('role1') == {'alice', 'bob'}
+
+    assert store.unassign_role('alice', 'role2')
+    assert not store.unassign_role('alice', 'role2')
+    assert store.role_members('role2') == {'bob'}
+
+    store.set_user('bob', 'b2', ['role3'])
+    assert store.role_members('role1') == {'alice'}
+    assert store.role_members('role3') == {'bob'}
+
+    assert store.remove_user('alice')
+    assert store.count_role_members('role1') == 0
+    assert list(store) == ['bob']
+    assert store['bob'] == {'password': 'b2', 'roles': ['role3']}
+
+def test_assign_and_unassign_role_routes(client, shiro_file):
+    """Role routes update shiro.ini and keep role order stable"""
+    with client.session_transaction() as sess:
+        sess['username'] = 'admin'
+
+    client.post('/assign_user_role', data={'username': 'bob', 'role': 'role2'})
+    client.post('/assign_user_role', data={'username': 'bob', 'role': 'role1'})
+    client.post('/unassign_user_role', data={'username': 'alice', 'role': 'role1'})
+
+    users, _, _ = app_module.read_shiro_ini()
+    assert users.get_roles('bob') == ['role2', 'role1']
+    assert users.get_roles('alice') == ['role2']
+    assert users.role_members('role2') == {'alice', 'bob'}
+    assert 'bob = bobpass, role2, role1\n' in shiro_file.read_text(encoding='utf-8')
+
+def test_write_shiro_ini_is_atomic_and_incremental(shiro_file):
+    """Only changed sections are rewritten, the file is replaced atomically"""
+    original = shiro_file.read_text(encoding='utf-8')
+    os.chmod(shiro_file, 0o640)
+    original_inode = os.stat(shiro_file).st_ino
+
+    users, roles, sections = app_module.read_shiro_ini()
+    users.set_password('bob', 'newpass')
+    assert app_module.write_shiro_ini(users, roles, sections)
+
+    updated = shiro_file.read_text(encoding='utf-8')
+    assert 'bob = newpass\n' in updated
+    # [main], [roles] и [urls] не изменились ни на байт
+    assert updated.split('[main]', 1)[1] == original.split('[main]', 1)[1]
+    assert os.stat(shiro_file).st_ino != original_inode
+    assert oct(os.stat(shiro_file).st_mode & 0o777) == oct(0o640)
+
+    backup = shiro_file.parent / 'shiro.ini.backup'
+    assert backup.read_text(encoding='utf-8') == original
+    assert sorted(p.name for p in shiro_file.parent.iterdir()) == ['shiro.ini', 'shiro.ini.backup']
+
+def test_write_shiro_ini_skips_unchanged(shiro_file):
+    """Writing back unmodified data does not touch the file"""
+    before = os.stat(shiro_file)
+    users, roles, sections = app_module.read_shiro_ini()
+    assert app_module.write_shiro_ini(users, roles, sections)
+    after = os.stat(shiro_file)
+    assert (before.st_ino, before.st_mtime_ns) == (after.st_ino, after.st_mtime_ns)
+
+    roles['role3'] = '*'
+    assert app_module.write_shiro_ini(users, roles, sections)
+    text = shiro_file.read_text(encoding='utf-8')
+    assert 'role3 = *\n' in text
+    assert text.startswith(SAMPLE_SHIRO_INI.split('[roles]')[0])
+
+def test_write_shiro_ini_bind_mount_fallback(shiro_file, monkeypatch):
+    """When rename onto shiro.ini fails with EBUSY the file is written in place"""
+    original = shiro_file.read_text(encoding='utf-8')
+    original_inode = os.stat(shiro_file).st_ino
+    real_replace = os.replace
+
+    def busy_replace(src, dst):
+        if str(dst) == str(shiro_file):
+            raise OSError(errno.EBUSY, 'Device or resource busy')
+        return real_replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', busy_replace)
+    users, roles, sections = app_module.read_shiro_ini()
+    users.remove_user('bob')
+    assert app_module.write_shiro_ini(users, roles, sections)
+
+    assert os.stat(shiro_file).st_ino == original_inode
+    assert 'bob' not in shiro_file.read_text(encoding='utf-8')
+    assert (shiro_file.parent / 'shiro.ini.backup').read_text(encoding='utf-8') == original
+
+def test_api_batch_applies_all_operations(client, shiro_file):
+    """Batch endpoint applies operations in order with a single write"""
+    with client.session_transaction() as sess:
+        sess['username'] = 'admin'
+
+    rv = client.post('/api/batch', json=[
+        {'op': 'add_role', 'role_name': 'analyst'},
+        {'op': 'add_user', 'username': 'carol', 'password': 'carolpass'},
+        {'op': 'assign_role', 'username': 'carol', 'role': 'analyst'},
+        {'op': 'change_password', 'username': 'bob', 'new_password': 'bobnew'},
+        {'op': 'delete_user', 'username': 'alice'},
+    ])
+    assert rv.status_code == 200
+    data = rv.get_json()
+    assert data['success'] and data['applied'] == 5
+    assert all(result['success'] for result in data['results'])
+
+    users, roles, _ = app_module.read_shiro_ini()
+    assert users.get_roles('carol') == ['analyst']
+    assert users.get_password('bob') == 'bobnew'
+    assert 'alice' not in users and 'analyst' in roles
+
+def test_api_batch_is_all_or_nothing(client, shiro_file):
+    """One invalid operation rejects the whole batch"""
+    with client.session_transaction() as sess:
+        sess['username'] = 'admin'
+    original = shiro_file.read_text(encoding='utf-8')
+
+    rv = client.post('/api/batch', json={'operations': [
+        {'op': 'add_user', 'username': 'carol', 'password': 'carolpass'},
+        {'op': 'delete_user', 'username': 'admin'},
+        {'op': 'add_user', 'username': 'x=y', 'password': 'pass'},
+    ]})
+    assert rv.status_code == 400
+    results = rv.get_json()['results']
+    assert [result['success'] for result in results] == [True, False, False]
+    assert shiro_file.read_text(encoding='utf-8') == original
+
+def test_api_import_csv_streams_errors(client, shiro_file):
+    """CSV import skips bad rows, reports them and commits the rest once"""
+    with client.session_transaction() as sess:
+        sess['username'] = 'admin'
+
+    csv_data = (
+        'username,password,roles\n'
+        'carol,carolpass,"role1, role2"\n'
+        'alice,dup,role1\n'
+        'dave,davepass,nosuchrole\n'
+        'x,short,\n'
+        'erin,erinpass,\n'
+    )
+    rv = client.post('/api/import', data={'file': (io.BytesIO(csv_data.encode('utf-8')), 'users.csv')},
+                     content_type='multipart/form-data')
+    assert rv.status_code == 200
+    events = [json.loads(line) for line in rv.data.decode('utf-8').splitlines()]
+    assert [event['line'] for event in events[:-1]] == [3, 4, 5]
+    summary = events[-1]
+    assert summary['processed'] == 5 and summary['imported'] == 2 and summary['errors'] == 3
+
+    users, _, _ = app_module.read_shiro_ini()
+    assert users.get_roles('carol') == ['role1', 'role2']
+    assert 'erin' in users and 'dave' not in users
+    assert users.get_password('alice') == 'alicepass'
+
+def test_import_users_cli_jsonl(shiro_file, tmp_path):
+    """flask import-users reads JSONL files"""
+    source = tmp_path / 'users.jsonl'
+    source.write_text(
+        json.dumps({'username': 'carol', 'password': 'carolpass', 'roles': ['role1']}) + '\n'
+        + json.dumps({'username': 'alice', 'password': 'newalice'}) + '\n',
+        encoding='utf-8')
+
+    result = app.test_cli_runner().invoke(args=['import-users', str(source), '--update-existing'])
+    assert result.exit_code == 0, result.output
+    users, _, _ = app_module.read_shiro_ini()
+    assert users.get_roles('carol') == ['role1']
+    assert users.get_password('alice') == 'newalice'
+
+def test_import_hashes_outside_realm_lock_and_reports_to_requester(client, shiro_file, monkeypatch):
+    """Import hashes without holding realm_lock, merges conflicts cleanly and reports progress to its session only"""
+    lock_held_while_hashing = []
+    encode_many = app_module.password_service.encode_many
+
+    def checking_encode_many(passwords, scheme):
+        lock_held_while_hashing.append(app_module.realm_lock.held())
+        if passwords and 'late' not in app_module.read_shiro_ini(copy=False)[0]:
+            # Пока идет хэширование, другой администратор добавляет пользователя
+            users, roles, sections = app_module.read_shiro_ini()
+            users.set_user('late', 'latepass')
+            assert app_module.write_shiro_ini(users, roles, sections)
+        return encode_many(passwords, scheme)
+
+    monkeypatch.setattr(app_module.password_service, 'encode_many', checking_encode_many)
+    monkeypatch.setattr(app_module.socketio, 'start_background_task', lambda target: None)
+    other = app.test_client()
+    for browser in (client, other):
+        with browser.session_transaction() as sess:
+            sess['username'] = 'admin'
+        browser.get('/api/version')
+    importer_ws = app_module.socketio.test_client(app, flask_test_client=client)
+    other_ws = app_module.socketio.test_client(app, flask_test_client=other)
+
+    csv_data = 'carol,carolpass,role1\nlate,latepass2,\ncarol,again,\n'
+    rv = client.post('/api/import', data={'file': (io.BytesIO(csv_data.encode('utf-8')), 'users.csv')},
+                     content_type='multipart/form-data')
+    events = [json.loads(line) for line in rv.data.decode('utf-8').splitlines()]
+    assert events[:-1] == [{'line': 3, 'error': 'Пользователь carol уже существует'},
+                           {'line': 2, 'error': 'Пользователь late уже существует'}]
+    assert events[-1]['imported'] == 1 and events[-1]['errors'] == 2
+    assert lock_held_while_hashing and not any(lock_held_while_hashing)
+    users, _, _ = app_module.read_shiro_ini()
+    assert users.get_password('late') == 'latepass' and users.get_roles('carol') == ['role1']
+
+    progress = [packet for packet in importer_ws.get_received() if packet['name'] == 'import_progress']
+    assert progress and progress[-1]['args'][0]['done']
+    assert progress[0]['args'][0]['processed'] == 0 and not progress[0]['args'][0]['done']
+    assert 'import-counters' in client.get('/dashboard').get_data(as_text=True)
+    assert not [packet for packet in other_ws.get_received() if packet['name'] == 'import_progress']
+    importer_ws.disconnect()
+    other_ws.disconnect()
+
+
+def test_write_shiro_ini_fails_cleanly_outside_request(shiro_file, monkeypatch):
+    """CLI callers get False and a log entry instead of a request-context error"""
+    users, roles, sections = app_module.read_shiro_ini()
+    users.set_user('carol', 'carolpass')
+    monkeypatch.setattr(app_module, '_atomic_write_text', lambda path, content: (_ for _ in ()).throw(
+        PermissionError(errno.EACCES, 'denied')))
+    assert app_module.write_shiro_ini(users, roles, sections) is False
+    monkeypatch.setattr(app_module, '_atomic_write_text', lambda path, content: (_ for _ in ()).throw(
+        OSError(errno.ENOSPC, 'full')))
+    assert app_module.write_shiro_ini(users, roles, sections) is False
+
+
+def test_system_info_is_cached(monkeypatch, tmp_path):
+    """Installation is detected once and re-detected when the daemon script disappears"""
+    daemon = tmp_path / 'zeppelin-daemon.sh'
+    daemon.write_text('#!/bin/sh\n')
+    calls = []
+
+    def fake_detect():
+        calls.append(1)
+        return {'os': 'Linux', 'service_manager': 'zeppelin-daemon.sh', 'demo_mode': False,
+                'zeppelin_type': 'daemon', 'daemon_path': str(daemon), 'commands': {}}
+
+    monkeypatch.setattr(app_module, '_detect_system_info', fake_detect)
+    cache = app_module.SystemInfo()
+    assert cache.get()['zeppelin_type'] == 'daemon'
+    cache.get()
+    assert len(calls) == 1
+    assert cache.describe()['detection_ms'] is not None
+
+    daemon.unlink()
+    cache.get()
+    assert len(calls) == 2
+
+    # Одновременные первые обращения выполняют одно определение
+    daemon.write_text('#!/bin/sh\n')
+
+    def slow_detect():
+        time.sleep(0.05)
+        return fake_detect()
+
+    monkeypatch.setattr(app_module, '_detect_system_info', slow_detect)
+    cache = app_module.SystemInfo()
+    threads = [threading.Thread(target=cache.get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 3
+
+def test_system_info_endpoints(client, monkeypatch):
+    """System info can be read and refreshed through the API"""
+    monkeypatch.setattr(app_module, '_detect_system_info', lambda: {
+        'os': 'Linux', 'service_manager': 'systemctl', 'demo_mode': False,
+        'zeppelin_type': 'systemd', 'commands': {}})
+    monkeypatch.setattr(app_module, 'system_info_cache', app_module.SystemInfo())
+    with client.session_transaction() as sess:
+        sess['username'] = 'admin'
+
+    rv = client.post('/api/system_info/refresh')
+    assert rv.status_code == 200
+    assert rv.get_json()['zeppelin_type'] == 'systemd'
+    data = client.get('/api/system_info').get_json()
+    assert data['service_manager'] == 'systemctl' and data['detected_at']
+
+def test_status_cache_single_flight_and_ttl():
+    """Concurrent callers share one probe, results are reused for the TTL"""
+    calls = []
+    release = threading.Event()
+
+    def slow_probe():
+        calls.append(1)
+        release.wait(5)
+        return {'status': 'running', 'n': len(calls)}
+
+    cache = app_module.StatusCache(slow_probe, ttl=60)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get())) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert len(results) == 10 and all(result['n'] == 1 for result in results)
+    assert cache.get()['n'] == 1
+    assert len(calls) == 1
+
+def test_status_cache_stale_while_revalidate():
+    """Stale status is returned immediately while a background probe refreshes it"""
+    calls = []
+    release = threading.Event()
+
+    def probe():
+        calls.append(1)
+        if len(calls) > 1:
+            release.wait(5)
+        return {'status': 'running', 'n': len(calls)}
+
+    cache = app_module.StatusCache(probe, ttl=60)
+    assert cache.get(allow_stale=True, wait=False) is None
+    time.sleep(0.1)
+    assert cache.get()['n'] == 1
+
+    cache.invalidate()
+    stale = cache.get(allow_stale=True)
+    assert stale['n'] == 1 and stale['stale']
+    release.set()
+    assert cache.get()['n'] == 2
+    assert len(calls) == 2
+
+
+def test_status_cache_follower_never_probes(tmp_path):
+    """While a leader is alive, a follower serves the leader's status and only asks it to refresh"""
+    leader = app_module.LeaderElection(str(tmp_path / 'leader.lock'))
+    follower = app_module.LeaderElection(str(tmp_path / 'leader.lock'))
+    assert leader.is_leader()
+    probes, requests = [], []
+    cache = app_module.StatusCache(lambda: probes.append(1) or {'status': 'running', 'n': len(probes)}, ttl=0.05)
+    cache.follow(follower, requests.append)
+    cache.LEADER_WAIT = 0.05
+
+    assert cache.get(wait=False) is None
+    assert cache.get()['status'] == 'unknown'
+    assert requests == [False]
+
+    cache.prime({'status': 'stopped'})
+    time.sleep(0.1)
+    assert cache.get()['status'] == 'stopped'
+    assert requests == [False, False]
+    assert cache.get(allow_stale=True)['status'] == 'stopped'
+    assert requests == [False, False]
+
+    cache.invalidate()
+    assert cache.get()['status'] == 'stopped'
+    assert requests == [False, False, True]
+    assert probes == []
+
+    leader.resign()
+    assert cache.get()['n'] == 1
+    follower.resign()
+
+def _make_fake_proc(root, pid, cmdline=b'java\x00org.apache.zeppelin.server.ZeppelinServer\x00'):
+    """Builds a minimal /proc tree for one process"""
+    root.mkdir(parents=True, exist_ok=True)
+    (root / 'stat').write_text('cpu  1 2 3\nbtime 1700000000\n')
+    proc = root / str(pid)
+    (proc / 'fd').mkdir(parents=True)
+    for fd in range(3):
+        (proc / 'fd' / str(fd)).write_text('')
+    (proc / 'cmdline').write_bytes(cmdline)
+    fields = ['S'] + ['0'] * 40
+    fields[11], fields[12], fields[17], fields[19] = '300', '100', '42', '500'
+    (proc / 'stat').write_text(f"{pid} (java (zeppelin)) " + ' '.join(fields) + '\n')
+    (proc / 'statm').write_text('1000 256 10 1 0 100 0\n')
+    (proc / 'status').write_text('Name:\tjava\nThreads:\t43\n')
+    (proc / 'io').write_text('rchar: 1\nread_bytes: 4096\nwrite_bytes: 8192\n')
+
+def test_read_process_metrics(tmp_path):
+    """Process metrics are read from /proc/<pid> files"""
+    _make_fake_proc(tmp_path, 1234)
+    metrics = app_module.read_process_metrics(1234, proc_root=str(tmp_path))
+    ticks = os.sysconf('SC_CLK_TCK')
+    assert metrics['rss_bytes'] == 256 * os.sysconf('SC_PAGE_SIZE')
+    assert metrics['cpu_seconds'] == round(400 / ticks, 2)
+    assert metrics['threads'] == 43
+    assert metrics['open_fds'] == 3
+    assert metrics['read_bytes'] == 4096 and metrics['write_bytes'] == 8192
+    assert app_module.read_process_metrics(999, proc_root=str(tmp_path)) is None
+
+def test_find_zeppelin_pid_from_daemon_pid_file(tmp_path, monkeypatch):
+    """The daemon pid file is used and stale pids are ignored"""
+    proc_root = tmp_path / 'proc'
+    _make_fake_proc(proc_root, 4321)
+    _make_fake_proc(proc_root, 5555, cmdline=b'bash\x00')
+    run_dir = tmp_path / 'zeppelin' / 'run'
+    run_dir.mkdir(parents=True)
+    (run_dir / 'zeppelin-interpreter-spark-host.pid').write_text('5555')
+    monkeypatch.delenv('ZEPPELIN_HOME', raising=False)
+    monkeypatch.setenv('ZEPPELIN_PID_DIR', str(run_dir))
+    system_info = {'zeppelin_type': 'daemon', 'daemon_path': str(tmp_path / 'zeppelin' / 'bin' / 'zeppelin-daemon.sh')}
+
+    assert app_module.find_zeppelin_pid(system_info, proc_root=str(proc_root)) is None
+    (run_dir / 'zeppelin-zeppelin-host.pid').write_text('5555\n')
+    assert app_module.find_zeppelin_pid(system_info, proc_root=str(proc_root)) is None
+    (run_dir / 'zeppelin-zeppelin-host.pid').write_text('4321\n')
+    assert app_module.find_zeppelin_pid(system_info, proc_root=str(proc_root)) == 4321
+    assert app_module.find_zeppelin_pid({'zeppelin_type': 'systemd'}, 'Main PID: 4321 (java)',
+                                        proc_root=str(proc_root)) == 4321
+
+def test_status_publisher_emits_only_on_change():
+    """Publisher emits on fingerprint changes and adapts its interval"""
+    statuses = [{'status': 'running', 'pid': '1', 'memory_usage': '1M'}]
+    emitted = []
+    publisher = app_module.StatusPublisher(lambda max_age: statuses[-1], emitted.append, interval=30,
+                                           fast_interval=2, max_interval=90, boost_window=60, heartbeat=0)
+
+    assert publisher.tick()
+    statuses.append({'status': 'running', 'pid': '1', 'memory_usage': '2M'})
+    assert not publisher.tick()
+    assert publisher.interval == 45
+    assert not publisher.tick() and not publisher.tick()
+    assert publisher.interval == 90
+
+    statuses.append({'status': 'stopped', 'pid': 'N/A'})
+    assert publisher.tick()
+    assert publisher.interval == 30
+    assert len(emitted) == 2
+
+    publisher.notify_action({'status': 'running', 'pid': '7'})
+    assert publisher.interval == 2
+    statuses.append({'status': 'running', 'pid': '7'})
+    assert not publisher.tick()
+    assert publisher.interval == 2
+
+def test_status_publisher_heartbeat():
+    """Heartbeat re-emits an unchanged status"""
+    emitted = []
+    publisher = app_module.StatusPublisher(lambda max_age: {'status': 'running'}, emitted.append,
+                                           heartbeat=0.01)
+    assert publisher.tick()
+    time.sleep(0.02)
+    assert publisher.tick()
+    assert len(emitted) == 2
+
+def test_status_publisher_tracks_clients(client, monkeypatch):
+    """Only authenticated WebSocket clients are counted and no thread runs at import"""
+    started = []
+    publisher = app_module.StatusPublisher(lambda max_age: {'status': 'running'}, lambda status: None)
+    monkeypatch.setattr(app_module, 'status_publisher', publisher)
+    monkeypatch.setattr(app_module.socketio, 'start_background_task', lambda target: started.append(target))
+
+    anonymous = app_module.socketio.test_client(app, flask_test_client=client)
+    assert not anonymous.is_connected()
+    assert publisher.client_count == 0 and not started
+
+    with client.session_transaction() as sess:
+        sess['username'] = 'admin'
+    ws = app_module.socketio.test_client(app, flask_test_client=client)
+    assert ws.is_connected()
+    assert publisher.client_count == 1 and len(started) == 1
+    ws.disconnect()
+    assert publisher.client_count == 0
+    assert not hasattr(app_module, 'status_thread')
+
+def test_service_job_queue_dedupes_and_serializes():
+    """Identical in-flight jobs are merged, different ones run one after another"""
+    release = threading.Event()
+    running = []
+    finished = []
+
+    def executor(command, progress):
+        running.append(command)
+        progress('work', f'{command} in progress')
+        release.wait(5)
+        return True, f'{command} done'
+
+    jobs = app_module.ServiceJobQueue(executor, on_finish=lambda job, ip: finished.append(job))
+    restart_job, created = jobs.submit('restart', 'admin')
+    assert created
+    same_job, created = jobs.submit('restart', 'bob')
+    assert not created and same_job['id'] == restart_job['id']
+    stop_job, created = jobs.submit('stop', 'admin')
+    assert created
+
+    time.sleep(0.1)
+    assert running == ['restart']
+    assert jobs.get(stop_job['id'])['state'] == 'queued'
+    release.set()
+    for _ in range(50):
+        if len(finished) == 2:
+            break
+        time.sleep(0.05)
+
+    assert running == ['restart', 'stop']
+    job = jobs.get(restart_job['id'])
+    assert job['state'] == 'succeeded' and job['message'] == 'restart done'
+    assert [step['phase'] for step in job['history']] == ['started', 'work', 'finished']
+
+def test_service_job_queue_is_shared_between_workers(tmp_path):
+    """With a shared state file, workers merge identical commands and run jobs one at a time in order"""
+    release = threading.Event()
+    running = []
+
+    def executor(command, progress):
+        running.append(command)
+        release.wait(5)
+        return True, f'{command} done'
+
+    state = app_module.SharedJobState(str(tmp_path / 'service-jobs.json'))
+    first = app_module.ServiceJobQueue(executor, shared=state)
+    second = app_module.ServiceJobQueue(executor, shared=state)
+    first.SHARED_POLL_INTERVAL = second.SHARED_POLL_INTERVAL = 0.02
+
+    restart_job, created = first.submit('restart', 'admin')
+    assert created
+    same_job, created = second.submit('restart', 'bob')
+    assert not created and same_job['id'] == restart_job['id']
+    stop_job, created = second.submit('stop', 'bob')
+    assert created
+
+    time.sleep(0.2)
+    assert running == ['restart']
+    assert second.get(restart_job['id'])['state'] == 'running'
+    assert [job['id'] for job in first.list_jobs()] == [stop_job['id'], restart_job['id']]
+    release.set()
+    deadline = time.monotonic() + 5
+    while first.get(stop_job['id'])['state'] != 'succeeded' and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert running == ['restart', 'stop']
+    assert first.get(stop_job['id'])['message'] == 'stop done'
+
+    # Задача завершившегося воркера не блокирует очередь
+    state.update(lambda data: (data['jobs'].update({'dead': {**restart_job, 'id': 'dead', 'state': 'queued',
+                                                              'worker': f'{app_module.socket.gethostname()}:999999'}}),
+                               data['active'].append('dead')))
+    _, created = first.submit('restart', 'admin')
+    assert created and first.get('dead')['state'] == 'failed'
+
+
+def test_service_routes_return_job(client, monkeypatch):
+    """Service routes enqueue a job and /api/jobs/<id> reports it"""
+    jobs = app_module.ServiceJobQueue(lambda command, progress: (True, 'ok'))
+    monkeypatch.setattr(app_module, 'service_jobs', jobs)
+    with client.session_transaction() as sess:
+        sess['username'] = 'admin'
+
+    rv = client.post('/restart_zeppelin', headers={'Accept': 'application/json'})
+    assert rv.status_code == 202
+    job_id = rv.get_json()['job']['id']
+    for _ in range(50):
+        if client.get(f'/api/jobs/{job_id}').get_json()['state'] == 'succeeded':
+            break
+        time.sleep(0.02)
+    assert client.get(f'/api/jobs/{job_id}').get_json()['state'] == 'succeeded'
+    assert client.get('/api/jobs/unknown').status_code == 404
+
+    rv = client.post('/stop_zeppelin')
+    assert rv.status_code == 302
+
+
+def _start_http_stub(status=200, port=0):
+    """Starts a throwaway HTTP server answering every GET with the given status"""
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(status)
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _free_port():
+    import socket
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_readiness_checker_polls_until_ready():
+    """Readiness returns as soon as the endpoint answers and times out on a closed port"""
+    port = _free_port()
+    checker = app_module.ReadinessChecker(f'http://127.0.0.1:{port}', initial_delay=0.02, max_delay=0.05,
+                                          request_timeout=0.5)
+    ready, elapsed = checker.wait_until_ready(0.2)
+    assert not ready and elapsed >= 0.2
+    assert checker.wait_until_down(0.2)[0]
+
+    servers = []
+    timer = threading.Timer(0.1, lambda: servers.append(_start_http_stub(port=port)))
+    timer.start()
+    try:
+        ready, elapsed = checker.wait_until_ready(5)
+        assert ready and elapsed < 2
+        assert checker.port_open()
+    finally:
+        timer.join()
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+
+def test_readiness_checker_treats_5xx_as_not_ready():
+    server = _start_http_stub(status=503)
+    try:
+        checker = app_module.ReadinessChecker(f'http://127.0.0.1:{server.server_port}', initial_delay=0.02)
+        assert checker.port_open()
+        assert not checker.probe()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_shiro1_hash_roundtrip():
+    """$shiro1$ hashes follow Shiro's SimpleHash layout and verify correctly"""
+    import base64
+    import hashlib
+    credential = app_module.hash_password('s3cret', 'sha256', iterations=3)
+    prefix, algorithm, iterations, salt, hashed = credential.split('$')[1:]
+    assert (prefix, algorithm, iterations) == ('shiro1', 'SHA-256', '3')
+    expected = hashlib.sha256(base64.b64decode(salt) + b's3cret').digest()
+    for _ in range(2):
+        expected = hashlib.sha256(expected).digest()
+    assert base64.b64decode(hashed) == expected
+
+    assert app_module.verify_credential('s3cret', credential)
+    assert not app_module.verify_credential('wrong', credential)
+    assert app_module.verify_credential('plain', 'plain')
+    assert not app_module.verify_credential('plain', '$shiro1$WHIRLPOOL$1$AA==$AA==')
+
+
+def test_login_with_hashed_credential_uses_cache(client, shiro_file, monkeypatch):
+    """Hashed logins are verified once, then served from the verification cache"""
+    credential = app_module.hash_password('admin123', 'sha256', iterations=50)
+    shiro_file.write_text(SAMPLE_SHIRO_INI.replace('admin = admin123', f'admin = {credential}'), encoding='utf-8')
+    service = app_module.PasswordService(max_workers=2, cache_ttl=60)
+    monkeypatch.setattr(app_module, 'password_service', service)
+
+    for _ in range(3):
+        rv = client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        assert rv.headers['Location'].endswith('/dashboard')
+    rv = client.post('/login', data={'username': 'admin', 'password': 'nope'})
+    assert not rv.headers['Location'].endswith('/dashboard')
+
+    stats = service.stats()
+    assert stats['hash_computations'] == 2
+    assert stats['cache_hits'] == 2
+
+
+def test_password_verify_with_already_finished_future(monkeypatch):
+    """A hash job that completes before its callback is attached must not deadlock verify()"""
+    from concurrent.futures import Future
+    credential = app_module.hash_password('secret', 'sha256', iterations=10)
+    service = app_module.PasswordService(max_workers=1, cache_ttl=60, verify_func=lambda password, cred: True)
+
+    def submit_finished(func, *args):
+        future = Future()
+        future.set_result(True)
+        return future
+
+    monkeypatch.setattr(service._executor, 'submit', submit_finished)
+    result = []
+    worker = threading.Thread(target=lambda: result.append(service.verify('alice', 'secret', credential)),
+                              daemon=True)
+    worker.start()
+    worker.join(5)
+    assert result == [True]
+    assert service.verify('alice', 'secret', credential) and service.stats()['cache_hits'] == 1
+
+
+def test_password_hashed_when_matcher_configured(client, shiro_file, monkeypatch):
+    """With PasswordMatcher in [main], new passwords are written as $shiro1$ hashes"""
+    shiro_file.write_text(SAMPLE_SHIRO_INI.replace(
+        '[main]\n', '[main]\npasswordMatcher = org.apache.shiro.authc.credential.PasswordMatcher\n'), encoding='utf-8')
+    monkeypatch.setattr(app_module, 'SHIRO_HASH_ITERATIONS', 5)
+    with client.session_transaction() as sess:
+        sess['username'] = 'admin'
+
+    client.post('/change_password', data={'username': 'bob', 'new_password': 'newpass'})
+    client.post('/add_user', data={'username': 'carol', 'password': 'carolpass'})
+
+    users, _, _ = app_module.read_shiro_ini()
+    assert users.get_password('bob').startswith('$shiro1$SHA-256$5$')
+    assert app_module.verify_credential('newpass', users.get_password('bob'))
+    assert app_module.verify_credential('carolpass', users.get_password('carol'))
+    assert users.get_password('alice') == 'alicepass'
+
+
+def test_batch_and_routes_hash_outside_realm_lock(client, shiro_file, monkeypatch):
+    """Batch passwords are hashed in one pooled call before realm_lock; single routes hash before it too"""
+    shiro_file.write_text(SAMPLE_SHIRO_INI.replace(
+        '[main]\n', '[main]\npasswordMatcher = org.apache.shiro.authc.credential.PasswordMatcher\n'), encoding='utf-8')
+    monkeypatch.setattr(app_module, 'SHIRO_HASH_ITERATIONS', 5)
+    calls = []
+    encode_many = app_module.password_service.encode_many
+
+    def checking_encode_many(passwords, scheme):
+        calls.append((list(passwords), scheme, app_module.realm_lock.held()))
+        return encode_many(passwords, scheme)
+
+    monkeypatch.setattr(app_module.password_service, 'encode_many', checking_encode_many)
+    monkeypatch.setattr(app_module.password_service, 'encode', lambda *args: pytest.fail('hashed under realm_lock'))
+    with client.session_transaction() as sess:
+        sess['username'] = 'admin'
+
+    rv = client.post('/api/batch', json=[
+        {'op': 'add_user', 'username': 'carol', 'password': 'carolpass'},
+        {'op': 'add_user', 'username': 'dave', 'password': 'davepass'},
+        {'op': 'change_password', 'username': 'bob', 'new_password': 'bobnew'},
+        {'op': 'add_user', 'username': 'erin', 'password': 'x'},
+    ])
+    assert rv.status_code == 400
+    assert calls == [(['carolpass', 'davepass', 'bobnew'], 'sha256', False)]
+
+    calls.clear()
+    rv = client.post('/api/batch', json=[
+        {'op': 'add_user', 'username': 'carol', 'password': 'carolpass'},
+        {'op': 'change_password', 'username': 'bob', 'new_password': 'bobnew'},
+    ])
+    assert rv.get_json()['success']
+    client.post('/change_password', data={'username': 'alice', 'new_password': 'alicenew'})
+    client.post('/add_user', data={'username': 'frank', 'password': 'frankpass'})
+    assert [call[0] for call in calls] == [['carolpass', 'bobnew'], ['alicenew'], ['frankpass']]
+    assert not any(call[2] for call in calls)
+
+    users, _, _ = app_module.read_shiro_ini()
+    for username, password in (('carol', 'carolpass'), ('bob', 'bobnew'), ('alice', 'alicenew'),
+                               ('frank', 'frankpass')):
+        assert app_module.verify_credential(password, users.get_password(username))
+
+
+def test_login_throttle_buckets_and_memory_cap():
+    """Token buckets refill over time and the table never exceeds its cap"""
+    now = [0.0]
+    throttle = app_module.LoginThrottle(ip_burst=3, ip_per_minute=60, user_burst=2, user_per_minute=60,
+                                        max_entries=100, clock=lambda: now[0])
+    assert throttle.check('10.0.0.1', 'alice')[0]
+    assert throttle.check('10.0.0.1', 'ALICE')[0]
+    allowed, retry_after = throttle.check('10.0.0.1', 'alice')
+    assert not allowed and retry_after == 1
+    now[0] += 1
+    assert throttle.check('10.0.0.1', 'alice')[0]
+    assert throttle.check('10.0.0.1', 'bob')[0]
+    assert not throttle.check('10.0.0.1', 'bob')[0]
+
+    for index in range(10000):
+        throttle.check(f'192.0.2.{index}', f'user{index}')
+    stats = throttle.stats()
+    assert stats['tracked_ips'] == 100 and stats['tracked_users'] == 100
+    assert stats['rejected_ip'] == 1 and stats['rejected_user'] == 1
+    assert stats['evictions'] > 0
+
+
+def test_login_rejected_before_reading_shiro(client, shiro_file, monkeypatch):
+    """Over-limit logins get 429 without touching shiro.ini or the log"""
+    monkeypatch.setattr(app_module, 'login_throttle',
+                        app_module.LoginThrottle(ip_burst=2, ip_per_minute=0.001, user_burst=10))
+    for _ in range(2):
+        assert client.post('/login', data={'username': 'bob', 'password': 'bad'}).status_code == 302
+
+    def fail(*args, **kwargs):
+        raise AssertionError('should not be called')
+    monkeypatch.setattr(app_module, 'read_shiro_ini', fail)
+    monkeypatch.setattr(app_module, 'log_user_action', fail)
+    rv = client.post('/login', data={'username': 'bob', 'password': 'bad'})
+    assert rv.status_code == 429
+    assert int(rv.headers['Retry-After']) > 0
+
+
+def test_queue_handler_drops_when_full():
+    """A full log queue drops records instead of blocking the caller"""
+    import logging
+    import queue
+    handler = app_module.DroppingQueueHandler(queue.Queue(maxsize=1))
+    for index in range(3):
+        handler.handle(logging.makeLogRecord({'msg': f'record {index}'}))
+    assert handler.dropped == 2
+    assert handler.queue.get_nowait().getMessage() == 'record 0'
+
+
+def test_audit_record_fields(client, caplog):
+    """log_user_action attaches a structured audit payload rendered as JSON"""
+    import logging
+    with caplog.at_level(logging.INFO, logger='app'):
+        with app.test_request_context('/', environ_base={'REMOTE_ADDR': '10.1.2.3'}):
+            app_module.log_user_action('DELETE_USER', 'admin', 'Deleted user: bob', target='bob')
+    record = next(r for r in caplog.records if getattr(r, 'audit', None))
+    assert app_module.AuditRecordFilter().filter(record)
+    payload = json.loads(app_module.JsonAuditFormatter().format(record))
+    assert {k: payload[k] for k in ('action', 'actor', 'target', 'ip')} == {
+        'action': 'DELETE_USER', 'actor': 'admin', 'target': 'bob', 'ip': '10.1.2.3'}
+    assert payload['ts']
+    assert not app_module.AuditRecordFilter().filter(logging.makeLogRecord({'msg': 'plain'}))
+
+
+def test_audit_store_filters_paginates_and_compacts(tmp_path):
+    """Audit events can be filtered, paged by cursor and expired by retention"""
+    store = app_module.AuditStore(str(tmp_path / 'audit.db'), retention_days=30)
+    now = time.time()
+    store.record_many([(now - 90 * 86400, 'ASSIGN_ROLE', 'admin', 'alice', '10.0.0.1', 'old')] + [
+        (now - index, 'ASSIGN_ROLE' if index % 2 else 'DELETE_USER', 'admin', 'alice' if index % 3 else 'bob',
+         '10.0.0.1', f'event {index}') for index in range(10)])
+
+    page = store.query(target='alice', limit=3)
+    assert [event['details'] for event in page['events']] == ['event 1', 'event 2', 'event 4']
+    page = store.query(target='alice', limit=3, cursor=page['next_cursor'])
+    assert [event['details'] for event in page['events']] == ['event 5', 'event 7', 'event 8']
+    page = store.query(target='alice', limit=3, cursor=page['next_cursor'])
+    assert [event['details'] for event in page['events']] == ['old'] and page['next_cursor'] is None
+
+    assert len(store.query(action='DELETE_USER', since=now - 4.5)['events']) == 3
+    assert store.compact(now=now) == 1
+    assert store.count() == 10
+
+
+def test_api_audit_endpoint(client, tmp_path, monkeypatch):
+    """log_user_action events reach the SQLite store and are served by /api/audit"""
+    store = app_module.AuditStore(str(tmp_path / 'audit.db'))
+    handler = app_module.AuditStoreHandler(store)
+    app_module.logger.addHandler(handler)
+    monkeypatch.setattr(app_module, 'audit_store', store)
+    try:
+        with app.test_request_context('/'):
+            app_module.log_user_action('ADD_USER', 'admin', 'Added user: carol', target='carol')
+            app_module.log_user_action('LOGOUT', 'admin')
+    finally:
+        app_module.logger.removeHandler(handler)
+
+    with client.session_transaction() as sess:
+        sess['username'] = 'admin'
+    data = client.get('/api/audit?target=carol').get_json()
+    assert [(e['action'], e['actor'], e['details']) for e in data['events']] == [
+        ('ADD_USER', 'admin', 'Added user: carol')]
+    assert len(client.get('/api/audit?actor=admin&limit=1').get_json()['events']) == 1
+    assert client.get('/api/audit?since=yesterday').status_code == 400
+
+
+def test_metrics_histogram_is_exact_under_concurrency(monkeypatch):
+    """Concurrent observations are folded without losing any, and rendered cumulatively"""
+    registry = []
+    monkeypatch.setattr(app_module, 'metrics_registry', registry)
+    histogram = app_module.Histogram('test_seconds', 'test', ('route',), buckets=(0.1, 1.0))
+    counter = app_module.Counter('test_events', 'test', ('event',))
+
+    def work():
+        for index in range(5000):
+            histogram.observe(0.05 if index % 2 else 0.5, '/x')
+            counter.inc('a')
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert histogram.count('/x') == 40000
+    assert counter.value('a') == 40000
+    text = app_module.render_metrics()
+    assert 'zeppelin_user_mgmt_test_seconds_bucket{route="/x",le="0.1"} 20000' in text
+    assert 'zeppelin_user_mgmt_test_seconds_bucket{route="/x",le="+Inf"} 40000' in text
+    assert 'zeppelin_user_mgmt_test_events_total{event="a"} 40000' in text
+
+
+def test_run_timed_command_counts_timeouts():
+    before = app_module.SUBPROCESS_TIMEOUTS.value('sleep')
+    with pytest.raises(app_module.subprocess.TimeoutExpired):
+        app_module.run_timed_command('sleep', [sys.executable, '-c', 'import time; time.sleep(5)'], timeout=0.2)
+    assert app_module.SUBPROCESS_TIMEOUTS.value('sleep') == before + 1
+    assert app_module.SUBPROCESS_SECONDS.count('sleep') >= 1
+
+
+def test_metrics_endpoint(client, shiro_file, monkeypatch):
+    """/metrics exposes route and shiro.ini timings and honours METRICS_TOKEN"""
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'zeppelin_user_mgmt_http_request_duration_seconds_count{endpoint="/login",method="POST"}' in text
+    assert 'zeppelin_user_mgmt_shiro_read_duration_seconds_count{cache="miss"}' in text
+    assert 'zeppelin_user_mgmt_websocket_clients ' in text
+
+    monkeypatch.setattr(app_module, 'METRICS_TOKEN', 'secret')
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code == 200
+
+
+def test_benchmark_suite_smoke():
+    """The benchmark suite runs end to end on a tiny synthetic shiro.ini"""
+    import subprocess
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks',
+                          'run_benchmarks.py')
+    result = subprocess.run([sys.executable, script, '--sizes', '50', '--repeat', '2'],
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout)
+    metrics = report['results']['50']
+    for name in ('read_shiro_ini_cold', 'write_shiro_ini', 'login', 'dashboard', 'add_user', 'delete_user'):
+        assert metrics[name]['iterations'] == 2
+
+
+def test_loadtest_harness_smoke():
+    """The load-test harness drives HTTP operators and WebSocket clients against the fake backend"""
+    import subprocess
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'loadtest.py')
+    result = subprocess.run([sys.executable, script, '--operators', '2', '--ws-clients', '2', '--duration', '1',
+                             '--users', '20', '--probe-latency', '0.01', '--command-latency', '0.01'],
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout)
+    assert report['operations']['login']['errors'] == 0
+    assert report['operations']['ws_status_request']['iterations'] > 0
+    assert report['ws_events_received']['connected'] == 2
+
+
+def test_api_users_filters_sorts_and_pages(client, shiro_file):
+    """/api/users filters by substring, role and status, and pages sorted results"""
+    shiro_file.write_text(SAMPLE_SHIRO_INI.replace('bob = bobpass\n', 'bob = bobpass\nAlina = pw, role2\n'),
+                          encoding='utf-8')
+    with client.session_transaction() as sess:
+        sess['username'] = 'admin'
+
+    data = client.get('/api/users').get_json()
+    assert data['total'] == 4
+    assert [user['username'] for user in data['users']] == ['admin', 'alice', 'Alina', 'bob']
+    assert data['users'][0] == {'username': 'admin', 'roles': [], 'protected': True}
+
+    data = client.get('/api/users?q=ALI&limit=1&offset=1').get_json()
+    assert data['total'] == 2 and [user['username'] for user in data['users']] == ['Alina']
+    data = client.get('/api/users?role=role2&sort=-name').get_json()
+    assert [(user['username'], user['roles']) for user in data['users']] == [
+        ('Alina', ['role2']), ('alice', ['role1', 'role2'])]
+    data = client.get('/api/users?status=normal&sort=file').get_json()
+    assert [user['username'] for user in data['users']] == ['alice', 'bob', 'Alina']
+    assert client.get('/api/users?limit=abc').status_code == 400
+
+
+def test_dashboard_does_not_embed_user_list(client, shiro_file):
+    """The dashboard renders a constant-size shell; rows come from /api/users"""
+    with client.session_transaction() as sess:
+        sess['username'] = 'admin'
+    html = client.get('/dashboard').get_data(as_text=True)
+    assert 'id="userTotal">3<' in html
+    assert 'alice' not in html
+
+
+def test_realm_etag_conditional_responses(client, shiro_file, monkeypatch):
+    """ETag follows the realm version; a matching If-None-Match is answered with 304 without parsing"""
+    with client.session_transaction() as sess:
+        sess['username'] = 'admin'
+    status = {'status': 'running', 'status_class': 'success', 'status_text': 'Запущен', 'pid': '1'}
+    monkeypatch.setattr(app_module.status_cache, 'get', lambda **kwargs: dict(status))
+    first = client.get('/api/users?limit=2')
+    etag = first.headers['ETag']
+    assert first.status_code == 200 and etag.startswith('W/')
+    assert client.get('/api/users?limit=3').headers['ETag'] != etag
+
+    page = client.get('/dashboard')
+    assert page.status_code == 200
+    version = client.get('/api/version').get_json()['realm_version']
+
+    def fail_read(copy=True):
+        raise AssertionError('shiro.ini must not be parsed for a 304')
+
+    read_shiro_ini = app_module.read_shiro_ini
+    monkeypatch.setattr(app_module, 'read_shiro_ini', fail_read)
+    assert client.get('/api/users?limit=2', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/dashboard', headers={'If-None-Match': page.headers['ETag']}).status_code == 304
+    monkeypatch.setattr(app_module, 'read_shiro_ini', read_shiro_ini)
+
+    # Время проверки не меняет ETag простаивающей вкладки, отрисованные поля статуса - меняют
+    status.update(checked_at='2026-01-01T00:00:00', process={'cpu_seconds': 12.5})
+    assert client.get('/dashboard', headers={'If-None-Match': page.headers['ETag']}).status_code == 304
+    status.update(status='stopped', pid='N/A')
+    restated = client.get('/dashboard', headers={'If-None-Match': page.headers['ETag']})
+    assert restated.status_code == 200 and restated.headers['ETag'] != page.headers['ETag']
+
+    shiro_file.write_text(SAMPLE_SHIRO_INI.replace('bob = bobpass\n', ''), encoding='utf-8')
+    changed = client.get('/api/users?limit=2', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+    assert client.get('/api/version').get_json()['realm_version'] > version
+
+
+def test_compression_and_fingerprinted_static(client, shiro_file, monkeypatch):
+    """Large text responses are gzipped; fingerprinted static URLs are immutable; vendor assets are served locally"""
+    import gzip
+    monkeypatch.setattr(app_module, 'brotli', None)
+    with client.session_transaction() as sess:
+        sess['username'] = 'admin'
+    plain = client.get('/dashboard')
+    assert 'Content-Encoding' not in plain.headers
+    compressed = client.get('/dashboard', headers={'Accept-Encoding': 'gzip, br'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+    assert gzip.decompress(compressed.data) == plain.data
+
+    small = client.get('/api/users?limit=1', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+
+    with app.test_request_context():
+        url = app_module.url_for('static', filename='themes.css')
+        vendor = app_module.vendor_url('socket.io.js')
+        assert vendor.startswith('/static/vendor/socket.io.min.js?v=')
+        # CDN только по явному разрешению и только для отсутствующего файла
+        monkeypatch.setattr(app_module, 'VENDOR_ASSETS', {**app_module.VENDOR_ASSETS, 'missing.js': 'https://cdn/x.js'})
+        assert app_module.vendor_url('missing.js').startswith('/static/vendor/x.js')
+        monkeypatch.setattr(app_module, 'VENDOR_CDN_FALLBACK', True)
+        assert app_module.vendor_url('missing.js') == 'https://cdn/x.js'
+        assert app_module.vendor_url('socket.io.js') == vendor
+    assert '?v=' in url and url in plain.get_data(as_text=True)
+    assert 'https://' not in plain.get_data(as_text=True).split('<body', 1)[0]
+    assert client.get(vendor).status_code == 200
+    asset = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert 'immutable' in asset.headers['Cache-Control']
+    with open(os.path.join(app.static_folder, 'themes.css'), 'rb') as f:
+        assert gzip.decompress(asset.data) == f.read()
+    assert 'immutable' not in client.get('/static/themes.css?v=stale').headers.get('Cache-Control', '')
+
+
+def test_dashboard_fragment_cache_follows_realm(client, shiro_file, monkeypatch):
+    """Role lists are rendered once per realm version and re-rendered after shiro.ini changes"""
+    app_module.fragment_cache.clear()
+    hits, misses = app_module.fragment_cache.hits, app_module.fragment_cache.misses
+    with client.session_transaction() as sess:
+        sess['username'] = 'admin'
+    html = client.get('/dashboard').get_data(as_text=True)
+    assert html.count('<option value="role2">role2</option>') == 3
+
+    read_shiro_ini = app_module.read_shiro_ini
+    monkeypatch.setattr(app_module, 'read_shiro_ini', lambda copy=True: pytest.fail('fragment must come from cache'))
+    assert client.get('/dashboard').get_data(as_text=True).count('<option value="role2">role2</option>') == 3
+    monkeypatch.setattr(app_module, 'read_shiro_ini', read_shiro_ini)
+
+    shiro_file.write_text(SAMPLE_SHIRO_INI.replace('role2 = notebook:read\n', 'role2 = notebook:read\nrole3 = *\n'),
+                          encoding='utf-8')
+    html = client.get('/dashboard').get_data(as_text=True)
+    assert html.count('<option value="role3">role3</option>') == 3
+    assert app_module.fragment_cache.hits - hits == 1 and app_module.fragment_cache.misses - misses == 2
+
+
+def test_socketio_async_mode_is_validated():
+    """An unknown SOCKETIO_ASYNC_MODE fails at import instead of silently falling back"""
+    import subprocess
+    result = subprocess.run([sys.executable, '-c', 'import app'], capture_output=True, text=True, timeout=60,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            env={**os.environ, 'SOCKETIO_ASYNC_MODE': 'asyncio'})
+    assert result.returncode != 0 and 'SOCKETIO_ASYNC_MODE' in result.stderr
+    assert app_module.run_blocking(divmod, 7, 2) == (3, 1)
+
+
+def test_socketio_capacity_benchmark_smoke():
+    """The capacity benchmark connects raw WebSocket clients and measures broadcast delivery"""
+    import subprocess
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks',
+                          'socketio_capacity.py')
+    result = subprocess.run([sys.executable, script, '--modes', 'threading', '--clients', '5', '--broadcasts', '2',
+                             '--broadcast-interval', '0'], capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout)['results']['threading']['5']
+    assert report['connected'] == 5 and report['undelivered'] == 0
+    assert report['delivery']['iterations'] == 10
+
+
+WORKER_SCRIPT = """
+import sys
+import app
+app.shiro_ini_path = sys.argv[1]
+for index in range(int(sys.argv[3])):
+    with app.realm_lock:
+        users, roles, sections = app.read_shiro_ini()
+        users.set_user(f'{sys.argv[2]}_{index}', 'pw')
+        assert app.write_shiro_ini(users, roles, sections)
+"""
+
+
+def test_realm_lock_serializes_writers_across_processes(shiro_file, tmp_path):
+    """Concurrent read-modify-write cycles from several processes do not lose updates"""
+    import subprocess
+    script = tmp_path / 'worker.py'
+    script.write_text(WORKER_SCRIPT, encoding='utf-8')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    workers = [subprocess.Popen([sys.executable, str(script), str(shiro_file), f'w{index}', '15'], cwd=root,
+                                env={**os.environ, 'PYTHONPATH': root, 'AUDIT_DB_PATH': ''},
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) for index in range(3)]
+    for worker in workers:
+        assert worker.wait(timeout=120) == 0, worker.stderr.read().decode()
+    app_module.invalidate_shiro_cache()
+    users, _, _ = app_module.read_shiro_ini()
+    assert sum(1 for name in users if name.startswith('w')) == 45
+    assert (tmp_path / 'shiro.ini.lock').read_text() == '45'
+
+
+def test_realm_lock_recovers_from_flock_and_read_errors(shiro_file, monkeypatch):
+    """A failing flock or generation read releases the lock instead of wedging later writers"""
+    lock = app_module.RealmLock()
+    flock = app_module.fcntl.flock
+    open_fds = len(os.listdir('/proc/self/fd'))
+
+    def failing_flock(fd, operation):
+        if operation == app_module.fcntl.LOCK_EX:
+            raise OSError(errno.ENOLCK, 'No locks available')
+        return flock(fd, operation)
+
+    monkeypatch.setattr(app_module.fcntl, 'flock', failing_flock)
+    with pytest.raises(OSError):
+        with lock:
+            pass
+    monkeypatch.setattr(app_module.fcntl, 'flock', flock)
+    monkeypatch.setattr(lock, '_read_generation', lambda: (_ for _ in ()).throw(OSError(errno.EIO, 'I/O error')))
+    with pytest.raises(OSError):
+        with lock:
+            pass
+    monkeypatch.delattr(lock, '_read_generation')
+
+    assert not lock.held() and lock._fd is None and len(os.listdir('/proc/self/fd')) == open_fds
+    entered = []
+
+    def write_from_other_thread():
+        with lock:
+            entered.append(lock.held())
+
+    worker = threading.Thread(target=write_from_other_thread)
+    worker.start()
+    worker.join(5)
+    assert entered == [True]
+
+
+def test_unix_socket_bus_and_leader_election(tmp_path):
+    """The UNIX-socket bus fans messages out to other workers; exactly one worker leads"""
+    first = app_module.UnixSocketMessageBus(str(tmp_path / 'bus'), name='first')
+    second = app_module.UnixSocketMessageBus(str(tmp_path / 'bus'), name='second')
+    try:
+        received, local = [], []
+        second.subscribe('emit', received.append)
+        first.subscribe('emit', local.append)
+        stale = app_module.socket.socket(app_module.socket.AF_UNIX, app_module.socket.SOCK_DGRAM)
+        stale.bind(str(tmp_path / 'bus' / 'dead.sock'))
+        stale.close()
+
+        first.publish('emit', {'event': 'user_change', 'data': {'username': 'alice'}})
+        deadline = time.monotonic() + 5
+        while not received and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert received == local == [{'event': 'user_change', 'data': {'username': 'alice'}}]
+        assert not (tmp_path / 'bus' / 'dead.sock').exists()
+    finally:
+        first.close()
+        second.close()
+
+    leader = app_module.LeaderElection(str(tmp_path / 'leader.lock'))
+    follower = app_module.LeaderElection(str(tmp_path / 'leader.lock'))
+    assert leader.is_leader() and not follower.is_leader()
+    probes = []
+    publisher = app_module.StatusPublisher(lambda max_age: probes.append(max_age) or {'status': 'running'},
+                                           lambda status: None, leader=follower)
+    assert publisher.tick() is False and probes == []
+    leader.resign()
+    assert publisher.tick() is True and len(probes) == 1
+    follower.resign()
+
+
+def test_bus_publish_never_blocks_on_stuck_worker(tmp_path, shiro_file, monkeypatch):
+    """A worker that stops reading loses messages instead of stalling publishers; realm goes out after the lock"""
+    bus = app_module.UnixSocketMessageBus(str(tmp_path / 'bus'), name='first')
+    stuck = app_module.socket.socket(app_module.socket.AF_UNIX, app_module.socket.SOCK_DGRAM)
+    stuck.bind(str(tmp_path / 'bus' / 'stuck.sock'))
+    try:
+        finished = threading.Event()
+
+        def flood():
+            for index in range(5000):
+                bus.publish('emit', {'event': 'user_change', 'data': {'n': index, 'pad': 'x' * 1000}})
+            finished.set()
+
+        threading.Thread(target=flood, daemon=True).start()
+        assert finished.wait(10)
+        assert bus.dropped > 0
+    finally:
+        stuck.close()
+        bus.close()
+
+    published = []
+    monkeypatch.setattr(app_module.message_bus, 'publish',
+                        lambda channel, message: published.append((channel, app_module.realm_lock.held())))
+    with app_module.realm_lock:
+        users, roles, sections = app_module.read_shiro_ini()
+        users.set_user('carol', 'carolpass')
+        assert app_module.write_shiro_ini(users, roles, sections)
+        assert published == []
+    assert published == [('realm', False)]
+
+
+def test_shiro_watcher_diffs_and_attributes_changes(client, shiro_file):
+    """External edits and app writes become targeted user_change events, without passwords"""
+    events = []
+    watcher = app_module.ShiroWatcher(mode='poll', notify=lambda *args: events.append(args))
+    watcher.reset()
+    assert watcher.check() == []
+
+    shiro_file.write_text(SAMPLE_SHIRO_INI.replace('bob = bobpass\n', 'bob = newpass, role1\ncarol = c\n')
+                          .replace('alice = alicepass, role1, role2\n', '')
+                          .replace('role2 = notebook:read\n', 'role2 = notebook:read\nrole3 = *\n'),
+                          encoding='utf-8')
+    os.utime(shiro_file, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+    assert watcher.check() == [('update', 'bob', ('password', 'roles')), ('add', 'carol', ()),
+                               ('delete', 'alice', ())]
+    assert events[0] == ('roles', None, {'added': ['role3'], 'removed': [], 'changed': []}, 3, None, 'external')
+    assert events[1] == ('update', 'bob', {'roles': ['role1'], 'fields': ['password', 'roles']}, 3, None, 'external')
+    assert [event[:2] for event in events[2:]] == [('add', 'carol'), ('delete', 'alice')]
+    assert 'newpass' not in repr(events) and watcher.check() == []
+
+    app_module.shiro_watcher.expect, expect = watcher.expect, app_module.shiro_watcher.expect
+    try:
+        with client.session_transaction() as sess:
+            sess['username'] = 'admin'
+        client.post('/add_user', data={'username': 'dave', 'password': 'davepass1'})
+    finally:
+        app_module.shiro_watcher.expect = expect
+    del events[:]
+    assert watcher.check() == [('add', 'dave', ())]
+    assert events == [('add', 'dave', {'roles': [], 'fields': []}, 4, 'admin', 'app')]
+    assert watcher.changes == {'app': 1, 'external': 1}
+
+    # Массовые правки сворачиваются в одно сводное событие
+    watcher.max_events = 2
+    shiro_file.write_text(SAMPLE_SHIRO_INI.replace('bob = bobpass\n', 'x1 = a\nx2 = b\nx3 = c\n'), encoding='utf-8')
+    del events[:]
+    watcher.check()
+    assert events == [('roles', None, {'added': [], 'removed': ['role3'], 'changed': []}, 5, None, 'external'),
+                      ('bulk', None, {'add': 4, 'update': 0, 'delete': 3}, 5, None, 'external')]
+
+
+def test_shiro_watcher_debounces_editor_saves(shiro_file, monkeypatch):
+    """A burst of writes is processed once, by inotify where available and by polling otherwise"""
+    for mode in ('auto', 'poll'):
+        shiro_file.write_text(SAMPLE_SHIRO_INI, encoding='utf-8')
+        events = []
+        watcher = app_module.ShiroWatcher(mode=mode, debounce=0.2, poll_interval=0.05,
+                                          notify=lambda *args: events.append(args))
+        monkeypatch.setattr(app_module.socketio, 'start_background_task',
+                            lambda target: threading.Thread(target=target, daemon=True).start())
+        watcher.start()
+        try:
+            deadline = time.monotonic() + 5
+            while watcher._state is None and time.monotonic() < deadline:
+                time.sleep(0.01)
+            # Редактор: временный файл, переименование, дописывание
+            for index in range(5):
+                tmp = shiro_file.with_name('shiro.ini.swp')
+                tmp.write_text(SAMPLE_SHIRO_INI + ''.join(f'\n[users]\nu{n} = p\n' for n in range(index)),
+                               encoding='utf-8')
+                os.replace(tmp, shiro_file)
+                time.sleep(0.02)
+            with open(shiro_file, 'a', encoding='utf-8') as f:
+                f.write('eve = evepass\n')
+            deadline = time.monotonic() + 5
+            while not events and time.monotonic() < deadline:
+                time.sleep(0.02)
+            time.sleep(0.3)
+            backend = watcher.backend
+        finally:
+            watcher.stop()
+        assert backend == ('inotify' if mode == 'auto' and sys.platform.startswith('linux') else 'poll')
+        assert watcher.changes['external'] == 1
+        assert sorted(event[1] for event in events) == ['eve', 'u0', 'u1', 'u2', 'u3']
+